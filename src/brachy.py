@@ -12,6 +12,7 @@ Authors:
     Bram Pronk               I.B.Pronk@student.tudelft.nl
 """
 import argparse
+import json
 import os
 import sys
 import signal
@@ -23,8 +24,10 @@ from src.util import input_processing
 from src.util import logger
 # from src.util.saving import Saving
 import src.needle as needle
-from src.reset_arduino import func as reset_arduino
 from src.image_pos.image_proc2 import position_from_image
+from src.image_pos.batch_processing import process_batch
+from src.image_pos import benchmark
+from src.image_pos import calibration
 # TODO: import configparser and use it to update parameters
 
 # pylint: disable=unused-argument
@@ -57,6 +60,8 @@ PARSER_FESTO = SUBPARSERS.add_parser("FESTO", help="Control the FESTO linear sta
 PARSER_NEEDLE = SUBPARSERS.add_parser("NEEDLE", help="Control the movement of the needle")
 PARSER_POSITION = SUBPARSERS.add_parser("POSITION", help="Gain feedback on the position of the needle")
 PARSER_IMAGEPROC = SUBPARSERS.add_parser("IMAGEPROC", help="Test the image processing performance")
+PARSER_BENCHMARK = SUBPARSERS.add_parser("BENCHMARK", help="Time every stage of the image processing")
+PARSER_CALIBRATE = SUBPARSERS.add_parser("CALIBRATE", help="Calibrate a camera with photos of a chessboard")
 
 # Arguments for main module (Needle and Camera's)
 PARSER.add_argument("-init", action="store_true", help="Initializes Crouzet Stepper Motor positions.")
@@ -69,12 +74,20 @@ PARSER.add_argument("--startsteps", type=str, default="200", action="store",
 PARSER.add_argument("--sensitivity", type=str, default="0.1", action="store",
                     help="The sensitivity of the needle controls (between 0 and 1) ")
 PARSER.add_argument("--fps", action="store", type=int, default=1,
-                    help="The number of times (per second) the module should check for its position using camera's")
+                    help="The largest number of times (per second) the module should check for its position using "
+                         "camera's, 0 for as many as the image processing can keep up with")
 PARSER.add_argument("--camtop", action="store", type=str, default="https://192.168.43.1:8080/video",
                     help="The URL or path to the (live) video of the camera positioned above the needle")
 PARSER.add_argument("--camfront", action="store", type=str, default="",
                     help="The URL or path to the (live) video of the camera positioned in front of the needle")
 PARSER.add_argument("-nofeed", action="store_true", help="Should the camera feed be displayed on screen")
+PARSER.add_argument("--recorddir", action="store", type=str, default="",
+                    help="Write the processed camera frames with the detected lines to this directory")
+PARSER.add_argument("--session", action="store", type=str, default="",
+                    help="Record the processed and shown camera frames with their time to this session recording "
+                         "(.mjpg and .idx)")
+PARSER.add_argument("--detectors", action="store", type=int, default=1,
+                    help="Number of processes that detect the needle in the camera frames")
 
 
 # Parser for the NEEDLE command with all the options
@@ -83,6 +96,8 @@ PARSER_NEEDLE.add_argument("-invertx", action="store_true",
                            help="Invert x-axis values. Akin to switching between front and posterior perspective.")
 PARSER_NEEDLE.add_argument("--test", type=str, action="store", default="",
                            help= "Set this parameter if you want to run a test from the config.ini")
+PARSER_NEEDLE.add_argument("-dryrun", action="store_true",
+                           help="Only print the planned moves and estimated duration of the --test, without moving")
 PARSER_NEEDLE.add_argument("--comport", type=str, default="COM9", action="store",
                            help="The comport on which the Arduino is connected")
 PARSER_NEEDLE.add_argument("--startsteps", type=str, default="200", action="store",
@@ -98,6 +113,42 @@ PARSER_IMAGEPROC.add_argument("--imagepath", type=str, default="image_pos/photos
                            help="The path to the config file")
 PARSER_IMAGEPROC.add_argument("--filtering", type=str, default="no", action="store",
                            help="Use a 3x3 low-pass filter before edge processing")
+PARSER_IMAGEPROC.add_argument("--flip", type=str, default="no", action="store",
+                           help="Flip the images along the vertical axis before edge processing")
+PARSER_IMAGEPROC.add_argument("--batch", type=str, default="", action="store",
+                           help="Process all images of this directory (or all frames of this video file or "
+                                "--session recording) without showing them, instead of --imagepath")
+PARSER_IMAGEPROC.add_argument("--workers", type=int, default=0, action="store",
+                           help="The number of worker processes of --batch (default: one per core)")
+PARSER_IMAGEPROC.add_argument("--output", type=str, default="imageproc_results.csv", action="store",
+                           help="The file the --batch results are written to, a .csv or .npz file")
+
+# Parser for the BENCHMARK command with all the options
+PARSER_BENCHMARK.add_argument("--configpath", type=str, default="config.ini", action="store",
+                           help="The path to the config file")
+PARSER_BENCHMARK.add_argument("--repeats", type=int, default=30, action="store",
+                           help="The number of synthetic frames timed per resolution and noise level")
+PARSER_BENCHMARK.add_argument("--filtering", type=str, default="yes", action="store",
+                           help="Use a 3x3 low-pass filter before edge processing")
+PARSER_BENCHMARK.add_argument("--tracking", type=str, default="no", action="store",
+                           help="Process only a window around the last tip, as the camera process does with tracking")
+PARSER_BENCHMARK.add_argument("--baseline", type=str, default="", action="store",
+                           help="Compare the results with this JSON file of an earlier run")
+PARSER_BENCHMARK.add_argument("--save", type=str, default="", action="store",
+                           help="Save the results as JSON to this file, to be used as --baseline later")
+
+# Parser for the CALIBRATE command with all the options
+PARSER_CALIBRATE.add_argument("--images", type=str, default="calibration/top", action="store",
+                           help="The directory with photos of the chessboard in different positions")
+PARSER_CALIBRATE.add_argument("--plane", type=str, default="", action="store",
+                           help="The photo of the chessboard lying on the needle plane (default: the first photo)")
+PARSER_CALIBRATE.add_argument("--pattern", type=str, default="9x6", action="store",
+                           help="The number of inner corners of the chessboard, as columns x rows")
+PARSER_CALIBRATE.add_argument("--square", type=float, default=5.0, action="store",
+                           help="The size of a chessboard square in millimetres")
+PARSER_CALIBRATE.add_argument("--output", type=str, default="calibration/top.npz", action="store",
+                           help="The calibration file, to be set as top_calibration or front_calibration in "
+                                "config.ini")
 
 
 def main() -> None:
@@ -116,6 +167,10 @@ def main() -> None:
         needle_movement(parser)
     elif subparser == "IMAGEPROC":
         image_proc(parser)
+    elif subparser == "BENCHMARK":
+        image_benchmark(parser)
+    elif subparser == "CALIBRATE":
+        camera_calibration(parser)
     else:
         if len(sys.argv) <= 1: # No optional arguments given --> print help
             PARSER.print_help()
@@ -126,13 +181,17 @@ def brachy_therapy(args: argparse.Namespace) -> None:
     """
     Handler for positional feedback using image acquisition & processing
     """
+    # Create Needle object
+    board_controller = needle.Needle(args.comport, args.startsteps, args.sensitivity,
+                                     getattr(args, "invertx", False), "")
     if args.init:
-        reset_arduino(args.comport, args.startsteps)
+        board_controller.home()
+        board_controller.close()
     else:
+        if board_controller.needs_homing:
+            board_controller.home()
         logger.success("Starting Brachy Therapy.\n")
 
-        # Create Needle object
-        board_controller = needle.Needle(args.comport, args.startsteps, args.sensitivity, args.invertx)
         # Call its movement function
         if args.manual:
             logger.info("Input type is MANUAL.")
@@ -146,10 +205,14 @@ def needle_movement(args: argparse.Namespace) -> None:
     Handler for main purpose of program
     """
     # Create Needle object
-    board_controller = needle.Needle(args.comport, args.startsteps, args.sensitivity, args.invertx, args.test)
+    board_controller = needle.Needle(args.comport, args.startsteps, args.sensitivity, args.invertx, args.test,
+                                     args.dryrun)
     if args.init:
-        board_controller.initial_position()
+        board_controller.home()
+        board_controller.close()
     else:
+        if board_controller.needs_homing and not args.dryrun:
+            board_controller.home()
         # Call its movement function
         board_controller.move_freely()
 
@@ -157,9 +220,13 @@ def needle_movement(args: argparse.Namespace) -> None:
 def image_proc(args: argparse.Namespace) -> None:
     """"
     Handler for testing image processing
-    useful for testing new functions on a single image
+    useful for testing new functions on a single image, or for reprocessing recordings with --batch
     """
-    tip_position, tip_ori = position_from_image(args.imagepath, args.configpath, filtering=args.filtering, show='yes')
+    if args.batch:
+        process_batch(args.batch, args.output, args.configpath, args.flip, args.filtering, args.workers or None)
+        return
+    tip_position, tip_ori = position_from_image(args.imagepath, args.configpath, args.flip, args.filtering,
+                                                show='yes')
     print("brachy.py: tip_position is: ", tip_position)
     print("brachy.py: tip orientation is: ", tip_ori)
 
@@ -169,5 +236,36 @@ def image_proc(args: argparse.Namespace) -> None:
     # route_check(args.imagepath, tip_pos, tip_ori)  gives a recommendation to move
 
 
+def image_benchmark(args: argparse.Namespace) -> None:
+    """
+    Handler for timing the stages of NeedleDetector.detect on synthetic frames,
+    exits with status 1 when a stage is slower than in the --baseline
+    """
+    results = benchmark.run_benchmark(args.configpath, filtering=args.filtering, tracking=args.tracking,
+                                      repeats=args.repeats)
+    benchmark.report(results)
+    if args.save:
+        benchmark.save_results(results, args.save)
+        logger.success("Benchmark results saved to {}".format(args.save))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = benchmark.compare_to_baseline(results, json.load(baseline_file))
+        for regression in regressions:
+            logger.error("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
+        logger.success("No regressions compared to {}".format(args.baseline))
+
+
+def camera_calibration(args: argparse.Namespace) -> None:
+    """
+    Handler for calibrating the lens and the needle plane of a camera, writes the calibration file
+    """
+    pattern_size = tuple(int(value) for value in args.pattern.lower().split("x"))
+    result = calibration.calibrate_directory(args.images, args.plane, pattern_size, args.square)
+    result.save(args.output)
+    logger.success("Calibration saved to {} (reprojection error {:.2f} pixels)".format(args.output, result.rms))
+
+
 if __name__ == '__main__':
     main()
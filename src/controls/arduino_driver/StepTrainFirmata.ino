@@ -0,0 +1,199 @@
+/*
+    Name: StepTrainFirmata.ino
+    Desc: Firmata firmware for the needle Arduino that generates the step pulses of the stepper motors
+          on the board itself. The host sends one SysEx command per move instead of two pin writes per step.
+    Note: Digital port writes and pin modes are handled like SimpleDigitalFirmata, so the regular
+          pyfirmata pin.write() keeps working. See src/controls/step_train.py for the host side.
+
+    SysEx commands (user defined range of the Firmata protocol), multi-byte values are 7-bit, LSB first:
+      STEP_TRAIN_CONFIG 0x01   host -> board: motor, dirpin, steppin   (echoed back as acknowledgement)
+      STEP_TRAIN        0x02   host -> board: motor, direction, steps (3 bytes), period in us (4 bytes),
+                                              start period in us (4 bytes), ramp steps (3 bytes), ramp shape
+      STEP_TRAIN_DONE   0x03   board -> host: motor, steps done (3 bytes)
+      STEP_TRAIN_STOP   0x04   host -> board: motor   (decelerates and stops the train, then sends STEP_TRAIN_DONE)
+
+    The ramp is the same as in src/controls/motion_profile.py: at r steps from the nearest end of the train
+    (r < ramp steps) the rate is sqrt(v0^2 + (v^2 - v0^2) * r / ramp) for a trapezoid, or
+    v0 + (v - v0) * (1 - cos(pi * r / ramp)) / 2 for an S-curve, with v0 the start rate and v the cruise rate.
+*/
+#include <Firmata.h>
+#include <math.h>
+
+#define STEP_TRAIN_CONFIG 0x01
+#define STEP_TRAIN        0x02
+#define STEP_TRAIN_DONE   0x03
+#define STEP_TRAIN_STOP   0x04
+#define MAX_MOTORS        4
+#define SCURVE            1
+
+struct Train {
+  byte dirPin;
+  byte stepPin;
+  bool configured;
+  bool active;
+  bool level;
+  byte shape;
+  unsigned long steps;
+  unsigned long remaining;
+  unsigned long done;
+  unsigned long rampSteps;
+  float startRate;            // steps/s
+  float cruiseRate;           // steps/s
+  unsigned long halfPeriod;   // us, of the current step
+  unsigned long lastEdge;     // us
+};
+
+Train trains[MAX_MOTORS];
+byte previousPORT[TOTAL_PORTS];
+
+unsigned long unpack7bit(byte *argv, byte count)
+{
+  unsigned long value = 0;
+  for (byte i = 0; i < count; i++) {
+    value |= ((unsigned long) (argv[i] & 0x7F)) << (7 * i);
+  }
+  return value;
+}
+
+unsigned long halfPeriodOf(Train *train)
+{
+  unsigned long fromEnd = train->steps - 1 - train->done;
+  unsigned long rampPos = train->done < fromEnd ? train->done : fromEnd;
+  float rate = train->cruiseRate;
+  if (rampPos < train->rampSteps) {
+    float fraction = (float) rampPos / train->rampSteps;
+    if (train->shape == SCURVE) {
+      rate = train->startRate + (train->cruiseRate - train->startRate) * (1 - cos(M_PI * fraction)) / 2;
+    } else {
+      rate = sqrt(train->startRate * train->startRate +
+                  (train->cruiseRate * train->cruiseRate - train->startRate * train->startRate) * fraction);
+    }
+  }
+  return (unsigned long) (500000.0 / rate);
+}
+
+void stopTrain(Train *train)
+{
+  // shorten the train so that it ends with the deceleration ramp from the current rate
+  unsigned long fromEnd = train->steps - 1 - train->done;
+  unsigned long rampPos = train->done < train->rampSteps ? train->done : train->rampSteps;
+  if (rampPos < fromEnd) {
+    train->steps = train->done + rampPos + 1;
+    train->remaining = train->steps - train->done;
+  }
+}
+
+void sendDone(byte motor)
+{
+  byte data[4];
+  data[0] = motor;
+  data[1] = trains[motor].done & 0x7F;
+  data[2] = (trains[motor].done >> 7) & 0x7F;
+  data[3] = (trains[motor].done >> 14) & 0x7F;
+  Firmata.sendSysex(STEP_TRAIN_DONE, 4, data);
+}
+
+void digitalWriteCallback(byte port, int value)
+{
+  byte i;
+  byte currentPinValue, previousPinValue;
+
+  if (port < TOTAL_PORTS && value != previousPORT[port]) {
+    for (i = 0; i < 8; i++) {
+      currentPinValue = (byte) value & (1 << i);
+      previousPinValue = previousPORT[port] & (1 << i);
+      if (currentPinValue != previousPinValue) {
+        digitalWrite(i + (port * 8), currentPinValue);
+      }
+    }
+    previousPORT[port] = value;
+  }
+}
+
+void setPinModeCallback(byte pin, int mode)
+{
+  if (IS_PIN_DIGITAL(pin)) {
+    pinMode(PIN_TO_DIGITAL(pin), mode);
+  }
+}
+
+void sysexCallback(byte command, byte argc, byte *argv)
+{
+  byte motor;
+  switch (command) {
+    case STEP_TRAIN_CONFIG:
+      if (argc < 3 || argv[0] >= MAX_MOTORS) return;
+      motor = argv[0];
+      trains[motor].dirPin = argv[1];
+      trains[motor].stepPin = argv[2];
+      trains[motor].configured = true;
+      trains[motor].active = false;
+      pinMode(trains[motor].dirPin, OUTPUT);
+      pinMode(trains[motor].stepPin, OUTPUT);
+      Firmata.sendSysex(STEP_TRAIN_CONFIG, 3, argv);
+      break;
+
+    case STEP_TRAIN:
+      if (argc < 17 || argv[0] >= MAX_MOTORS || !trains[argv[0]].configured) return;
+      motor = argv[0];
+      digitalWrite(trains[motor].dirPin, argv[1] ? HIGH : LOW);
+      trains[motor].steps = unpack7bit(argv + 2, 3);
+      trains[motor].remaining = trains[motor].steps;
+      trains[motor].cruiseRate = 1e6 / unpack7bit(argv + 5, 4);
+      trains[motor].startRate = 1e6 / unpack7bit(argv + 9, 4);
+      trains[motor].rampSteps = unpack7bit(argv + 13, 3);
+      trains[motor].shape = argv[16];
+      trains[motor].done = 0;
+      trains[motor].level = false;
+      trains[motor].halfPeriod = halfPeriodOf(&trains[motor]);
+      trains[motor].lastEdge = micros() - trains[motor].halfPeriod;
+      trains[motor].active = trains[motor].remaining > 0;
+      if (!trains[motor].active) sendDone(motor);
+      break;
+
+    case STEP_TRAIN_STOP:
+      if (argc < 1 || argv[0] >= MAX_MOTORS || !trains[argv[0]].active) return;
+      stopTrain(&trains[argv[0]]);
+      break;
+  }
+}
+
+void runTrains()
+{
+  unsigned long now = micros();
+  for (byte motor = 0; motor < MAX_MOTORS; motor++) {
+    Train *train = &trains[motor];
+    if (!train->active || now - train->lastEdge < train->halfPeriod) continue;
+
+    train->lastEdge += train->halfPeriod;
+    train->level = !train->level;
+    digitalWrite(train->stepPin, train->level ? HIGH : LOW);
+    if (!train->level) {  // a falling edge completes a step
+      train->done++;
+      train->remaining--;
+      if (train->remaining == 0) {
+        train->active = false;
+        sendDone(motor);
+      } else {
+        train->halfPeriod = halfPeriodOf(train);
+      }
+    }
+  }
+}
+
+void setup()
+{
+  Firmata.setFirmwareVersion(FIRMATA_FIRMWARE_MAJOR_VERSION, FIRMATA_FIRMWARE_MINOR_VERSION);
+  Firmata.attach(DIGITAL_MESSAGE, digitalWriteCallback);
+  Firmata.attach(SET_PIN_MODE, setPinModeCallback);
+  Firmata.attach(START_SYSEX, sysexCallback);
+  Firmata.begin(57600);
+}
+
+void loop()
+{
+  while (Firmata.available()) {
+    Firmata.processInput();
+  }
+  runTrains();
+}
@@ -0,0 +1,82 @@
+"""
+Module for homing the stepper motors: driving all of them to their zero position and then to the start position.
+
+The motors have no end switches, so homing drives them backwards over their full travel until they are against
+their mechanical end. All motors move at the same time, first with a fast approach and then with a short slow
+final approach, so they touch the end at a rate that is safe. Afterwards all motors move forwards to startsteps.
+
+The settings are read from the [HOMING] section of config.ini.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import src.util.logger as logger
+from src.controls.motion_profile import MotionProfile
+
+
+class HomingSettings:
+    """
+    Settings of the homing routine.
+
+    Attributes
+    ----------
+    travel_steps : int
+        Number of steps that is certainly enough to reach the end from any position
+    final_steps : int
+        Number of steps of the slow final approach
+    approach_rate, final_rate : float
+        Step rates (steps/s) of the fast approach and of the final approach
+    acceleration : float
+        Acceleration (steps/s^2) of the fast approach
+    """
+
+    def __init__(self, travel_steps=822, final_steps=40, approach_rate=200.0, final_rate=50.0, acceleration=400.0):
+        self.travel_steps = int(travel_steps)
+        self.final_steps = min(int(final_steps), self.travel_steps)
+        self.approach_rate = float(approach_rate)
+        self.final_rate = float(final_rate)
+        self.acceleration = float(acceleration)
+
+    @classmethod
+    def from_config(cls, config_object):
+        """
+        Reads the settings from the [HOMING] section of a ConfigParser, missing values keep their defaults
+        """
+        if not config_object.has_section("HOMING"):
+            return cls()
+        homing = config_object["HOMING"]
+        defaults = cls()
+        return cls(homing.getint("travel_steps", defaults.travel_steps),
+                   homing.getint("final_steps", defaults.final_steps),
+                   homing.getfloat("approach_rate", defaults.approach_rate),
+                   homing.getfloat("final_rate", defaults.final_rate),
+                   homing.getfloat("acceleration", defaults.acceleration))
+
+
+def home_motors(scheduler, settings: HomingSettings, startsteps: int) -> float:
+    """
+    Homes all motors of the scheduler at the same time and moves them to startsteps.
+    Returns the total homing time in seconds.
+    """
+    start = scheduler.clock.monotonic()
+    nr_of_motors = len(scheduler.motors)
+    approach = MotionProfile(settings.final_rate, settings.approach_rate, settings.acceleration)
+    final = MotionProfile(settings.final_rate)
+    approach_deltas = [-(settings.travel_steps - settings.final_steps)] * nr_of_motors
+    final_deltas = [-settings.final_steps] * nr_of_motors
+    mid_deltas = [startsteps] * nr_of_motors
+
+    planned = (scheduler.duration(approach_deltas, approach) + scheduler.duration(final_deltas, final)
+               + scheduler.duration(mid_deltas))
+    logger.info("HOMING: all motors to zero, then to {} steps (planned {:.1f} s)".format(startsteps, planned))
+
+    scheduler.move(approach_deltas, profile=approach)
+    scheduler.move(final_deltas, profile=final)
+    for motor in scheduler.motors:
+        motor.stepcounter = 0
+    logger.info("HOMING: at zero after {:.1f} s".format(scheduler.clock.monotonic() - start))
+
+    scheduler.move(mid_deltas)
+    elapsed = scheduler.clock.monotonic() - start
+    logger.success("HOMING: ready at {} steps, homing took {:.1f} s".format(startsteps, elapsed))
+    return elapsed
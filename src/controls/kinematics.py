@@ -0,0 +1,133 @@
+"""
+Module for the inverse kinematics of the needle: from a requested (x, y) displacement to steps per motor.
+
+Every direction (0..7, see controller.Direction) has two push motors and two pull motors (one of each for the
+diagonal directions). The displacement is written as a linear combination of the motor vectors of those motors,
+and since there are only 8 directions the (pseudo-)inverse matrices are constant. They are computed once here and
+a whole batch of Output (GDO) objects is turned into per-motor step deltas with a single vectorized product.
+"""
+import numpy as np
+
+# motors that pull (run backward) and push (run forward) for each direction
+DIRPULL = {
+    0: [0, 1],
+    1: [0],
+    2: [0, 3],
+    3: [3],
+    4: [2, 3],
+    5: [2],
+    6: [1, 2],
+    7: [1],
+}
+
+DIRPUSH = {
+    0: [2, 3],
+    1: [2],
+    2: [1, 2],
+    3: [1],
+    4: [0, 1],
+    5: [0],
+    6: [0, 3],
+    7: [3],
+}
+
+# motor vectors that code for the directions in the x-y space of the needle
+MOTORVEC = {
+    0: np.array([1, 1]),
+    1: np.array([-1, 1]),
+    2: np.array([-1, -1]),
+    3: np.array([1, -1]),
+}
+
+NR_OF_DIRECTIONS = 8
+
+
+def inverse_table(dirmotors: dict, nr_of_motors=4) -> np.ndarray:
+    """
+    Returns an array of shape (8, nr_of_motors, 2): for direction d, table[d] @ (x, y) gives the number of steps
+    of every motor of dirmotors[d] (zero for the other motors) such that the motor vectors add up to (x, y).
+    Directions with a single motor use the pseudo-inverse, i.e. the projection on its motor vector.
+    """
+    table = np.zeros((NR_OF_DIRECTIONS, nr_of_motors, 2))
+    for direction in range(NR_OF_DIRECTIONS):
+        motors = dirmotors[direction]
+        matrix = np.array([MOTORVEC[motor] for motor in motors], dtype=float).transpose()
+        table[direction, motors, :] = np.linalg.pinv(matrix)
+    return table
+
+
+class MovePlanner:
+    """
+    Turns GDOs into step deltas per motor (push > 0, pull < 0) with the precomputed inverse tables.
+
+    Attributes
+    ----------
+    sensitivity : float
+        Factor between the GDO stepsout and the displacement in steps
+    lower_limit, upper_limit : int
+        Range of the step counters of the motors
+    """
+
+    def __init__(self, sensitivity: float, nr_of_motors=4, lower_limit=0, upper_limit=400) -> None:
+        self.sensitivity = sensitivity
+        self.nr_of_motors = nr_of_motors
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.push_table = inverse_table(DIRPUSH, nr_of_motors)
+        self.pull_table = inverse_table(DIRPULL, nr_of_motors)
+
+    def candidates(self, gdos) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Returns (push deltas, pull deltas, valid) for a list of GDOs, the deltas as int arrays of shape (N, motors).
+        GDOs without a needle direction (NULL, init, FESTO, ...) are not valid and get zero deltas.
+        """
+        directions = np.array([gdo.direction for gdo in gdos], dtype=int).reshape(-1)
+        valid = (directions >= 0) & (directions < NR_OF_DIRECTIONS)
+        safe_directions = np.where(valid, directions, 0)
+        stepsout = np.array([gdo.stepsout[:2] for gdo in gdos], dtype=float).reshape(-1, 2)
+        displacement = np.trunc(stepsout * self.sensitivity)
+
+        push = np.einsum('nmk,nk->nm', self.push_table[safe_directions], displacement)
+        pull = np.einsum('nmk,nk->nm', self.pull_table[safe_directions], displacement)
+        # the number of steps is the truncated absolute value, the small margin absorbs rounding of the inverse
+        push = np.floor(np.abs(push) + 1e-9).astype(int) * valid[:, None]
+        pull = -np.floor(np.abs(pull) + 1e-9).astype(int) * valid[:, None]
+        return push, pull, valid
+
+    def within_limits(self, counts, deltas) -> np.ndarray:
+        """
+        Checks a batch of consecutive moves starting from counts, returns per move whether all motors stay in range
+        """
+        positions = np.asarray(counts, dtype=int) + np.cumsum(np.atleast_2d(deltas), axis=0)
+        return np.all((positions >= self.lower_limit) & (positions <= self.upper_limit), axis=1)
+
+    def plan_batch(self, gdos, counts) -> (np.ndarray, np.ndarray):
+        """
+        Plans a batch of consecutive GDOs starting from the step counters counts.
+        Every move pushes if the push motors stay within the limits, otherwise it pulls, otherwise it is skipped.
+        Returns (deltas of shape (N, motors), feasible of shape (N,)), infeasible moves have zero deltas.
+        """
+        push, pull, valid = self.candidates(gdos)
+        position = np.array(counts, dtype=int)
+        deltas = np.zeros_like(push)
+        feasible = np.zeros(len(push), dtype=bool)
+        # the choice between push and pull depends on the positions after the previous moves, so it is sequential
+        for move in np.flatnonzero(valid):
+            for option in (push[move], pull[move]):
+                new_position = position + option
+                in_range = (new_position >= self.lower_limit) & (new_position <= self.upper_limit)
+                if np.all(in_range | (option == 0)):
+                    deltas[move] = option
+                    feasible[move] = True
+                    position = new_position
+                    break
+        return deltas, feasible
+
+    def plan(self, gdo, counts):
+        """
+        Plans a single GDO, returns the list of deltas or None if neither pushing nor pulling is possible
+        """
+        deltas, feasible = self.plan_batch([gdo], counts)
+        if not feasible[0]:
+            return None
+        return deltas[0].tolist()
@@ -0,0 +1,161 @@
+"""
+Module for executing needle moves in a background thread.
+
+The main program loop submits commands and immediately continues handling pygame events and tip positions.
+Only the newest command is kept: a command that arrives while the needle is moving preempts the move in progress,
+which then decelerates and stops at a step boundary. Depending on the merge setting, the steps that were not done
+are either dropped (the stale joystick command is cancelled) or added to the new command.
+
+A command is a plan function that returns the step deltas per motor (or None when the move is not possible).
+The plan is only evaluated when the executor starts the command, so it always sees the current step counters.
+Because the executor thread is the only one moving the motors, the step counters stay consistent.
+"""
+import threading
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import src.util.logger as logger
+
+
+class MotionCommand:
+    """
+    A move waiting for the executor.
+
+    Attributes
+    ----------
+    plan : callable
+        Function without arguments that returns the list of step deltas per motor, or None
+    name : str
+        Description of the command used in the log
+    """
+
+    def __init__(self, plan, name="") -> None:
+        self.plan = plan
+        self.name = name
+
+
+class MotionExecutor:
+    """
+    Background thread that executes MotionCommands with a StepScheduler.
+
+    Attributes
+    ----------
+    scheduler : StepScheduler
+        Scheduler that moves the motors, its motors list is used to check the 0..400 limits
+    merge : bool
+        If True the steps not done by a preempted move are added to the next command, otherwise they are dropped
+    """
+
+    def __init__(self, scheduler, merge=False, lower_limit=0, upper_limit=400) -> None:
+        self.scheduler = scheduler
+        self.merge = merge
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.is_running = False
+        self.busy = False
+        self._pending = None
+        self._leftover = None
+        self._condition = threading.Condition()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Starts the executor thread
+        """
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run, name="MotionExecutor_thread", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the move in progress at a step boundary, drops the pending command and ends the executor thread
+        """
+        with self._condition:
+            self.is_running = False
+            self._pending = None
+            self._cancel.set()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, plan, name="") -> None:
+        """
+        Queues a command, replacing any command that has not started yet and preempting the move in progress
+        """
+        with self._condition:
+            if self._pending is not None:
+                logger.info("MOTION_EXECUTOR: dropping stale command {}".format(self._pending.name))
+            self._pending = MotionCommand(plan, name)
+            if self.busy:
+                self._cancel.set()
+            self._condition.notify_all()
+
+    def cancel(self) -> None:
+        """
+        Drops the pending command and stops the move in progress at a step boundary
+        """
+        with self._condition:
+            self._pending = None
+            if self.busy:
+                self._cancel.set()
+
+    def wait_idle(self, timeout=None) -> bool:
+        """
+        Blocks until no command is pending or running, returns False on a timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self.busy, timeout)
+
+    def _within_limits(self, deltas) -> bool:
+        for motor, delta in zip(self.scheduler.motors, deltas):
+            if not self.lower_limit <= motor.get_count() + delta <= self.upper_limit:
+                return False
+        return True
+
+    def _next_deltas(self, command):
+        """
+        Evaluates the plan of a command and merges the steps left over from a preempted move into it
+        """
+        deltas = command.plan()
+        leftover, self._leftover = self._leftover, None
+        if deltas is None:
+            return None
+        if self.merge and leftover is not None:
+            merged = [delta + rest for delta, rest in zip(deltas, leftover)]
+            if self._within_limits(merged):
+                return merged
+            logger.info("MOTION_EXECUTOR: merged move exceeds the motor limits, dropping the preempted steps")
+        return deltas
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or not self.is_running)
+                if not self.is_running:
+                    break
+                command, self._pending = self._pending, None
+                self.busy = True
+                self._cancel.clear()
+
+            try:
+                deltas = self._next_deltas(command)
+                if deltas is not None:
+                    done = self.scheduler.move(deltas, cancel=self._cancel)
+                    if self._cancel.is_set():
+                        with self._condition:
+                            if self.merge and self._pending is not None:
+                                self._leftover = [delta - step for delta, step in zip(deltas, done)]
+                        logger.info("MOTION_EXECUTOR: {} preempted after {} of {} steps".format(
+                            command.name, done, deltas))
+            except Exception as error:  # pylint: disable=broad-except
+                # a failing plan or move must not end the thread, later commands would wait forever
+                logger.error("MOTION_EXECUTOR: {} failed: {!r}, dropping the pending command".format(
+                    command.name, error))
+                with self._condition:
+                    self._pending = None
+                    self._leftover = None
+            finally:
+                with self._condition:
+                    self.busy = False
+                    self._condition.notify_all()
@@ -0,0 +1,114 @@
+"""
+Module for the acceleration profiles of the stepper motors.
+
+A motor starts every move at start_rate (a rate that is safe from standstill), accelerates to at most max_rate,
+cruises, and decelerates back to start_rate before the last step. The ramp is either trapezoidal (constant
+acceleration) or an S-curve (smooth cosine shaped acceleration). Short moves never reach max_rate: they accelerate
+for the first half of the move and decelerate for the second half.
+
+The profiles are configured in config.ini: the [MOTION] section holds the defaults for all motors and a [MOTORi]
+section may override any of them for motor i. The exact same ramp formula is used by the board firmware
+(arduino_driver/StepTrainFirmata.ino), so the durations reported here also hold for step trains.
+"""
+import math
+
+TRAPEZOID = 0
+SCURVE = 1
+SHAPES = {"trapezoid": TRAPEZOID, "scurve": SCURVE}
+
+
+def ramp_rate(ramp_pos: int, ramp_steps: int, start_rate: float, peak_rate: float, shape: int) -> float:
+    """
+    Step rate (steps/s) at ramp_pos steps from the nearest end of a move with a ramp of ramp_steps steps
+    """
+    if ramp_pos >= ramp_steps:
+        return peak_rate
+    fraction = ramp_pos / ramp_steps
+    if shape == SCURVE:
+        return start_rate + (peak_rate - start_rate) * (1 - math.cos(math.pi * fraction)) / 2
+    # trapezoid: constant acceleration, so the squared rate grows linearly with the distance
+    return math.sqrt(start_rate ** 2 + (peak_rate ** 2 - start_rate ** 2) * fraction)
+
+
+def train_intervals(steps: int, peak_rate: float, start_rate: float, ramp_steps: int, shape: int) -> list:
+    """
+    Time in seconds between consecutive steps of a move of steps steps
+    """
+    intervals = []
+    for step in range(steps):
+        ramp_pos = min(step, steps - 1 - step)
+        intervals.append(1 / ramp_rate(ramp_pos, ramp_steps, start_rate, peak_rate, shape))
+    return intervals
+
+
+class MotionProfile:
+    """
+    Acceleration, cruise and deceleration profile of a single motor.
+
+    Attributes
+    ----------
+    start_rate : float
+        Rate (steps/s) of the first and last step of a move, safe for a cold start
+    max_rate : float
+        Highest rate (steps/s) the motor is driven at without losing steps
+    acceleration : float
+        Acceleration in steps/s^2, 0 disables ramping and keeps every move at start_rate
+    shape : int
+        TRAPEZOID or SCURVE
+    """
+
+    def __init__(self, start_rate=50.0, max_rate=50.0, acceleration=0.0, shape=TRAPEZOID) -> None:
+        self.start_rate = float(start_rate)
+        self.max_rate = max(float(max_rate), self.start_rate)
+        self.acceleration = float(acceleration)
+        self.shape = shape
+
+    def __str__(self) -> str:
+        return "{:.0f} -> {:.0f} steps/s at {:.0f} steps/s^2 ({})".format(
+            self.start_rate, self.max_rate, self.acceleration, "scurve" if self.shape == SCURVE else "trapezoid")
+
+    def ramp(self, steps: int) -> (float, int):
+        """
+        Returns (peak rate, number of ramp steps) of a move of steps steps
+        """
+        if self.acceleration <= 0 or self.max_rate <= self.start_rate:
+            return self.start_rate, 0
+        full_ramp = math.ceil((self.max_rate ** 2 - self.start_rate ** 2) / (2 * self.acceleration))
+        ramp_steps = min(full_ramp, steps // 2)
+        if ramp_steps == full_ramp:
+            return self.max_rate, ramp_steps
+        return math.sqrt(self.start_rate ** 2 + 2 * self.acceleration * ramp_steps), ramp_steps
+
+    def intervals(self, steps: int) -> list:
+        """
+        Time in seconds between consecutive steps of a move of steps steps
+        """
+        peak_rate, ramp_steps = self.ramp(steps)
+        return train_intervals(steps, peak_rate, self.start_rate, ramp_steps, self.shape)
+
+    def duration(self, steps: int) -> float:
+        """
+        Time in seconds a move of steps steps takes, known before the move is started
+        """
+        return sum(self.intervals(abs(int(steps))))
+
+    def scaled_train(self, steps: int, lead_steps: int) -> (float, float, int):
+        """
+        Step-train parameters (cruise period, start period, ramp steps) for a motor doing steps steps in the same
+        time as a motor with this profile needs for lead_steps steps. Used to let several motors finish together.
+        """
+        peak_rate, ramp_steps = self.ramp(lead_steps)
+        ratio = steps / lead_steps
+        return 1 / (peak_rate * ratio), 1 / (self.start_rate * ratio), int(round(ramp_steps * ratio))
+
+
+def profile_from_config(config_object, index: int) -> MotionProfile:
+    """
+    Reads the profile of motor index from a ConfigParser, [MOTORi] values override those in [MOTION]
+    """
+    values = {"start_rate": "50", "max_rate": "50", "acceleration": "0", "shape": "trapezoid"}
+    for section in ("MOTION", "MOTOR{}".format(index)):
+        if config_object.has_section(section):
+            values.update({key: config_object[section][key] for key in values if key in config_object[section]})
+    return MotionProfile(float(values["start_rate"]), float(values["max_rate"]), float(values["acceleration"]),
+                         SHAPES[values["shape"].strip().lower()])
@@ -0,0 +1,56 @@
+"""
+Module for writing several digital pins of a pyfirmata board with as few messages as possible.
+
+Firmata sets digital outputs per port of 8 pins: pyfirmata's Pin.write() sends the whole port state every time a
+single pin changes. When the step pins of several motors go high in the same tick, writing them one by one sends
+one message per pin, and the edges of the motors are spread over the time those messages take on the serial line.
+A PinBatch collects the pin changes of a tick and sends one message per port that changed, so all edges on a port
+happen at the same moment (pins 2 - 7 are on port 0, pins 8 - 13 on port 1).
+"""
+import pyfirmata
+
+
+class PinBatch:
+    """
+    Collects digital pin writes and sends them per port with flush().
+    Pins that are not digital outputs on a port are written immediately with Pin.write().
+
+    Attributes
+    ----------
+    messages_sent : int
+        Number of port messages sent by flush()
+    """
+
+    def __init__(self) -> None:
+        self._ports = {}
+        self.messages_sent = 0
+
+    def set(self, pin, value) -> None:
+        """
+        Sets the value of pin, it is sent to the board by the next flush()
+        """
+        if pin.mode != pyfirmata.OUTPUT or pin.port is None:
+            pin.write(value)
+            return
+        if value != pin.value:
+            pin.value = value
+            self._ports[id(pin.port)] = pin.port
+
+    def flush(self) -> int:
+        """
+        Sends one message for every port with changed pins, returns the number of messages sent
+        """
+        ports = list(self._ports.values())
+        self._ports.clear()
+        for port in ports:
+            port.write()
+        self.messages_sent += len(ports)
+        return len(ports)
+
+    def write(self, pins_values) -> int:
+        """
+        Sets all (pin, value) pairs and flushes them, returns the number of messages sent
+        """
+        for pin, value in pins_values:
+            self.set(pin, value)
+        return self.flush()
@@ -0,0 +1,183 @@
+"""
+Module for stepping several stepper motors at the same time.
+
+A move is a list of step deltas, one per motor (positive = forward/push, negative = backward/pull).
+The motor with the most steps sets the number of pulse windows (ticks), and a DDA/Bresenham planner decides in
+which ticks the other motors step. All motors that step in a tick get their pulse in the same window, so a move of
+(a, b) steps takes max(a, b) pulse periods instead of a + b, and every motor ends on exactly its requested total.
+
+The timing of the ticks follows the acceleration profile (see motion_profile.py) of the moving motor that needs the
+most time for the move, so none of the motors is driven faster than its own profile allows.
+Pin writes of a tick are combined per Firmata port (see pin_batch.py), so the pulses of all motors on a port start
+and end with a single message.
+"""
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from src.controls.step_train import FORWARD, BACKWARD
+from src.controls.pin_batch import PinBatch
+
+
+def plan_ticks(deltas) -> list:
+    """
+    Bresenham planner: returns a list of ticks, every tick being the list of motor indices that step in it.
+    The number of ticks equals the largest absolute delta, and motor i steps exactly abs(deltas[i]) times,
+    spread as evenly as possible over the move.
+    """
+    steps = [abs(int(delta)) for delta in deltas]
+    nr_of_ticks = max(steps, default=0)
+    errors = [nr_of_ticks // 2] * len(steps)
+    ticks = []
+    for _ in range(nr_of_ticks):
+        tick = []
+        for motor_i, motor_steps in enumerate(steps):
+            errors[motor_i] += motor_steps
+            if errors[motor_i] >= nr_of_ticks:
+                errors[motor_i] -= nr_of_ticks
+                tick.append(motor_i)
+        ticks.append(tick)
+    return ticks
+
+
+class StepScheduler:
+    """
+    Executes synchronized moves of any subset of the motors.
+
+    Attributes
+    ----------
+    motors : list
+        Steppermotor objects with their motion profiles, deltas are given in the same order
+    step_train : StepTrain or None
+        When given, the board generates the pulses and each motor gets its own rate so all finish together
+    clock : module or VirtualClock
+        Provides sleep() for the pulse windows, the time module or a simulator.VirtualClock
+    journal : StateJournal or None
+        When set, the step counters are journaled after every move (see state_journal.py)
+    tracker : TipTracker or None
+        When set, every move is reported to the tip tracker (see image_pos/tip_tracker.py)
+    motion : multiprocessing.Value or None
+        When set, it holds the clock time at which the last move ends, so the camera process processes every frame
+        while the needle moves (see image_pos/motion_gate.py)
+    """
+
+    def __init__(self, motors: list, step_train=None, clock=time) -> None:
+        self.motors = motors
+        self.step_train = step_train
+        self.clock = clock
+        self.journal = None
+        self.tracker = None
+        self.motion = None
+        self.pin_batch = PinBatch()
+
+    def lead_profile(self, deltas):
+        """
+        Profile that sets the timing of a move: the slowest profile of the moving motors for the number of ticks
+        """
+        nr_of_ticks = max([abs(int(delta)) for delta in deltas], default=0)
+        profiles = [self.motors[motor_i].profile for motor_i, delta in enumerate(deltas) if int(delta) != 0]
+        if not profiles:
+            return None
+        return max(profiles, key=lambda profile: profile.duration(nr_of_ticks))
+
+    def duration(self, deltas, profile=None) -> float:
+        """
+        Time in seconds a move takes, known before the move is started
+        """
+        if profile is None:
+            profile = self.lead_profile(deltas)
+        if profile is None:
+            return 0.0
+        return profile.duration(max([abs(int(delta)) for delta in deltas]))
+
+    def move(self, deltas, report=0, cancel=None, profile=None) -> list:
+        """
+        Steps all motors with a non-zero delta at the same time and updates their step counters.
+        Does not check the 0..400 limits of the motors, that is up to the caller.
+        When the threading.Event cancel gets set, the move decelerates and stops at the next possible step boundary.
+        The profile of the motors can be overruled for this move with profile (used by homing).
+        Returns the list of signed steps that were done per motor.
+        """
+        deltas = [int(delta) for delta in deltas]
+        moving = [motor_i for motor_i, delta in enumerate(deltas) if delta != 0]
+        done = [0] * len(deltas)
+        if not moving:
+            return done
+        if profile is None:
+            profile = self.lead_profile(deltas)
+
+        self.pin_batch.write([(self.motors[motor_i].dirpin, FORWARD if deltas[motor_i] > 0 else BACKWARD)
+                              for motor_i in moving])
+        if self.tracker is not None:
+            self.tracker.command(deltas, self.clock.monotonic(), self.duration(deltas, profile))
+        if self.motion is not None:
+            self.motion.value = self.clock.monotonic() + self.duration(deltas, profile)
+
+        if self.step_train is not None:
+            done = self._move_step_train(deltas, moving, profile, cancel)
+        else:
+            done = self._move_ticks(deltas, profile, cancel)
+        if self.journal is not None:
+            self.journal.record(counts=[motor.stepcounter for motor in self.motors])
+        if self.tracker is not None and done != deltas:
+            self.tracker.finish_command(done, self.clock.monotonic())
+        if self.motion is not None:
+            self.motion.value = self.clock.monotonic()
+
+        if report == 1:
+            print("SCHEDULER->move: deltas = {}, done = {}, planned duration = {:.2f} s".format(
+                deltas, done, self.duration(deltas, profile)))
+        return done
+
+    @staticmethod
+    def _tick_intervals(profile, nr_of_ticks: int, cancel):
+        """
+        Yields the interval of every tick. After cancel is set, only the ticks needed to decelerate back to
+        the start rate are yielded, using the intervals of the acceleration ramp in reverse.
+        """
+        intervals = profile.intervals(nr_of_ticks)
+        ramp_steps = profile.ramp(nr_of_ticks)[1]
+        for tick_i, interval in enumerate(intervals):
+            if cancel is not None and cancel.is_set():
+                ramp_pos = min(tick_i, ramp_steps)
+                if ramp_pos < nr_of_ticks - tick_i:
+                    for ramp_i in reversed(range(ramp_pos)):
+                        yield intervals[ramp_i]
+                    return
+            yield interval
+
+    def _move_ticks(self, deltas, profile, cancel=None) -> list:
+        """
+        Pulses the motors from Python, all motors of a tick share one pulse window and one message per port
+        """
+        done = [0] * len(deltas)
+        ticks = plan_ticks(deltas)
+        for tick, interval in zip(ticks, self._tick_intervals(profile, len(ticks), cancel)):
+            self.pin_batch.write([(self.motors[motor_i].movpin, 1) for motor_i in tick])
+            self.clock.sleep(interval / 2)
+            self.pin_batch.write([(self.motors[motor_i].movpin, 0) for motor_i in tick])
+            for motor_i in tick:
+                step = 1 if deltas[motor_i] > 0 else -1
+                self.motors[motor_i].stepcounter += step
+                done[motor_i] += step
+            self.clock.sleep(interval / 2)
+        return done
+
+    def _move_step_train(self, deltas, moving, profile, cancel=None) -> list:
+        """
+        Lets the board pulse every motor at its own rate, such that all motors finish at the same time.
+        Every motor gets the ramp of the lead profile, scaled to its own number of steps.
+        """
+        done = [0] * len(deltas)
+        nr_of_ticks = max([abs(delta) for delta in deltas])
+        for motor_i in moving:
+            direction = FORWARD if deltas[motor_i] > 0 else BACKWARD
+            period, start_period, ramp_steps = profile.scaled_train(abs(deltas[motor_i]), nr_of_ticks)
+            self.step_train.start(self.motors[motor_i].index, direction, abs(deltas[motor_i]),
+                                  period, start_period, ramp_steps, profile.shape)
+        steps_done = self.step_train.wait([self.motors[motor_i].index for motor_i in moving], cancel)
+        for motor_i in moving:
+            step = steps_done[self.motors[motor_i].index] * (1 if deltas[motor_i] > 0 else -1)
+            self.motors[motor_i].stepcounter += step
+            done[motor_i] = step
+        return done
@@ -0,0 +1,483 @@
+"""
+Module with emulated hardware, so motor and FESTO code can run (and be tested) without an Arduino or a LabJack T7.
+
+SimulatedBoard is a pyfirmata Board whose serial port is replaced by SimulatedSerial.
+SimulatedSerial parses the raw Firmata byte stream exactly as the firmware on the Arduino would,
+keeps track of the pin levels and also implements the step-train SysEx commands (see step_train.py).
+SimulatedLJM offers the functions of labjack.ljm that needle.py uses and emulates the FESTO Lua script
+(labjack_driver/FESTO_controlv3.lua) running on the T7.
+
+All timestamps come from a clock object with the monotonic() and sleep() functions of the time module.
+By default that is the time module itself. With a VirtualClock, sleep() only advances the clock, so a long motion
+session replays in a fraction of its real duration. Pass the same clock to the board, the StepTrain, the
+StepScheduler and the Steppermotors. A VirtualClock is meant for single threaded replays, not for the MotionExecutor.
+
+Example, replaying moves and reporting their message counts and step rates:
+    clock = VirtualClock()
+    board = SimulatedBoard(clock=clock)
+    ... create Steppermotors and a StepScheduler on board with clock=clock ...
+    with board.measure("diagonal"):
+        scheduler.move([100, 0, -100, 0])
+    print(board.sp.moves[-1])
+"""
+import contextlib
+import time
+import sys
+import os
+import pyfirmata
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import src.util.logger as logger
+from src.controls.step_train import STEP_TRAIN, STEP_TRAIN_CONFIG, STEP_TRAIN_DONE, STEP_TRAIN_STOP, \
+    pack_7bit, decode_step_train
+from src.controls.motion_profile import ramp_rate, train_intervals
+
+
+class VirtualClock:
+    """
+    Clock with the interface of the time module (monotonic and sleep) that only advances when sleep is called
+    """
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def monotonic(self) -> float:
+        """
+        Current virtual time in seconds
+        """
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Advances the virtual time without waiting
+        """
+        if seconds > 0:
+            self._now += seconds
+
+
+class MoveStats:
+    """
+    Statistics of a measured move on a SimulatedSerial.
+
+    Attributes
+    ----------
+    name : str
+        Description of the move
+    duration : float
+        Clock time in seconds from the start to the end of the measurement
+    messages, replies : int
+        Number of Firmata messages from the host to the board, and from the board to the host
+    steps : dict
+        Step pin -> number of steps generated during the move
+    rates : dict
+        Step pin -> achieved rate in steps/s, from the first to the last step edge of that pin
+    """
+
+    def __init__(self, name, duration, messages, replies, steps, rates):
+        self.name = name
+        self.duration = duration
+        self.messages = messages
+        self.replies = replies
+        self.steps = steps
+        self.rates = rates
+
+    def __str__(self) -> str:
+        pins = ", ".join("pin {}: {} steps at {:.0f} steps/s".format(pin, self.steps[pin], self.rates[pin])
+                         for pin in sorted(self.steps))
+        return "{}: {:.3f} s, {} messages, {} replies ({})".format(
+            self.name, self.duration, self.messages, self.replies, pins or "no steps")
+
+
+class _Train:
+    """
+    A step train that is running on the emulated board
+    """
+
+    def __init__(self, motor, steppin, steps, period, start_period, ramp_steps, shape, start):
+        self.motor = motor
+        self.steppin = steppin
+        self.steps = steps
+        self.peak_rate = 1 / period
+        self.start_rate = 1 / start_period
+        self.ramp_steps = ramp_steps
+        self.shape = shape
+        self.start = start
+        self.intervals = train_intervals(steps, self.peak_rate, self.start_rate, ramp_steps, shape)
+
+    def end(self) -> float:
+        return self.start + sum(self.intervals)
+
+    def steps_done(self, now: float) -> int:
+        """
+        Number of steps completed (falling edge passed) at time now
+        """
+        done = 0
+        timestamp = self.start
+        for interval in self.intervals:
+            if timestamp + interval / 2 > now:
+                break
+            done += 1
+            timestamp += interval
+        return done
+
+    def stop(self, now: float) -> None:
+        """
+        Shortens the train to a deceleration from the current step, like stopTrain() in the firmware
+        """
+        done = self.steps_done(now)
+        from_end = self.steps - 1 - done
+        ramp_pos = min(done, self.ramp_steps)
+        if ramp_pos < from_end:
+            self.steps = done + ramp_pos + 1
+            self.intervals = self.intervals[:done] + [
+                1 / ramp_rate(min(step, self.steps - 1 - step), self.ramp_steps, self.start_rate, self.peak_rate,
+                              self.shape)
+                for step in range(done, self.steps)]
+
+
+class SimulatedSerial:
+    """
+    Stand-in for serial.Serial that emulates the Firmata firmware (including the step-train extension).
+
+    Attributes
+    ----------
+    clock : module or VirtualClock
+        Source of the timestamps, step trains take their duration on this clock
+    levels : dict
+        Current level (0 or 1) of every digital pin that has been written
+    edges : list
+        Every pin change as a tuple (timestamp, pin, level)
+    messages, replies : int
+        Number of complete Firmata messages received from the host, and sent back to the host
+    motors : dict
+        Step-train configuration, motor index -> (dirpin, steppin)
+    moves : list
+        MoveStats of every measured move
+    """
+
+    def __init__(self, port="SIM", clock=time):
+        self.port = port
+        self.clock = clock
+        self.levels = {}
+        self.modes = {}
+        self.edges = []
+        self.messages = 0
+        self.replies = 0
+        self.motors = {}
+        self.moves = []
+        self._trains = {}
+        self._message = []
+        self._output = bytearray()
+
+    def _set_level(self, pin: int, level: int, timestamp: float) -> None:
+        if self.levels.get(pin, 0) != level:
+            self.edges.append((timestamp, pin, level))
+        self.levels[pin] = level
+
+    def _reply_sysex(self, command: int, data) -> None:
+        self.replies += 1
+        self._output.extend([pyfirmata.START_SYSEX, command] + list(data) + [pyfirmata.END_SYSEX])
+
+    def _end_train(self, train: _Train, steps: int) -> None:
+        """
+        Records the edges of the first steps steps of a train and removes it
+        """
+        timestamp = train.start
+        for interval in train.intervals[:steps]:
+            self._set_level(train.steppin, 1, timestamp)
+            self._set_level(train.steppin, 0, timestamp + interval / 2)
+            timestamp += interval
+        del self._trains[train.motor]
+
+    def _finish_train(self, train: _Train, steps: int) -> None:
+        """
+        Ends a train after steps steps and reports it as done
+        """
+        self._end_train(train, steps)
+        self._reply_sysex(STEP_TRAIN_DONE, [train.motor] + pack_7bit(steps, 3))
+
+    def _advance(self) -> None:
+        """
+        Finishes the step trains whose last step has passed on the clock
+        """
+        now = self.clock.monotonic()
+        for train in sorted(self._trains.values(), key=_Train.end):
+            if train.end() <= now:
+                self._finish_train(train, train.steps)
+
+    def _handle_sysex(self, command: int, data) -> None:
+        if command == STEP_TRAIN_CONFIG and len(data) >= 3:
+            self.motors[data[0]] = (data[1], data[2])
+            self._reply_sysex(STEP_TRAIN_CONFIG, data[:3])
+        elif command == STEP_TRAIN and len(data) >= 17:
+            motor, direction, steps, period, start_period, ramp_steps, shape = decode_step_train(data)
+            dirpin, steppin = self.motors[motor]
+            now = self.clock.monotonic()
+            if motor in self._trains:
+                # a new train silently replaces the running one, like in the firmware: no STEP_TRAIN_DONE of the old one
+                self._end_train(self._trains[motor], self._trains[motor].steps_done(now))
+            self._set_level(dirpin, direction, now)
+            self._trains[motor] = _Train(motor, steppin, steps, period, start_period, ramp_steps, shape, now)
+            self._advance()
+        elif command == STEP_TRAIN_STOP and len(data) >= 1 and data[0] in self._trains:
+            self._trains[data[0]].stop(self.clock.monotonic())
+            self._advance()
+
+    def _handle_message(self, message) -> None:
+        self.messages += 1
+        command = message[0]
+        now = self.clock.monotonic()
+        if command & 0xF0 == pyfirmata.DIGITAL_MESSAGE:
+            port = command & 0x0F
+            mask = message[1] | (message[2] << 7)
+            for bit in range(8):
+                pin = port * 8 + bit
+                if self.modes.get(pin, pyfirmata.OUTPUT) == pyfirmata.OUTPUT:
+                    self._set_level(pin, (mask >> bit) & 1, now)
+        elif command == pyfirmata.SET_PIN_MODE:
+            self.modes[message[1]] = message[2]
+        elif command == pyfirmata.START_SYSEX:
+            self._handle_sysex(message[1], message[2:-1])
+
+    @staticmethod
+    def _message_length(command: int) -> int:
+        """
+        Number of bytes of a (non SysEx) Firmata message, including the command byte
+        """
+        if command in (pyfirmata.SYSTEM_RESET, pyfirmata.REPORT_VERSION):
+            return 1
+        if command & 0xF0 in (pyfirmata.REPORT_ANALOG, pyfirmata.REPORT_DIGITAL):
+            return 2
+        return 3
+
+    def write(self, data) -> int:
+        """
+        Receives bytes from the host, like serial.Serial.write
+        """
+        for byte in bytearray(data):
+            if byte & 0x80 and byte != pyfirmata.END_SYSEX:
+                self._message = [byte]  # command byte starts a new message
+            elif self._message:
+                self._message.append(byte)
+            else:
+                continue
+            if self._message[0] == pyfirmata.START_SYSEX:
+                complete = byte == pyfirmata.END_SYSEX
+            else:
+                complete = len(self._message) == self._message_length(self._message[0])
+            if complete:
+                message, self._message = self._message, []
+                self._handle_message(message)
+        return len(data)
+
+    def inWaiting(self) -> int:  # pylint: disable=invalid-name
+        """
+        Number of bytes the emulated board has sent back to the host
+        """
+        self._advance()
+        return len(self._output)
+
+    def read(self, size=1) -> bytes:
+        """
+        Returns bytes sent by the emulated board to the host, like serial.Serial.read
+        """
+        self._advance()
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        return data
+
+    def close(self) -> None:
+        """
+        Nothing to close for an emulated port
+        """
+
+    def step_count(self, pin: int) -> int:
+        """
+        Number of rising edges (steps) that were generated on a pin
+        """
+        self._advance()
+        return sum(1 for _, edge_pin, level in self.edges if edge_pin == pin and level == 1)
+
+    @contextlib.contextmanager
+    def measure(self, name="", pins=None):
+        """
+        Context manager that records a MoveStats of everything that happens inside it, appends it to moves and logs it.
+        The steps are counted on pins, by default the step pins configured for step trains, or every pin that
+        toggled during the move when no step trains are configured.
+        """
+        self._advance()
+        start, first_edge = self.clock.monotonic(), len(self.edges)
+        messages, replies = self.messages, self.replies
+        yield
+        self._advance()
+        if pins is None and self.motors:
+            pins = [steppin for _, steppin in self.motors.values()]
+        rises = {}
+        for timestamp, pin, level in self.edges[first_edge:]:
+            if level == 1 and (pins is None or pin in pins):
+                rises.setdefault(pin, []).append(timestamp)
+        steps = {pin: len(timestamps) for pin, timestamps in rises.items()}
+        rates = {pin: (len(timestamps) - 1) / (max(timestamps) - min(timestamps)) if len(timestamps) > 1 else 0.0
+                 for pin, timestamps in rises.items()}
+        stats = MoveStats(name, self.clock.monotonic() - start, self.messages - messages, self.replies - replies,
+                          steps, rates)
+        self.moves.append(stats)
+        logger.info("SIMULATOR: " + str(stats))
+
+
+class SimulatedBoard(pyfirmata.Board):
+    """
+    A pyfirmata Board connected to SimulatedSerial instead of a real Arduino.
+    Everything written to it passes through the regular pyfirmata Pin and Port classes.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, name="SIM", layout=None, clock=time):
+        self.sp = SimulatedSerial(name, clock)
+        self.name = name
+        self.clock = clock
+        self._command_handlers = {}
+        self._layout = layout if layout is not None else pyfirmata.BOARDS['arduino']
+        self.setup_layout(self._layout)
+
+    def measure(self, name="", pins=None):
+        """
+        See SimulatedSerial.measure
+        """
+        return self.sp.measure(name, pins)
+
+
+class SimulatedLJM:
+    """
+    Stand-in for the labjack.ljm module with a single emulated T7 running FESTO_controlv3.lua.
+
+    The Lua script waits for a positive enable register, then drives the stage to the initial position for 1.5 s,
+    and from then on corrects the position every script interval: at the speed register (in V, 2.5 V = 25 mm/s)
+    when the target is more than 0.3 V away, and at a slow creep speed when it is closer.
+    The stage moves on the clock, so AIN0 follows a FESTO move in virtual time.
+
+    Attributes
+    ----------
+    position : float
+        Position of the FESTO stage in mm, as of the last register access
+    reads, writes : int
+        Number of eReadAddress and eWriteAddress calls
+    """
+
+    AIN0 = 0
+    DAC0 = 1000
+    DAC1 = 1002
+    INITIAL_POS = 46000
+    TARGET_POS = 46002
+    SPEED = 46004
+    ENABLE = 46008
+
+    # constants of FESTO_controlv3.lua
+    DMAX, DMIN = 50.5, 3.0          # mm
+    VMAX, VMIN = 9.418, 0.032       # V on AIN0 at DMAX and DMIN
+    OFFSET_V = 2.5                  # V on DAC1 for speed 0
+    OUTPUT_MAX = 1.5                # V
+    MM_PER_S_PER_V = 10.0           # 2.5 V = 25 mm/s
+    DEADBAND = 0.3                  # V
+    CREEP_BACK, CREEP_FORWARD = 0.18, 0.1   # V
+    INIT_TIME = 1.5                 # s
+    CHECK_INTERVAL = 0.02           # s
+    DRIVE_TIME = 0.04               # s
+
+    def __init__(self, clock=time, position=DMIN):
+        self.clock = clock
+        self.position = float(position)
+        self.reads = 0
+        self.writes = 0
+        self.registers = {self.DAC0: 0.5, self.DAC1: 0.0, self.INITIAL_POS: 0.0, self.TARGET_POS: 0.0,
+                          self.SPEED: 0.0, self.ENABLE: 0.0}
+        self._handles = set()
+        self._state = "enable"      # enable -> init -> main
+        self._time = clock.monotonic()
+        self._init_end = 0.0
+
+    def _volt(self, position: float) -> float:
+        volt = (self.VMAX - self.VMIN) / (self.DMAX - self.DMIN) * (position - self.DMIN)
+        return min(max(volt, self.VMIN), self.VMAX)
+
+    def _drive(self, dac1: float, seconds: float) -> None:
+        self.registers[self.DAC1] = dac1
+        self.position += (dac1 - self.OFFSET_V) * self.MM_PER_S_PER_V * seconds
+        self.position = min(max(self.position, self.DMIN), self.DMAX)
+        self._time += seconds
+
+    def _advance(self) -> None:
+        """
+        Runs the Lua script up to the current time of the clock
+        """
+        now = self.clock.monotonic()
+        if self._state == "enable":
+            self._time = now
+            return
+        while self._state == "init" and self._time < now:
+            # INIT1: run at full speed to the initial position and hold there until the interval ends
+            target = self._volt(self.registers[self.INITIAL_POS])
+            seconds = min(now, self._init_end) - self._time
+            direction = 1 if target > self._volt(self.position) else -1
+            distance = abs(self.registers[self.INITIAL_POS] - self.position)
+            drive_time = min(seconds, distance / (self.OUTPUT_MAX * self.MM_PER_S_PER_V))
+            self._drive(self.OFFSET_V + direction * self.OUTPUT_MAX, drive_time)
+            self._drive(self.OFFSET_V, seconds - drive_time)
+            if self._time >= self._init_end:
+                self._state = "main"
+        while self._state == "main" and self._time + self.CHECK_INTERVAL <= now:
+            speed = min(self.registers[self.SPEED], self.OUTPUT_MAX)
+            target = self._volt(self.registers[self.TARGET_POS])
+            current = self._volt(self.position)
+            if current > target + self.DEADBAND:
+                self._drive(self.OFFSET_V - speed, self.DRIVE_TIME)
+            elif current < target - self.DEADBAND:
+                self._drive(self.OFFSET_V + speed, self.DRIVE_TIME)
+            elif current > target:
+                self._drive(self.OFFSET_V - self.CREEP_BACK, self.DRIVE_TIME)
+            elif current < target:
+                self._drive(self.OFFSET_V + self.CREEP_FORWARD, self.DRIVE_TIME)
+            else:
+                self._drive(self.OFFSET_V, self.CHECK_INTERVAL)
+            self.registers[self.DAC1] = self.OFFSET_V
+
+    def _check(self, handle) -> None:
+        if handle not in self._handles:
+            raise ValueError("SimulatedLJM: unknown handle {}".format(handle))
+
+    def openS(self, device_type="ANY", connection_type="ANY", identifier="ANY") -> int:  # pylint: disable=invalid-name
+        """
+        Opens the emulated T7, returns its handle
+        """
+        handle = len(self._handles) + 1
+        self._handles.add(handle)
+        return handle
+
+    def close(self, handle) -> None:
+        """
+        Closes a handle of the emulated T7
+        """
+        self._handles.discard(handle)
+
+    def eReadAddress(self, handle, address: int, data_type=None) -> float:  # pylint: disable=invalid-name
+        """
+        Reads a register, AIN0 gives the position of the stage in V
+        """
+        self._check(handle)
+        self.reads += 1
+        self._advance()
+        if address == self.AIN0:
+            return self._volt(self.position)
+        return self.registers.get(address, 0.0)
+
+    def eWriteAddress(self, handle, address: int, data_type, value: float) -> None:  # pylint: disable=invalid-name
+        """
+        Writes a register, a positive value on the enable register starts the Lua script
+        """
+        self._check(handle)
+        self.writes += 1
+        self._advance()
+        self.registers[address] = float(value)
+        if address == self.ENABLE and value > 0 and self._state == "enable":
+            self.registers[self.ENABLE] = 0.0
+            self._state = "init"
+            self._init_end = self._time + self.INIT_TIME
@@ -0,0 +1,151 @@
+"""
+Module for the state journal: a small memory-mapped file that always holds the last known state of the needle.
+
+The journal stores the step counters of the motors, the FESTO position and init_pos in a fixed binary record with
+a CRC32 checksum. While a Needle is running the record is marked RUNNING and it is rewritten in place after every
+move (a few bytes in the mapped page, no file system calls). A clean shutdown marks it CLEAN.
+
+At the next start a CLEAN journal means the motors are exactly where the journal says, so the step counters can be
+restored without homing. A journal that is still RUNNING (the program crashed or was killed, possibly during a move)
+or that has a wrong checksum (torn write on power loss) cannot be trusted and the motors have to be homed.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+STATE_CLEAN = 0
+STATE_RUNNING = 1
+
+_MAGIC = b"BRJ1"
+# magic, state, sequence number, step counters, FESTO position, init_pos; followed by the CRC32 of these bytes
+_RECORD = "<4sB3xQ{}idi"
+_CRC = struct.Struct("<I")
+
+
+class JournalState:
+    """
+    Contents of a journal record.
+
+    Attributes
+    ----------
+    state : int
+        STATE_CLEAN or STATE_RUNNING
+    sequence : int
+        Number of writes since the journal was created
+    counts : list
+        Step counters of the motors
+    festo_pos : float
+        Position of the FESTO stage in mm
+    init_pos : int
+        Step count the init button returns the motors to
+    valid : bool
+        False if the record has a wrong magic number or checksum
+    """
+
+    def __init__(self, state, sequence, counts, festo_pos, init_pos, valid=True):
+        self.state = state
+        self.sequence = sequence
+        self.counts = counts
+        self.festo_pos = festo_pos
+        self.init_pos = init_pos
+        self.valid = valid
+
+    @property
+    def clean(self) -> bool:
+        """
+        True if the record can be trusted: valid and written by a clean shutdown
+        """
+        return self.valid and self.state == STATE_CLEAN
+
+
+class StateJournal:
+    """
+    Memory-mapped journal file with the state of nr_of_motors motors, see the module docstring.
+    Writes are protected by a lock, because moves are journaled from the MotionExecutor thread.
+    """
+
+    def __init__(self, path: str, nr_of_motors=4) -> None:
+        self.path = path
+        self.nr_of_motors = nr_of_motors
+        self._record = struct.Struct(_RECORD.format(nr_of_motors))
+        self.size = self._record.size + _CRC.size
+        self._state = JournalState(STATE_RUNNING, 0, [0] * nr_of_motors, 0.0, 0)
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+
+    def _decode(self) -> JournalState:
+        record = bytes(self._map[:self._record.size])
+        crc = _CRC.unpack_from(self._map, self._record.size)[0]
+        magic, state, sequence, *values = self._record.unpack(record)
+        counts = list(values[:self.nr_of_motors])
+        festo_pos, init_pos = values[self.nr_of_motors:]
+        valid = magic == _MAGIC and crc == zlib.crc32(record)
+        return JournalState(state, sequence, counts, festo_pos, init_pos, valid)
+
+    def _write(self) -> None:
+        state = self._state
+        state.sequence += 1
+        self._record.pack_into(self._map, 0, _MAGIC, state.state, state.sequence,
+                               *state.counts, state.festo_pos, state.init_pos)
+        _CRC.pack_into(self._map, self._record.size, zlib.crc32(self._map[:self._record.size]))
+
+    def open(self):
+        """
+        Maps the journal file (creating it if needed) and marks it RUNNING.
+        Returns the JournalState of the previous session, or None if there was no journal yet.
+        A journal of the wrong size is returned as an invalid state and recreated.
+        """
+        previous = None
+        existed = os.path.exists(self.path)
+        if existed and os.path.getsize(self.path) != self.size:
+            previous = JournalState(STATE_RUNNING, 0, [0] * self.nr_of_motors, 0.0, 0, valid=False)
+            existed = False
+        self._file = open(self.path, "r+b" if existed else "w+b")
+        if not existed:
+            self._file.truncate(self.size)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+        if existed:
+            previous = self._decode()
+            if previous.valid:
+                self._state = JournalState(STATE_RUNNING, previous.sequence, list(previous.counts),
+                                           previous.festo_pos, previous.init_pos)
+        with self._lock:
+            self._state.state = STATE_RUNNING
+            self._write()
+            self._map.flush()
+        return previous
+
+    def record(self, counts=None, festo_pos=None, init_pos=None) -> None:
+        """
+        Updates the given values in place, the values that are None keep their last journaled value
+        """
+        if self._map is None:
+            return
+        with self._lock:
+            if counts is not None:
+                self._state.counts = [int(count) for count in counts]
+            if festo_pos is not None:
+                self._state.festo_pos = float(festo_pos)
+            if init_pos is not None:
+                self._state.init_pos = int(init_pos)
+            self._write()
+
+    def close(self, clean=True) -> None:
+        """
+        Marks the journal CLEAN, writes it to disk and unmaps it.
+        With clean=False it stays RUNNING, so the next session homes the motors.
+        """
+        if self._map is None:
+            return
+        with self._lock:
+            self._state.state = STATE_CLEAN if clean else STATE_RUNNING
+            self._write()
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.close()
+            self._file = None
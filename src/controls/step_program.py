@@ -0,0 +1,116 @@
+"""
+Module for compiling a predefined test from config.ini into a step program.
+
+A test section lists, per position, a number of steps for every motor, a joystick coordinate and a sleep time
+(see [example_test] in config.ini). Compiling turns every position into a single concurrent move: the motor steps
+of the position and the needle move of the coordinate (planned with the MovePlanner from the step counters after
+the motor steps) are added per motor, and the StepScheduler steps all motors together.
+Everything is planned before the first motor moves, so the duration is known up front and running the program
+costs one scheduler move per position.
+"""
+import ast
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import src.util.logger as logger
+
+
+class ProgramStep:
+    """
+    One position of a step program.
+
+    Attributes
+    ----------
+    deltas : list
+        Steps per motor (forward > 0, backward < 0), all done in a single move
+    sleep : float
+        Seconds to wait after the move, 0 waits for the user to press Enter
+    label : str
+        Description used in the log
+    """
+
+    def __init__(self, deltas, sleep, label="") -> None:
+        self.deltas = deltas
+        self.sleep = sleep
+        self.label = label
+
+
+class StepProgram:
+    """
+    A compiled test: the list of ProgramSteps and the step counters the motors end up at
+    """
+
+    def __init__(self, name="") -> None:
+        self.name = name
+        self.steps = []
+        self.final_counts = []
+
+    def duration(self, scheduler) -> float:
+        """
+        Estimated run time in seconds: the motion time of every move plus the sleeps (without the manual pauses)
+        """
+        return sum(scheduler.duration(step.deltas) + step.sleep for step in self.steps)
+
+    def manual_pauses(self) -> int:
+        """
+        Number of positions that wait for the user to press Enter
+        """
+        return sum(1 for step in self.steps if step.sleep == 0)
+
+    def run(self, scheduler) -> None:
+        """
+        Executes the program with the scheduler, one move per position
+        """
+        for position, step in enumerate(self.steps):
+            done = scheduler.move(step.deltas)
+            logger.info("STEP_PROGRAM: position {} ({}) done: {}".format(position, step.label, done))
+            if step.sleep == 0:
+                input("Press Enter to continue...")
+            else:
+                scheduler.clock.sleep(step.sleep)
+
+
+def compile_test(test, planner, to_gdo, counts, name="") -> StepProgram:
+    """
+    Compiles a test section of config.ini into a StepProgram
+        - test: the section (or a dict) with number_of_positions, motor0test..motor3test, coords and sleep
+        - planner: MovePlanner used for the coordinate moves
+        - to_gdo: function (x, y) -> GDO, the analog_stick_to_dir of a Controller
+        - counts: step counters of the motors at the start of the program
+    Motor steps that would take a motor outside its limits are dropped with a warning, like run_forward and
+    run_backward do. A coordinate is only moved to when both x and y are non-zero.
+    """
+    number_of_positions = int(test["number_of_positions"])
+    motortests = [ast.literal_eval(test["motor{}test".format(motor_i)]) for motor_i in range(len(counts))]
+    coords = ast.literal_eval(test["coords"])
+    sleep = ast.literal_eval(test["sleep"])
+
+    program = StepProgram(name)
+    counts = list(counts)
+    for position in range(number_of_positions):
+        deltas = []
+        for motor_i, motortest in enumerate(motortests):
+            delta = int(motortest[position])
+            if not planner.lower_limit <= counts[motor_i] + delta <= planner.upper_limit:
+                logger.error("STEP_PROGRAM: position {}: {} steps of motor {} exceed its limits, skipped".format(
+                    position, delta, motor_i))
+                delta = 0
+            deltas.append(delta)
+        counts = [count + delta for count, delta in zip(counts, deltas)]
+
+        test_x = coords[position][0] / 100
+        test_y = coords[position][1] / 100
+        label = "motor steps {}".format(deltas)
+        if test_x != 0 and test_y != 0:
+            needle_deltas = planner.plan(to_gdo(test_x, test_y), counts)
+            if needle_deltas is None:
+                logger.error("STEP_PROGRAM: position {}: coordinate ({}, {}) is out of reach, skipped".format(
+                    position, test_x, test_y))
+            else:
+                label += ", needle to ({}, {})".format(test_x, test_y)
+                counts = [count + delta for count, delta in zip(counts, needle_deltas)]
+                deltas = [delta + needle_delta for delta, needle_delta in zip(deltas, needle_deltas)]
+
+        program.steps.append(ProgramStep(deltas, sleep[position], label))
+    program.final_counts = counts
+    return program
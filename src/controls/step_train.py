@@ -0,0 +1,205 @@
+"""
+Module for the step-train protocol between host and Arduino.
+
+Instead of toggling the mov pin of a stepper motor from Python for every single step (two pin writes and two sleeps
+per step), the host sends one compact SysEx command per move: (motor, direction, number of steps, pulse period).
+The board then generates the pulses itself and reports back when the train is finished.
+The board side of the protocol is implemented in arduino_driver/StepTrainFirmata.ino.
+
+SysEx payloads only carry 7-bit bytes, so all multi-byte values are sent least significant 7 bits first.
+"""
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import src.util.logger as logger
+from src.controls.motion_profile import TRAPEZOID, train_intervals
+
+# SysEx command bytes, taken from the user defined range (0x01 - 0x0F) of the Firmata protocol
+STEP_TRAIN_CONFIG = 0x01    # host -> board: motor, dirpin, steppin     board -> host: echo as acknowledgement
+STEP_TRAIN = 0x02           # host -> board: motor, direction, steps (3 bytes), period in us (4 bytes),
+                            #                start period in us (4 bytes), ramp steps (3 bytes), ramp shape
+STEP_TRAIN_DONE = 0x03      # board -> host: motor, steps done (3 bytes)
+STEP_TRAIN_STOP = 0x04      # host -> board: motor, the train decelerates and stops as soon as possible
+
+FORWARD = 1
+BACKWARD = 0
+
+
+def pack_7bit(value: int, nr_of_bytes: int) -> list:
+    """
+    Splits a non-negative integer into nr_of_bytes 7-bit bytes, least significant bits first
+    """
+    if value < 0 or value >= 1 << (7 * nr_of_bytes):
+        raise ValueError("{} does not fit in {} 7-bit bytes".format(value, nr_of_bytes))
+    return [(value >> (7 * i)) & 0x7F for i in range(nr_of_bytes)]
+
+
+def unpack_7bit(data) -> int:
+    """
+    Inverse of pack_7bit: combines 7-bit bytes (least significant first) into one integer
+    """
+    value = 0
+    for i, byte in enumerate(data):
+        value |= (byte & 0x7F) << (7 * i)
+    return value
+
+
+def encode_step_train(motor: int, direction: int, steps: int, period: float,
+                      start_period=None, ramp_steps=0, shape=TRAPEZOID) -> list:
+    """
+    Creates the SysEx payload of a STEP_TRAIN command
+        - motor: index of the motor as configured with STEP_TRAIN_CONFIG
+        - direction: FORWARD (1) or BACKWARD (0)
+        - steps: number of pulses the board has to generate
+        - period: time between two rising edges in seconds at cruise rate (resolution of 1 us on the board)
+        - start_period, ramp_steps, shape (optional): acceleration ramp, see motion_profile.py
+    """
+    if start_period is None:
+        start_period = period
+    return ([motor & 0x7F, direction & 0x01] + pack_7bit(steps, 3) + pack_7bit(int(round(period * 1e6)), 4) +
+            pack_7bit(int(round(start_period * 1e6)), 4) + pack_7bit(ramp_steps, 3) + [shape & 0x7F])
+
+
+def decode_step_train(data) -> (int, int, int, float, float, int, int):
+    """
+    Inverse of encode_step_train, returns (motor, direction, steps, period, start_period, ramp_steps, shape)
+    """
+    return (data[0], data[1], unpack_7bit(data[2:5]), unpack_7bit(data[5:9]) / 1e6, unpack_7bit(data[9:13]) / 1e6,
+            unpack_7bit(data[13:16]), data[16])
+
+
+def train_duration(steps: int, period: float, start_period=None, ramp_steps=0, shape=TRAPEZOID) -> float:
+    """
+    Time in seconds the board needs for a step train
+    """
+    if start_period is None:
+        start_period = period
+    return sum(train_intervals(steps, 1 / period, 1 / start_period, ramp_steps, shape))
+
+
+class StepTrain:
+    """
+    Host side of the step-train protocol.
+    Wraps a (pyfirmata) board object and sends one command per move instead of one message per pin toggle.
+
+    The board answers with STEP_TRAIN_DONE messages. These are read by polling board.iterate(), so no
+    pyfirmata Iterator thread should be reading the same serial port at the same time.
+    All waiting is done with clock, the time module or a simulator.VirtualClock.
+    """
+
+    def __init__(self, board, timeout_margin=0.5, clock=time):
+        self.board = board
+        self.timeout_margin = timeout_margin
+        self.clock = clock
+        self.configured = {}    # motor index -> True once the board acknowledged the configuration
+        self.running = {}       # motor index -> (steps requested, time by which the train should be done)
+        self.steps_done = {}    # motor index -> steps reported by the board for the last finished train
+        self.lost = set()       # motor indices of which a train was not reported, their position is unknown
+        self.messages_sent = 0
+        self.board.add_cmd_handler(STEP_TRAIN_CONFIG, self._handle_config)
+        self.board.add_cmd_handler(STEP_TRAIN_DONE, self._handle_done)
+
+    def _handle_config(self, *data):
+        """
+        Handler for the acknowledgement of a STEP_TRAIN_CONFIG command
+        """
+        if data:
+            self.configured[data[0]] = True
+
+    def _handle_done(self, *data):
+        """
+        Handler for a STEP_TRAIN_DONE message
+        """
+        if len(data) >= 4:
+            self.steps_done[data[0]] = unpack_7bit(data[1:4])
+
+    def _poll(self) -> None:
+        """
+        Handles all messages that are waiting on the serial port
+        """
+        while self.board.bytes_available():
+            self.board.iterate()
+
+    def configure(self, motor: int, dirpin: int, steppin: int, timeout=1.0) -> bool:
+        """
+        Tells the board which pins belong to a motor index.
+        Returns False when the board does not acknowledge, i.e. when it does not run the step-train firmware.
+        """
+        self.configured.pop(motor, None)
+        self.board.send_sysex(STEP_TRAIN_CONFIG, [motor & 0x7F, dirpin & 0x7F, steppin & 0x7F])
+        self.messages_sent += 1
+        deadline = self.clock.monotonic() + timeout
+        while motor not in self.configured and self.clock.monotonic() < deadline:
+            self._poll()
+            self.clock.sleep(0.001)
+        return motor in self.configured
+
+    def start(self, motor: int, direction: int, steps: int, period: float,
+              start_period=None, ramp_steps=0, shape=TRAPEZOID) -> None:
+        """
+        Starts a step train on the board without waiting for it to finish
+        """
+        self.steps_done.pop(motor, None)
+        if steps <= 0:
+            self.steps_done[motor] = 0
+            return
+        self.board.send_sysex(STEP_TRAIN, encode_step_train(motor, direction, steps, period,
+                                                            start_period, ramp_steps, shape))
+        self.messages_sent += 1
+        duration = train_duration(steps, period, start_period, ramp_steps, shape)
+        self.running[motor] = (steps, self.clock.monotonic() + duration + self.timeout_margin)
+
+    def stop(self, motor: int) -> None:
+        """
+        Asks the board to decelerate and stop a running train, the board still answers with STEP_TRAIN_DONE
+        """
+        self.board.send_sysex(STEP_TRAIN_STOP, [motor & 0x7F])
+        self.messages_sent += 1
+
+    def wait(self, motors, cancel=None) -> dict:
+        """
+        Blocks until the step trains of all given motors are done.
+        When the threading.Event cancel gets set, the trains that are still running are stopped.
+        Returns a dict motor index -> number of steps the board reported as done.
+        A train that is not reported in time (also after a stop) is logged and counts as 0 steps; its motor is added
+        to lost, because nobody knows how far it went, so it needs homing.
+        """
+        pending = [motor for motor in motors if motor not in self.steps_done]
+        stopped = False
+        while pending:
+            if cancel is not None and cancel.is_set() and not stopped:
+                for motor in pending:
+                    self.stop(motor)
+                stopped = True
+            self._poll()
+            now = self.clock.monotonic()
+            for motor in list(pending):
+                if motor in self.steps_done:
+                    pending.remove(motor)
+                elif now > self.running[motor][1]:
+                    logger.error("STEP_TRAIN: no response from board for motor {}{}, its position is unknown "
+                                 "and it needs homing".format(motor, " after a stop" if stopped else ""))
+                    self.steps_done[motor] = 0
+                    self.lost.add(motor)
+                    pending.remove(motor)
+            if pending and cancel is None:
+                # nothing to react to before the first train is expected to be done
+                expected = min(self.running[motor][1] for motor in pending) - self.timeout_margin
+                self.clock.sleep(max(expected - now, 0.001))
+            elif pending:
+                self.clock.sleep(0.001)
+
+        result = {}
+        for motor in motors:
+            result[motor] = self.steps_done[motor]
+            self.running.pop(motor, None)
+        return result
+
+    def run(self, motor: int, direction: int, steps: int, period: float,
+            start_period=None, ramp_steps=0, shape=TRAPEZOID) -> int:
+        """
+        Runs one step train and waits for it, returns the number of steps done
+        """
+        self.start(motor, direction, steps, period, start_period, ramp_steps, shape)
+        return self.wait([motor])[motor]
@@ -6,20 +6,30 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 import src.util.logger as logger
+from src.controls.motion_profile import MotionProfile
+
+# (dirpin, movpin) on the Arduino of every motor index, the index also selects the [MOTOR<index>] profile
+MOTOR_PINS = [(7, 6), (5, 4), (3, 2), (9, 8)]
+
+
 class Steppermotor:
     """
     Class that represent stepper motor
     """
 
-    def __init__(self, dirpin, movpin, startcount, index):
+    def __init__(self, dirpin, movpin, startcount, index, profile=None, clock=time):
         self.dirpin = dirpin
         self.movpin = movpin
         self.stepcounter = int(startcount)
         self.index = index
+        self.profile = profile if profile is not None else MotionProfile()    # acceleration profile
+        self.step_train = None              # StepTrain object when the board generates the pulses itself
+        self.clock = clock                  # time module, or a simulator.VirtualClock
         logger.info("Creating new stepper motor instance:\n" +
                     "    Directional pin: {}\n".format(self.dirpin) +
                     "    Mov pin: {}\n".format(self.movpin) +
-                    "    Initial stepcount: {}\n".format(self.stepcounter))
+                    "    Initial stepcount: {}\n".format(self.stepcounter) +
+                    "    Motion profile: {}\n".format(self.profile))
 
 
     def get_count(self, report=0) ->int:
@@ -37,6 +47,34 @@ class Steppermotor:
         self.stepcounter = self.stepcounter + steps_done
         print(str(self.index) + " STEPPER_MOTOR.py: new stepcount = ", self.stepcounter)
 
+    def attach_step_train(self, step_train) -> bool:
+        """
+        Lets the board generate the pulses for this motor (see step_train.py).
+        Returns False and keeps toggling the pins from Python if the board does not support step trains.
+        """
+        if step_train.configure(self.index, self.dirpin.pin_number, self.movpin.pin_number):
+            self.step_train = step_train
+            return True
+        logger.info("Board does not acknowledge step trains, motor {} is pulsed from Python".format(self.index))
+        self.step_train = None
+        return False
+
+    def pulse(self, runsteps, direction) -> int:
+        """
+        Generates runsteps pulses on the mov pin following the motion profile, the direction pin has to be set already.
+        With a step train a single command is sent to the board, otherwise every pulse is toggled from Python.
+        Returns the number of steps done.
+        """
+        if self.step_train is not None:
+            peak_rate, ramp_steps = self.profile.ramp(runsteps)
+            return self.step_train.run(self.index, direction, runsteps, 1 / peak_rate,
+                                       1 / self.profile.start_rate, ramp_steps, self.profile.shape)
+        for interval in self.profile.intervals(runsteps):
+            self.movpin.write(1)
+            self.clock.sleep(interval / 2)
+            self.movpin.write(0)
+            self.clock.sleep(interval / 2)
+        return runsteps
 
 
     def run_forward(self, runsteps, report=0):
@@ -47,12 +85,8 @@ class Steppermotor:
         if self.stepcounter + runsteps > 400:
             print("STEPPER_MOTOR.py->run_forward:    Steps make stepcounter exceed upper limit (400)")
         else:
-            for _ in range(runsteps):
-                self.movpin.write(1)
-                time.sleep(0.01)
-                self.movpin.write(0)
-                time.sleep(0.01)
-            self.stepcounter = self.stepcounter + runsteps
+            steps_done = self.pulse(runsteps, 1)
+            self.stepcounter = self.stepcounter + steps_done
             if report == 1:
                 print(str(self.index) + " STEPPER_MOTOR.py->run_forward: Current stepcount is: ", self.stepcounter)
 
@@ -65,11 +99,7 @@ class Steppermotor:
         if self.stepcounter - runsteps < 0:
             print("STEPPER_MOTOR.py->run_backward:    Steps reduce stepcounter under lower limit (0)")
         else:
-            for _ in range(runsteps):
-                self.movpin.write(1)
-                time.sleep(0.01)
-                self.movpin.write(0)
-                time.sleep(0.01)
-            self.stepcounter = self.stepcounter - runsteps
+            steps_done = self.pulse(runsteps, 0)
+            self.stepcounter = self.stepcounter - steps_done
             if report == 1:
                 print(str(self.index) + " STEPPER_MOTOR.py--> run_backward: Current stepcount is: ", self.stepcounter)
@@ -0,0 +1,181 @@
+"""
+This file offers offline (batch) processing of recorded images and videos with position_from_image
+
+The frames are spread over a multiprocessing pool; every worker keeps its own NeedleDetector (see image_proc2) and
+reads its own frames, so only file names, frame numbers and results travel between the processes:
+    - a directory of images: every task is one image file
+    - a video file: every task is a chunk of consecutive frames, which the worker decodes after seeking to its start
+    - a session recording (see session_recording.py): every task is a chunk of frames, read from the mapped files
+The results come back in frame order and are written while the batch runs (CSV) or at the end (NPZ).
+Nothing is shown on screen, so a batch can run headless.
+
+OpenCV-package required
+"""
+import csv
+import os
+import time
+import multiprocessing
+import cv2
+import numpy as np
+import src.util.logger as logger
+from src.image_pos.image_proc2 import position_from_image
+from src.image_pos.session_recording import SessionReader, is_session, session_paths
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+CSV_HEADER = ["frame", "source", "tip_x", "tip_y", "dir_x", "dir_y", "seconds"]
+
+
+class FrameResult:
+    """
+    Result of processing one frame.
+
+    Attributes
+    ----------
+    frame : int
+        Index of the frame in the batch (file order for a directory, frame number for a video)
+    source : str
+        Image file name, or the name of the video file
+    tip_position, tip_ori : tuple or None
+        Result of position_from_image, None when no lines were detected or the frame could not be read
+    seconds : float
+        Processing time of the frame (without reading or decoding it)
+    """
+
+    def __init__(self, frame, source, tip_position, tip_ori, seconds) -> None:
+        self.frame = frame
+        self.source = source
+        self.tip_position = tip_position
+        self.tip_ori = tip_ori
+        self.seconds = seconds
+
+    def row(self) -> list:
+        """
+        CSV row in the order of CSV_HEADER, with empty fields for a missing tip
+        """
+        tip = self.tip_position if self.tip_position is not None else ("", "")
+        ori = self.tip_ori if self.tip_ori is not None else ("", "")
+        return [self.frame, self.source, tip[0], tip[1], ori[0], ori[1], "{:.6f}".format(self.seconds)]
+
+
+def _process(frame_nr, source, image, settings) -> FrameResult:
+    configpath, flip, filtering = settings
+    if image is None:
+        return FrameResult(frame_nr, source, None, None, 0.0)
+    start = time.perf_counter()
+    tip_position, tip_ori = position_from_image(image, configpath, flip, filtering)
+    return FrameResult(frame_nr, source, tip_position, tip_ori, time.perf_counter() - start)
+
+
+def _init_worker() -> None:
+    # one OpenCV thread per worker process, the pool already uses every core
+    cv2.setNumThreads(1)
+
+
+def _image_task(task) -> list:
+    frame_nr, path, settings = task
+    return [_process(frame_nr, os.path.basename(path), cv2.imread(path), settings)]
+
+
+def _video_task(task) -> list:
+    path, start, count, settings = task
+    source = os.path.basename(path)
+    vidcap = cv2.VideoCapture(path)
+    vidcap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    results = []
+    for frame_nr in range(start, start + count):
+        success, frame = vidcap.read()
+        results.append(_process(frame_nr, source, frame if success else None, settings))
+    vidcap.release()
+    return results
+
+
+def _session_task(task) -> list:
+    path, start, count, settings = task
+    source = os.path.basename(session_paths(path)[0])
+    with SessionReader(path) as reader:
+        return [_process(frame_nr, source, frame, settings)
+                for frame, _, frame_nr in reader.frames(start, start + count)]
+
+
+def count_frames(path: str) -> int:
+    """
+    Number of frames in a video file, counted by decoding when the file does not state it
+    """
+    vidcap = cv2.VideoCapture(path)
+    if not vidcap.isOpened():
+        raise IOError("Could not open video file {}".format(path))
+    nr_of_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if nr_of_frames <= 0:
+        logger.info("BATCH: {} does not state its number of frames, counting them".format(path))
+        nr_of_frames = 0
+        while vidcap.grab():
+            nr_of_frames += 1
+    vidcap.release()
+    return nr_of_frames
+
+
+def batch_tasks(source: str, settings: tuple, chunk_size=64):
+    """
+    Returns (task function, list of tasks) for a directory of images, a session recording or a video file
+    """
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return _image_task, [(frame_nr, os.path.join(source, name), settings) for frame_nr, name in enumerate(names)]
+    if is_session(source):
+        with SessionReader(source) as reader:
+            nr_of_frames = len(reader)
+        return _session_task, [(source, start, min(chunk_size, nr_of_frames - start), settings)
+                               for start in range(0, nr_of_frames, chunk_size)]
+    nr_of_frames = count_frames(source)
+    return _video_task, [(source, start, min(chunk_size, nr_of_frames - start), settings)
+                         for start in range(0, nr_of_frames, chunk_size)]
+
+
+def process_batch(source: str, output: str, configpath: str, flip='no', filtering='no', workers=None,
+                  chunk_size=64) -> int:
+    """
+    Processes all images in the directory source (or all frames of the video file or session recording source)
+    with position_from_image in a pool of workers (default: one per core) and writes the results in frame order
+    to output.
+        - output ending in .npz: arrays frame, tip (N x 2), ori (N x 2) and seconds, NaN where no tip was found
+        - any other output: CSV file with the columns of CSV_HEADER, written while the batch runs
+    Returns the number of processed frames.
+    """
+    settings = (configpath, flip, filtering)
+    task, tasks = batch_tasks(source, settings, chunk_size)
+    workers = workers or os.cpu_count()
+    logger.info("BATCH: processing {} with {} worker(s)".format(source, workers))
+
+    as_npz = output.lower().endswith(".npz")
+    csv_file = None if as_npz else open(output, "w", newline="")
+    rows = []
+    processed = 0
+    start = time.perf_counter()
+    try:
+        if csv_file is not None:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_HEADER)
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            for results in pool.imap(task, tasks):
+                if csv_file is None:
+                    rows.extend(results)
+                else:
+                    writer.writerows(result.row() for result in results)
+                processed += len(results)
+                if processed % 500 < len(results):
+                    logger.info("BATCH: {} frames processed".format(processed))
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+
+    if as_npz:
+        missing = (np.nan, np.nan)
+        np.savez(output, frame=np.array([result.frame for result in rows], dtype=np.int64),
+                 source=np.array([result.source for result in rows]),
+                 tip=np.array([result.tip_position or missing for result in rows], dtype=np.float64).reshape(-1, 2),
+                 ori=np.array([result.tip_ori or missing for result in rows], dtype=np.float64).reshape(-1, 2),
+                 seconds=np.array([result.seconds for result in rows], dtype=np.float64))
+    elapsed = time.perf_counter() - start
+    logger.success("BATCH: {} frames in {:.1f} s ({:.1f} frames per second), results in {}".format(
+        processed, elapsed, processed / elapsed if elapsed > 0 else 0.0, output))
+    return processed
@@ -0,0 +1,136 @@
+"""
+This file offers a benchmark of every stage of the needle detection (see NeedleDetector in image_proc2)
+
+Synthetic camera frames with a bent needle are generated at several resolutions and noise levels, and
+NeedleDetector.detect is run on each of them with timing, so every stage of the detection is timed separately:
+    - gray: cv2.cvtColor to grayscale
+    - resize: reduce_size with INTER_CUBIC
+    - flip, lpf: only timed when the detector flips or filters
+    - canny, hough: edge mask and cv2.HoughLinesP
+    - post: merging, sorting and taking the tip of the lines (line_processing)
+    - total: the whole detect call (with tracking, the stages are summed over all windows that were processed)
+The report gives the 50th, 90th and 99th percentile of every stage and the frames per second of a case, and also
+how often a tip was found and its median distance (in processed image pixels) to the drawn tip, so a change that
+speeds up a stage can be checked for changing the results as well.
+Results are saved as JSON, and a later run can be compared with such a baseline to find regressions.
+
+OpenCV-package required
+"""
+import json
+import os
+import platform
+import cv2
+import numpy as np
+import src.util.logger as logger
+from src.image_pos.image_proc2 import NeedleDetector
+
+RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080), (3125, 1256))
+NOISE_LEVELS = (0, 10, 25)
+PERCENTILES = (50, 90, 99)
+
+
+def synthetic_needle_image(width: int, height: int, noise=0.0, seed=0) -> (np.ndarray, tuple):
+    """
+    BGR frame of a dark needle that enters at the left and bends down towards its tip at 3/4 of the width,
+    on a light background with a gradient and gaussian noise of standard deviation noise.
+    Returns the frame and the tip position in frame coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    background = np.linspace(150, 200, width, dtype=np.float32)[None, :].repeat(height, axis=0)
+    tip_x = int(0.75 * width)
+    xs = np.linspace(0, tip_x, 64)
+    ys = 0.4 * height + 0.1 * height * (xs / tip_x) ** 2
+    frame = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    points = np.round(np.stack((xs, ys), axis=1)).astype(np.int32)
+    cv2.polylines(frame, [points], False, (40, 40, 40), max(2, height // 150), cv2.LINE_AA)
+    if noise > 0:
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+    return np.clip(frame, 0, 255).astype(np.uint8), (int(points[-1, 0]), int(points[-1, 1]))
+
+
+def benchmark_case(detector, width, height, noise, repeats=30) -> dict:
+    """
+    Times detector.detect (with its stage_times) on repeats different frames of one resolution and noise level,
+    returns the percentiles (in ms) per stage, the frames per second and the detection results
+    """
+    samples = {}
+    errors = []
+    # one untimed frame so the buffers are allocated (and a tracking detector has a tip) before the first measurement
+    detector.last_tip = None
+    detector.detect(synthetic_needle_image(width, height, noise, seed=0)[0])
+    for repeat in range(repeats):
+        frame, tip = synthetic_needle_image(width, height, noise, seed=repeat)
+        tip_pos = detector.detect(frame)[0]
+        for stage, seconds in detector.stage_times.items():
+            samples.setdefault(stage, []).append(seconds)
+        if tip_pos is not None:
+            # distance in processed image pixels
+            tip_in_frame = detector.to_frame([tip_pos], frame.shape)[0]
+            errors.append(np.hypot(*(tip_in_frame - tip)) * detector.scale_percent / 100)
+
+    stages = {stage: {"p{}".format(q): float(np.percentile(values, q) * 1e3) for q in PERCENTILES}
+              for stage, values in samples.items()}
+    return {"width": width, "height": height, "noise": noise, "repeats": repeats, "stages": stages,
+            "fps": float(1 / np.mean(samples["total"])), "detected": len(errors) / repeats,
+            "median_tip_error": float(np.median(errors)) if errors else None}
+
+
+def run_benchmark(configpath: str, flip='no', filtering='yes', tracking='no', repeats=30, resolutions=RESOLUTIONS,
+                  noise_levels=NOISE_LEVELS) -> dict:
+    """
+    Benchmarks every combination of resolution and noise level with the [IMAGEPOS] settings of configpath.
+    With tracking the case names end in _tracking, so they are only compared with tracking cases of a baseline.
+    """
+    detector = NeedleDetector(configpath, 40, flip, filtering, tracking=tracking, timing='yes')
+    cases = {}
+    for width, height in resolutions:
+        for noise in noise_levels:
+            name = "{}x{}_noise{}".format(width, height, noise) + ("_tracking" if tracking == 'yes' else "")
+            cases[name] = benchmark_case(detector, width, height, noise, repeats)
+    return {"machine": {"platform": platform.platform(), "processor": platform.processor(),
+                        "cpu_count": os.cpu_count(), "opencv": cv2.__version__, "numpy": np.__version__},
+            "settings": {"flip": flip, "filtering": filtering, "tracking": tracking,
+                         "cv2_threads": cv2.getNumThreads()},
+            "cases": cases}
+
+
+def report(results: dict) -> None:
+    """
+    Logs a table with the p50 / p90 / p99 (ms) of every stage and the frames per second of every case
+    """
+    for name, case in results["cases"].items():
+        logger.info("{:<22} {:7.1f} fps, detected {:.0%}, tip error {}".format(
+            name, case["fps"], case["detected"],
+            "-" if case["median_tip_error"] is None else "{:.1f} px".format(case["median_tip_error"])))
+        for stage, percentiles in case["stages"].items():
+            logger.info("    {:<7} ".format(stage) + "  ".join(
+                "p{} {:7.3f} ms".format(q, percentiles["p{}".format(q)]) for q in PERCENTILES))
+
+
+def save_results(results: dict, path: str) -> None:
+    """
+    Writes the results as JSON to path, to be used as baseline of later runs
+    """
+    with open(path, "w") as json_file:
+        json.dump(results, json_file, indent=2)
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance=1.25, min_ms=0.05) -> list:
+    """
+    Returns a list of regressions: stages whose p50 is more than tolerance times the p50 of the baseline
+    (stages faster than min_ms in the baseline are ignored, their timing is mostly noise).
+    Cases that are not in the baseline are skipped.
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        if name not in baseline.get("cases", {}):
+            continue
+        base_stages = baseline["cases"][name]["stages"]
+        for stage, percentiles in case["stages"].items():
+            if stage not in base_stages or base_stages[stage]["p50"] < min_ms:
+                continue
+            ratio = percentiles["p50"] / base_stages[stage]["p50"]
+            if ratio > tolerance:
+                regressions.append("{} {}: p50 {:.3f} ms, baseline {:.3f} ms ({:.0%} slower)".format(
+                    name, stage, percentiles["p50"], base_stages[stage]["p50"], ratio - 1))
+    return regressions
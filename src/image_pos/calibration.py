@@ -0,0 +1,210 @@
+"""
+This file converts the pixel coordinates of a camera to millimetres on the plane of the needle
+
+The phone cameras have lens distortion and look at the needle plane at an angle. A CameraCalibration is computed once
+from photos of a chessboard and saved to a .npz file:
+    - the camera matrix and distortion coefficients (cv2.calibrateCamera on all chessboard photos)
+    - a homography from undistorted pixels to millimetres, from a photo of the chessboard lying on the needle plane
+    - the cv2.initUndistortRectifyMap lookup tables of the whole frame
+During a run no frame is warped: only the two end points of the tip segment are undistorted, in one vectorized
+cv2.undistortPoints call, and mapped to millimetres with the homography (see tip_to_mm). When an undistorted image
+is needed, remap_roi() remaps only a window of the frame with the stored lookup tables.
+
+OpenCV-package required
+"""
+import os
+import cv2
+import numpy as np
+import src.util.logger as logger
+
+
+def chessboard_points(pattern_size: tuple, square_size: float) -> np.ndarray:
+    """
+    Positions in millimetres of the inner corners of a chessboard of pattern_size (columns, rows), as an N x 3 array
+    in the order of cv2.findChessboardCorners
+    """
+    columns, rows = pattern_size
+    grid = np.mgrid[0:columns, 0:rows].T.reshape(-1, 2) * square_size
+    return np.hstack((grid, np.zeros((len(grid), 1)))).astype(np.float32)
+
+
+def find_chessboard(image, pattern_size: tuple):
+    """
+    Sub-pixel positions (N x 1 x 2) of the inner corners of the chessboard in image, None when it is not found
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    found, corners = cv2.findChessboardCorners(gray, pattern_size)
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+
+
+class CameraCalibration:
+    """
+    Lens and plane calibration of one camera, see the module docstring.
+
+    Attributes
+    ----------
+    camera_matrix, dist_coeffs : ndarray
+        Intrinsics of the camera (cv2.calibrateCamera)
+    new_camera_matrix : ndarray
+        Camera matrix of the undistorted pixels
+    homography : ndarray
+        3 x 3 transformation of undistorted pixels to millimetres on the needle plane
+    image_size : tuple
+        (width, height) of the calibrated frames
+    map1, map2 : ndarray
+        cv2.initUndistortRectifyMap lookup tables (CV_16SC2) of the whole frame
+    rms : float
+        Reprojection error of the lens calibration in pixels
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, new_camera_matrix, homography, image_size, map1=None, map2=None,
+                 rms=0.0) -> None:
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64)
+        self.new_camera_matrix = np.asarray(new_camera_matrix, dtype=np.float64)
+        self.homography = np.asarray(homography, dtype=np.float64)
+        self.image_size = tuple(int(value) for value in image_size)
+        if map1 is None or map2 is None:
+            map1, map2 = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                     self.new_camera_matrix, self.image_size, cv2.CV_16SC2)
+        self.map1 = map1
+        self.map2 = map2
+        self.rms = rms
+
+    @classmethod
+    def from_chessboards(cls, images: list, plane_image, pattern_size=(9, 6), square_size=1.0):
+        """
+        Calibrates the lens with the chessboard photos images and the plane with plane_image, a photo of the same
+        chessboard lying on the needle plane (square_size in millimetres). Raises a ValueError when the chessboard
+        is not found in enough photos or in plane_image.
+        """
+        object_points = chessboard_points(pattern_size, square_size)
+        found_object, found_image = [], []
+        image_size = None
+        for image in images:
+            corners = find_chessboard(image, pattern_size)
+            if corners is None:
+                continue
+            image_size = (image.shape[1], image.shape[0])
+            found_object.append(object_points)
+            found_image.append(corners)
+        if len(found_image) < 3:
+            raise ValueError("Chessboard of {} found in {} of the {} photos, at least 3 are needed".format(
+                pattern_size, len(found_image), len(images)))
+        rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(found_object, found_image, image_size,
+                                                                     None, None)
+        new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, image_size, 0)
+
+        plane_corners = find_chessboard(plane_image, pattern_size)
+        if plane_corners is None:
+            raise ValueError("Chessboard of {} not found in the photo of the needle plane".format(pattern_size))
+        undistorted = cv2.undistortPoints(plane_corners, camera_matrix, dist_coeffs, P=new_camera_matrix)
+        homography, _ = cv2.findHomography(undistorted.reshape(-1, 2), object_points[:, :2])
+        return cls(camera_matrix, dist_coeffs, new_camera_matrix, homography, image_size, rms=rms)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the calibration, with its lookup tables, to the .npz file path
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, camera_matrix=self.camera_matrix, dist_coeffs=self.dist_coeffs,
+                            new_camera_matrix=self.new_camera_matrix, homography=self.homography,
+                            image_size=np.array(self.image_size), map1=self.map1, map2=self.map2,
+                            rms=np.array(self.rms))
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Reads a calibration written by save()
+        """
+        with np.load(path) as data:
+            return cls(data["camera_matrix"], data["dist_coeffs"], data["new_camera_matrix"], data["homography"],
+                       data["image_size"], data["map1"], data["map2"], float(data["rms"]))
+
+    def undistort_points(self, points) -> np.ndarray:
+        """
+        Undistorted pixel positions (N x 2) of the frame pixel positions points (N x 2), in one call
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs,
+                                   P=self.new_camera_matrix).reshape(-1, 2)
+
+    def points_to_mm(self, points) -> np.ndarray:
+        """
+        Positions in millimetres on the needle plane (N x 2) of the frame pixel positions points (N x 2)
+        """
+        undistorted = self.undistort_points(points).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(undistorted, self.homography).reshape(-1, 2)
+
+    def check_frame(self, frame_shape) -> None:
+        """
+        Raises a ValueError when frames of frame_shape do not have the size of the calibrated frames
+        """
+        if (frame_shape[1], frame_shape[0]) != self.image_size:
+            raise ValueError("Frames of {}x{} pixels do not fit a calibration of {}x{} pixels".format(
+                frame_shape[1], frame_shape[0], *self.image_size))
+
+    def tip_to_mm(self, detector, frame_shape, tip_pos, tip_dir) -> (tuple, tuple):
+        """
+        Converts the (tip_pos, tip_dir) of NeedleDetector detector, in its processed image coordinates of a frame of
+        frame_shape, to the position in millimetres and the unit direction on the needle plane. Only the end points
+        of the tip segment are converted. Returns (None, None) when there is no tip or its direction has no length,
+        and raises a ValueError for a frame of another size than the calibrated frames.
+        """
+        self.check_frame(frame_shape)
+        if tip_pos is None:
+            return None, None
+        segments = np.asarray(detector.sorted_lines, dtype=np.float64).reshape(-1, 4)
+        tip_segments = segments[(segments[:, 2] == tip_pos[0]) & (segments[:, 3] == tip_pos[1])]
+        if len(tip_segments) and tuple(tip_segments[-1, 0:2]) != tuple(tip_pos):
+            start = tip_segments[-1, 0:2]
+        else:
+            start = np.asarray(tip_pos, dtype=np.float64) - 20 * np.asarray(tip_dir, dtype=np.float64)
+        start_mm, tip_mm = self.points_to_mm(detector.to_frame(np.vstack((start, tip_pos)), frame_shape))
+        direction = tip_mm - start_mm
+        norm = np.hypot(*direction)
+        if norm == 0:
+            return None, None
+        return (float(tip_mm[0]), float(tip_mm[1])), (float(direction[0] / norm), float(direction[1] / norm))
+
+    def remap_roi(self, frame, roi) -> np.ndarray:
+        """
+        Undistorted image of the window roi (x0, y0, x1, y1) in undistorted pixels, remapped from frame with the
+        part of the lookup tables of that window only
+        """
+        self.check_frame(frame.shape)
+        x0, y0, x1, y1 = (int(value) for value in roi)
+        return cv2.remap(frame, self.map1[y0:y1, x0:x1], self.map2[y0:y1, x0:x1], cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_REPLICATE)
+
+
+def calibrate_directory(directory: str, plane_path="", pattern_size=(9, 6), square_size=1.0):
+    """
+    CameraCalibration from all chessboard photos in directory; the plane is calibrated with the photo plane_path
+    (default: the first photo of the directory)
+    """
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+    images = [cv2.imread(os.path.join(directory, name)) for name in names]
+    images = [image for image in images if image is not None]
+    if not images:
+        raise ValueError("No photos found in {}".format(directory))
+    plane_image = cv2.imread(plane_path) if plane_path else images[0]
+    if plane_image is None:
+        raise ValueError("Could not read the photo of the needle plane {}".format(plane_path))
+    return CameraCalibration.from_chessboards(images, plane_image, pattern_size, square_size)
+
+
+def load_calibration(path: str):
+    """
+    CameraCalibration of the .npz file path, None for an empty path or a missing file (the tips stay in pixels)
+    """
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        logger.error("Calibration {} not found, tip positions stay in pixels".format(path))
+        return None
+    return CameraCalibration.load(path)
@@ -0,0 +1,263 @@
+"""
+This file offers the needle detection of a live camera feed in several processes
+
+The camera process copies every frame to be processed into a ring of frame slots in shared memory
+(multiprocessing.shared_memory), so the frames themselves are never pickled:
+    - submit(): writes the frame into a free slot and puts (sequence number, slot) in the task queue
+    - every worker process keeps its own NeedleDetector (see image_proc2) and reads the frame from its slot.
+      With tracking, a worker only sees the frames it detects itself, so its last_tip can be several frames old:
+      the windows are tracked from that tip, and a tip that moved more than track_jump since then is detected in
+      the whole frame
+    - results(): the results come back in any order; the frame is copied out of its slot, which is then free again,
+      and the results are handed out in the order of the sequence numbers
+    - reuse(): a frame that does not have to be detected (see motion_gate.py) takes the next sequence number without
+      a slot or a worker; when its turn comes it is handed out with the tip of the frame handed out before it
+With workers <= 1 the frames are detected in the calling process, without shared memory.
+With a calibration file the tips are converted to millimetres on the needle plane (see calibration.py).
+
+OpenCV-package required
+"""
+import heapq
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+import src.util.logger as logger
+from src.image_pos.calibration import load_calibration
+from src.image_pos.image_proc2 import NeedleDetector
+from src.image_pos.render import Detection
+
+
+class DetectionResult:
+    """
+    Detection of one submitted frame.
+
+    Attributes
+    ----------
+    sequence : int
+        Number of the frame in the order it was submitted
+    frame : ndarray
+        The frame (a copy of the shared memory slot when detected by a worker)
+    frame_time : float
+        time.monotonic() at which the frame was taken
+    frame_nr : int
+        Frame number in the video feed
+    tip_position, tip_ori : tuple or None
+        Result of NeedleDetector.detect (in millimetres with a calibration), None when no lines were detected
+    detection : Detection
+        Lines and window of the detection, for drawing
+    seconds : float
+        Processing time of the frame
+    reused : bool
+        True when the frame was not detected but reuses the result of the frame before it (see DetectionPool.reuse)
+    """
+
+    def __init__(self, sequence, frame, frame_time, frame_nr, tip_position, tip_ori, detection, seconds,
+                 reused=False) -> None:
+        self.sequence = sequence
+        self.frame = frame
+        self.frame_time = frame_time
+        self.frame_nr = frame_nr
+        self.tip_position = tip_position
+        self.tip_ori = tip_ori
+        self.detection = detection
+        self.seconds = seconds
+        self.reused = reused
+
+
+def _detect(detector, frame, calibration):
+    start = time.perf_counter()
+    tip_position, tip_ori = detector.detect(frame)
+    detection = Detection(detector, frame.shape, tip_position, tip_ori)
+    if calibration is not None:
+        tip_position, tip_ori = calibration.tip_to_mm(detector, frame.shape, tip_position, tip_ori)
+    return tip_position, tip_ori, detection, time.perf_counter() - start
+
+
+def _worker(memory, shape, dtype, slots, configpath, options, calibration_path, tasks, results) -> None:
+    # one OpenCV thread per worker process, the workers already use the cores
+    cv2.setNumThreads(1)
+    frames = np.ndarray((slots,) + shape, dtype=dtype, buffer=memory.buf)
+    detector = NeedleDetector(configpath, **options)
+    calibration = load_calibration(calibration_path)
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            try:
+                task = tasks.get(timeout=0.5)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():  # camera process was terminated
+                    break
+                continue
+            if task is None:
+                break
+            sequence, slot = task
+            results.put((sequence,) + _detect(detector, frames[slot], calibration))
+    finally:
+        del frames
+        memory.close()
+
+
+class DetectionPool:
+    """
+    Detects the needle in the submitted frames with several processes and hands out the results in order,
+    see the module docstring.
+
+    Attributes
+    ----------
+    workers : int
+        Number of detection processes, <= 1 to detect in the calling process
+    configpath : str
+        Path to config.ini of the NeedleDetectors
+    options : dict
+        Keyword arguments of the NeedleDetectors (flip, filtering, tracking)
+    calibration_path : str
+        CameraCalibration file to convert the tips to millimetres with, "" to keep them in pixels
+    slots : int
+        Number of frames in the shared memory ring, at least the number of workers
+    """
+
+    def __init__(self, workers: int, configpath: str, slots=None, calibration_path="", **options) -> None:
+        self.workers = workers
+        self.configpath = configpath
+        self.options = options
+        self.calibration_path = calibration_path
+        self.slots = max(slots or 0, workers, 1)
+        self._submitted = 0
+        self._handed_out = 0
+        self._free = list(range(self.slots))
+        self._pending = []  # heap of results waiting for an earlier sequence number
+        self._reused = {}   # sequence number -> (frame, frame_time, frame_nr) of the frames that reuse a result
+        self._last = (None, None, None)  # tip_position, tip_ori and detection of the last handed out detection
+        self._times = {}
+        self._memory = None
+        self._frames = None
+        self._processes = []
+        self._tasks = None
+        self._results = None
+        self._detector = None
+        self._calibration = None
+
+    def _start(self, frame) -> None:
+        # a calibration of another frame size raises here, before any worker is started
+        calibration = load_calibration(self.calibration_path)
+        if calibration is not None:
+            calibration.check_frame(frame.shape)
+        if self.workers <= 1:
+            self._detector = NeedleDetector(self.configpath, **self.options)
+            self._calibration = calibration
+            return
+        self._memory = shared_memory.SharedMemory(create=True, size=self.slots * frame.nbytes)
+        self._frames = np.ndarray((self.slots,) + frame.shape, dtype=frame.dtype, buffer=self._memory.buf)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        for number in range(self.workers):
+            process = multiprocessing.Process(
+                target=_worker, name="DetectionPool_worker_{}".format(number), daemon=True,
+                args=(self._memory, frame.shape, frame.dtype, self.slots, self.configpath, self.options,
+                      self.calibration_path, self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+        logger.info("DetectionPool: {} detection processes, {} frame slots of {:.1f} MB".format(
+            self.workers, self.slots, frame.nbytes / 1e6))
+
+    def stop(self) -> None:
+        """
+        Stops the worker processes and frees the shared memory
+        """
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if self._memory is not None:
+            self._frames = None
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of submitted frames of which the result has not come back yet
+        """
+        return self._submitted - self._handed_out - len(self._pending) - len(self._reused)
+
+    def ready(self) -> bool:
+        """
+        True when a submitted frame is detected right away: a worker is free and so is a slot
+        """
+        if self.workers <= 1:
+            return True
+        return self.in_flight < self.workers and len(self._free) > 0
+
+    def submit(self, frame, frame_time: float, frame_nr: int) -> bool:
+        """
+        Starts the detection of frame. Returns False (and drops the frame) when there is no free slot
+        or the frame size differs from the first frame.
+        """
+        if self._detector is None and self._memory is None:
+            self._start(frame)
+        sequence = self._submitted
+        if self.workers <= 1:
+            self._submitted += 1
+            heapq.heappush(self._pending, (sequence, DetectionResult(
+                sequence, frame, frame_time, frame_nr, *_detect(self._detector, frame, self._calibration))))
+            return True
+        if not self._free:
+            return False
+        if frame.shape != self._frames.shape[1:] or frame.dtype != self._frames.dtype:
+            logger.error("DetectionPool: frame of {} does not fit the slots of {}".format(
+                frame.shape, self._frames.shape[1:]))
+            return False
+        slot = self._free.pop()
+        self._frames[slot] = frame
+        self._times[sequence] = (slot, frame_time, frame_nr)
+        self._submitted += 1
+        self._tasks.put((sequence, slot))
+        return True
+
+    def reuse(self, frame, frame_time: float, frame_nr: int) -> None:
+        """
+        Adds frame without detecting it: it is handed out by results() after the frames submitted before it, with
+        their last tip_position, tip_ori and detection
+        """
+        self._reused[self._submitted] = (frame, frame_time, frame_nr)
+        self._submitted += 1
+
+    def results(self, timeout=0.0) -> list:
+        """
+        Results that are finished, in the order the frames were submitted. Waits at most timeout seconds for
+        a result when none is available.
+        """
+        if self.workers > 1:
+            block = True
+            while self._handed_out + len(self._pending) + len(self._reused) < self._submitted:
+                try:
+                    item = self._results.get(block=block and timeout > 0, timeout=timeout if block else None)
+                except queue.Empty:
+                    break
+                block = False
+                sequence = item[0]
+                slot, frame_time, frame_nr = self._times.pop(sequence)
+                result = DetectionResult(sequence, self._frames[slot].copy(), frame_time, frame_nr, *item[1:])
+                self._free.append(slot)
+                heapq.heappush(self._pending, (sequence, result))
+
+        ordered = []
+        while True:
+            if self._handed_out in self._reused:
+                frame, frame_time, frame_nr = self._reused.pop(self._handed_out)
+                result = DetectionResult(self._handed_out, frame, frame_time, frame_nr, *self._last, 0.0, reused=True)
+            elif self._pending and self._pending[0][0] == self._handed_out:
+                result = heapq.heappop(self._pending)[1]
+                self._last = (result.tip_position, result.tip_ori, result.detection)
+            else:
+                break
+            ordered.append(result)
+            self._handed_out += 1
+        return ordered
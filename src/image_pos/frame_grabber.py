@@ -0,0 +1,150 @@
+"""
+This file offers a thread that reads a video feed continuously, so the detector always gets the newest frame
+
+cv2.VideoCapture.read() both grabs and decodes a frame. When frames are only read between two detections, the
+network stream buffers the frames in the meantime and the next read() returns a stale one. The FrameGrabber calls
+grab() for every frame as soon as it arrives and only decodes (retrieve()) the frames that are used:
+    - for processing: a frame that is due according to the FrameScheduler, when the detector asked for one
+    - for display: at most display_fps frames per second, handed to a FrameRenderer
+A session recording (optional) gets the frames that are decoded anyway, for processing or display, with their grab
+time, so recording does not decode any extra frames.
+A processing frame is put in a single slot that the next frame overwrites, so a slow detector skips frames instead
+of falling behind.
+
+OpenCV-package required
+"""
+import os
+import threading
+import time
+import cv2
+import src.util.logger as logger
+
+
+class FrameGrabber:
+    """
+    Background thread that grabs every frame of a cv2.VideoCapture, see the module docstring.
+
+    Attributes
+    ----------
+    vidcap : cv2.VideoCapture
+        Opened video feed
+    scheduler : FrameScheduler
+        Chooses the frames that are processed and counts the frames dropped because the detector was busy
+    renderer : FrameRenderer or None
+        Receives the display frames, None to not decode frames for display
+    display_fps : float
+        Largest number of frames per second decoded for the renderer
+    recorder : SessionRecorder or None
+        Receives every decoded frame, None to not record them
+    pace : float
+        Frames per second to read a video file at (its own frame rate), 0 for a live feed that is read as fast as
+        frames arrive
+    ended : bool
+        True when the feed could not be read anymore
+    grabbed, retrieved : int
+        Number of grabbed frames and of frames that were decoded
+    """
+
+    def __init__(self, vidcap, scheduler, renderer=None, display_fps=15, pace=0.0, recorder=None) -> None:
+        self.vidcap = vidcap
+        self.scheduler = scheduler
+        self.renderer = renderer
+        self.recorder = recorder
+        self.display_fps = display_fps
+        self.pace = pace
+        self.ended = False
+        self.is_running = False
+        self.grabbed = 0
+        self.retrieved = 0
+        self._wanted = False
+        self._slot = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def file_pace(source: str, vidcap) -> float:
+        """
+        Frame rate to read source at: the frame rate of a video file, 0 for a camera or network stream
+        """
+        if os.path.isfile(source):
+            return vidcap.get(cv2.CAP_PROP_FPS) or 25.0
+        return 0.0
+
+    def start(self) -> None:
+        """
+        Starts the grabber thread
+        """
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber_thread", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the grabber thread, the video feed is not released
+        """
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def latest(self, timeout=None):
+        """
+        Asks for a frame to process and waits until it is decoded.
+        Returns (frame, frame_time, frame_nr), with frame_time the time.monotonic() at which it was grabbed,
+        or None on timeout or when the feed ended.
+        """
+        with self._condition:
+            self._wanted = True
+            if self._slot is None:
+                self._condition.wait_for(lambda: self._slot is not None or self.ended or not self.is_running,
+                                         timeout)
+            slot, self._slot = self._slot, None
+            return slot
+
+    def _run(self) -> None:
+        display_interval = 1 / self.display_fps
+        next_display = next_grab = time.monotonic()
+        while self.is_running:
+            if self.pace > 0:
+                # a video file is read at its own frame rate, like a camera
+                next_grab += 1 / self.pace
+                time.sleep(max(0.0, next_grab - time.monotonic()))
+            if not self.vidcap.grab():
+                logger.error("FrameGrabber: not able to grab a frame from the video feed")
+                break
+            now = time.monotonic()
+            self.grabbed += 1
+            for_processing = self.scheduler.due(now)
+            if for_processing:
+                with self._condition:
+                    wanted = self._wanted
+                if wanted:
+                    self.scheduler.take(now)
+                else:
+                    # the detector is still busy: this frame is skipped instead of waiting for it
+                    self.scheduler.drop(now)
+                    for_processing = False
+            for_display = self.renderer is not None and now >= next_display
+            if not (for_processing or for_display):
+                continue
+
+            success, frame = self.vidcap.retrieve()
+            if not success:
+                continue
+            self.retrieved += 1
+            if self.recorder is not None:
+                self.recorder.submit(frame, now, self.grabbed - 1)
+            if for_processing:
+                with self._condition:
+                    self._slot = (frame, now, self.grabbed - 1)
+                    self._wanted = False
+                    self._condition.notify_all()
+            elif for_display:
+                # frames for processing are shown by the acquisition loop together with their detection
+                next_display = max(next_display + display_interval, now)
+                self.renderer.submit(frame)
+
+        with self._condition:
+            self.ended = True
+            self._condition.notify_all()
@@ -0,0 +1,129 @@
+"""
+This file offers the choice of the moments a camera frame is processed, on a monotonic clock
+
+The FrameGrabber asks due() for every grabbed frame. A frame that is due is processed when a detector is free for
+it; otherwise the moment is dropped and counted, instead of queueing an old frame. The detection time of every
+processed frame is reported with finished(), and the rate follows what the detectors can sustain:
+    rate = min(max_rate, headroom * workers / latency)
+with latency the smoothed detection time. So the rate goes down when the detection gets slower (a larger window,
+a busy CPU) and up again, at most to max_rate (--fps), when it gets faster.
+"""
+import collections
+import threading
+import time
+
+
+class FrameScheduler:
+    """
+    Adaptive processing rate of a video feed, see the module docstring.
+
+    Attributes
+    ----------
+    max_rate : float
+        Largest number of processed frames per second, inf to process as many as the detectors can
+    workers : int
+        Number of frames that are detected at the same time
+    headroom : float
+        Part of the detector time that is used, so a slower frame does not immediately cause a drop
+    smoothing : float
+        Weight of the newest detection time in the smoothed latency
+    latency : float or None
+        Smoothed detection time in seconds, None before the first detection
+    rate : float
+        Current processing rate in frames per second
+    processed, dropped : int
+        Number of processed frames and of moments a frame was due while no detector was free
+    """
+
+    def __init__(self, max_rate: float, workers=1, headroom=0.8, smoothing=0.2, clock=time) -> None:
+        self.max_rate = max_rate if max_rate and max_rate > 0 else float("inf")
+        self.workers = max(workers, 1)
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.clock = clock
+        self.latency = None
+        # until the first detection time is known, an unlimited rate starts at one frame per second
+        self.rate = self.max_rate if self.max_rate != float("inf") else 1.0
+        self.processed = 0
+        self.dropped = 0
+        self._next = None
+        self._taken = collections.deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    def due(self, now=None) -> bool:
+        """
+        True when a frame grabbed at now should be processed
+        """
+        now = self.clock.monotonic() if now is None else now
+        with self._lock:
+            return self._next is None or now >= self._next
+
+    def take(self, now=None) -> None:
+        """
+        Registers that the frame grabbed at now (which was due) is processed
+        """
+        now = self.clock.monotonic() if now is None else now
+        with self._lock:
+            self._advance(now)
+            self._taken.append(now)
+            self.processed += 1
+
+    def drop(self, now=None) -> None:
+        """
+        Registers that the frame grabbed at now (which was due) is not processed, because no detector is free
+        """
+        now = self.clock.monotonic() if now is None else now
+        with self._lock:
+            self._advance(now)
+            self.dropped += 1
+
+    def discard(self, now=None) -> None:
+        """
+        Registers that the frame grabbed at now, which was taken, could not be processed after all (the detectors
+        refused it): it is counted as dropped instead of processed
+        """
+        now = self.clock.monotonic() if now is None else now
+        with self._lock:
+            if self._taken and self._taken[-1] == now:
+                self._taken.pop()
+            self.processed -= 1
+            self.dropped += 1
+
+    def _advance(self, now) -> None:
+        interval = 1 / self.rate
+        # after a stall of more than one interval the schedule restarts at now: the missed moments are not made up
+        # with a burst of frames, and the next frame is due one interval later, not right away
+        if self._next is None or self._next + interval < now:
+            self._next = now + interval
+        else:
+            self._next += interval
+
+    def finished(self, seconds: float) -> None:
+        """
+        Reports the detection time of a processed frame and adapts the rate to it
+        """
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.smoothing * (seconds - self.latency)
+            sustainable = self.headroom * self.workers / max(self.latency, 1e-6)
+            self.rate = min(self.max_rate, sustainable)
+
+    @property
+    def achieved_rate(self) -> float:
+        """
+        Number of frames per second processed over the last 20 processed frames
+        """
+        with self._lock:
+            if len(self._taken) < 2 or self._taken[-1] <= self._taken[0]:
+                return 0.0
+            return (len(self._taken) - 1) / (self._taken[-1] - self._taken[0])
+
+    def summary(self) -> str:
+        """
+        One line with the rates, the latency and the dropped frames, for the log
+        """
+        latency = "-" if self.latency is None else "{:.1f} ms".format(self.latency * 1000)
+        return "processing {:.1f} frames per second (rate {:.1f}, max {}), detection {}, {} processed, {} dropped"\
+            .format(self.achieved_rate, self.rate, self.max_rate, latency, self.processed, self.dropped)
@@ -4,12 +4,21 @@ This file finds the X,Y coordinates of the needle and the orientation of its tip
     - Process image
     - Return data to Main Program Loop
 """
-from queue import Queue
+import os
 import time
 import multiprocessing
+from configparser import ConfigParser
 import cv2
 from src.util import logger
-from src.image_pos.image_proc2 import position_from_image
+from src.image_pos.detection_pool import DetectionPool
+from src.image_pos.frame_grabber import FrameGrabber
+from src.image_pos.frame_scheduler import FrameScheduler
+from src.image_pos.motion_gate import GateSettings, MotionGate
+from src.image_pos.render import FrameRenderer
+from src.image_pos.session_recording import SessionRecorder, session_paths
+from src.image_pos.stereo import StereoPairer, StereoSettings
+
+REPORT_INTERVAL = 10  # seconds between the logged processing rates
 
 class ImageAcquisition:
     """
@@ -18,40 +27,66 @@ class ImageAcquisition:
 
     The user defines the number of times per second the video footage is used to calculate position,
     and these frames are then processed to obtain a needle tip position and orientation.
+    A FrameGrabber reads the feed in a background thread, so the newest frame is processed instead of a buffered one.
+    The frames can be processed by several processes at the same time (see detection_pool.py).
+    Showing the feed with the detected lines (and recording it) is done by a FrameRenderer in background threads,
+    so it does not delay the detection.
 
-    Needle tip position and orientation is communicated back to the Main Process.
+    Needle tip position and orientation is communicated back to the Main Process, together with the time.monotonic()
+    at which the frame was read, so the main process can fuse it with the motor moves (see tip_tracker.py).
+    With a front camera as well, the tips of both cameras are combined into (x, y, z) positions and orientations.
 
     Attributes
     ----------
     top_vid_link : str
         Link or path to video feed of the top camera
+    front_vid_link : str
+        Link or path to video feed of the front camera, "" to only use the top camera
     images_per_second : int
-        Number that represents the number of times per second a video frame is processed to determine needle pos/ori
+        Largest number of times per second a video frame is processed to determine needle pos/ori, 0 for as many
+        as the detection can keep up with
     no_cam_feed : bool
         Boolean from input args that determines if the live video stream is displayed.
+    record_dir : str
+        Directory to which the processed frames with their detection overlay are written, "" to not record them
+    detectors : int
+        Number of processes that detect the needle, 1 to detect in the process of the video feed
+    session : str
+        Path of the session recording the processed and shown frames are written to, "" to not record them
+    moved : multiprocessing.Value
+        Time.monotonic() at which the last motor move ends, set by the main process (StepScheduler.motion)
     is_running : bool
         Boolean that can be used to signal the termination of Processes that use this Class.
     """
 
-    def __init__(self, images_per_second: int, top_camera: str, front_camera: str, no_cam_feed: bool) -> None:
+    def __init__(self, images_per_second: int, top_camera: str, front_camera: str, no_cam_feed: bool,
+                 record_dir="", detectors=1, session="") -> None:
         if top_camera == "" and front_camera == "":
             logger.error(
                 "No URL or Path to camera's were given --> Not able to provide visual feedback")
 
-        self.top_vid_link = "http://192.168.43.1:8080/video"
+        self.top_vid_link = top_camera if top_camera != "" else "http://192.168.43.1:8080/video"
+        self.front_vid_link = front_camera
 
         self.images_per_second = images_per_second
         self.no_cam_feed = no_cam_feed
+        self.record_dir = record_dir
+        self.detectors = detectors
+        self.session = session
+        # end time of the last motor move, written by the StepScheduler of the main process (see motion_gate.py)
+        self.moved = multiprocessing.Value("d", float("-inf"))
 
         self.is_running = True  # Bool to be modified from main loop, that ends loop
 
     def retrieve_current_image(self, needle_pos_feed: multiprocessing.Queue) -> None:
         """ Retrieves and processes video feed, then sends needle pos/ori back to main Process.
+        With a front camera both feeds are processed in their own process and their tips are paired into
+        3D positions and orientations (see stereo.py).
 
         Parameters
         ----------
         needle_pos_feed : multiprocessing.Queue
-            Queue to pass needle position and orientation to main Process.
+            Queue to pass needle position, orientation and frame time to main Process.
 
         Raises
         ------
@@ -62,74 +97,150 @@ class ImageAcquisition:
         -------
         None
         """
-
-        # Create Queue of size 10 that is used for image acq/proc
-        video_feed = Queue(maxsize=10)
-
-        top_vidcap = cv2.VideoCapture(self.top_vid_link)
-
-        process_frame = self.fps_to_images_per_second(top_vidcap.get(cv2.CAP_PROP_FPS))
-
-        while self.is_running:
-            # Image Acquisition
-            frame_nr = top_vidcap.get(1)  # Current frame of the video feed
-            success, frame = top_vidcap.read() # Retrieve frame from video feed
-
-            if success:
-                # If camera feed is shown (nofeed == false)
-                if not self.no_cam_feed:
-
-                    cv2.imshow("Top Camera Feed", frame)
-
-                    if cv2.waitKey(1) == 27:  # Escape Key exits loop
-                        logger.error("Exiting Video Acquisition Process.")
-                        top_vidcap.release()
-                        cv2.destroyAllWindows()
-                        # Sentinel Value to end main program loop
-                        needle_pos_feed.put((None, None))
-                        break
-
-                # Only send a certain few frames per second to processing
-                if frame_nr % process_frame == 0:
-                    video_feed.put(frame)
-
-            else:
-                logger.error("Not able to retrieve image from VideoCapture Object. Exiting Process.")
-                top_vidcap.release()
-                cv2.destroyAllWindows()
-                needle_pos_feed.put((None, None)) # Can't open video feed, send Sentinel value to Main Process
-                break
-
-            # Image Processing
-            if not video_feed.empty(): # Check queue if an image can be processed
-
-                current_frame = video_feed.get()
-
-                # Retrieve needle tip and orientation and measure processing time.
-                start = time.time()
-                tip_position, tip_ori = position_from_image(
-                    current_frame, "config.ini", flip='yes', filtering='yes', show='yes')
-                end = time.time()
-
-                logger.success("processing took {}".format((end - start)))
-
-                if tip_position is None or tip_ori is None: # No lines detected, so don't get pos and ori
-                    continue
-
-                # Send Needle position and orientation back to main process.
-                needle_pos_feed.put((tip_position, tip_ori))
-
-    def fps_to_images_per_second(self, video_fps: int) -> int:
-        """ Calculates the Number of images per second sent to processing, expressed in nr of frames between images.
-        (So 25 fps and 2 images per second leads to one image every 12 frames, for example)
+        if self.front_vid_link == "":
+            self.process_camera(self.top_vid_link, "Top Camera Feed", self.record_dir, self.session, needle_pos_feed)
+            return
+
+        camera_feed = multiprocessing.Queue(maxsize=0)
+        stop = multiprocessing.Event()
+        processes = []
+        for camera, link in (("top", self.top_vid_link), ("front", self.front_vid_link)):
+            record_dir = os.path.join(self.record_dir, camera) if self.record_dir else ""
+            session = "{}_{}".format(os.path.splitext(session_paths(self.session)[0])[0], camera) \
+                if self.session else ""
+            process = multiprocessing.Process(
+                target=self.process_camera, name="ImageAcquiProc_{}".format(camera),
+                args=(link, "{} Camera Feed".format(camera.capitalize()), record_dir, session, camera_feed, camera,
+                      stop))
+            process.start()
+            processes.append(process)
+
+        config_object = ConfigParser()
+        config_object.read("config.ini")
+        pairer = StereoPairer(StereoSettings.from_config(config_object))
+        while True:
+            camera, tip_position, tip_ori, frame_time = camera_feed.get()
+            if tip_position is None and tip_ori is None: # Sentinel value: the camera stopped
+                if camera == "top":
+                    break
+                logger.error("Front camera stopped, continuing with the top camera only.")
+                continue
+            estimate = pairer.add(camera, tip_position, tip_ori, frame_time)
+            if estimate is not None:
+                needle_pos_feed.put(estimate)
+
+        stop.set()
+        for process in processes:
+            process.join()
+        logger.info("Cameras: {} tips paired, {} without a tip of the other camera".format(
+            pairer.paired, pairer.unpaired))
+        # Sentinel Value to end main program loop
+        needle_pos_feed.put((None, None, None))
+
+    def process_camera(self, vid_link: str, window: str, record_dir: str, session: str,
+                       pos_feed: multiprocessing.Queue, camera=None, stop=None) -> None:
+        """ Retrieves and processes one video feed and sends its needle pos/ori to pos_feed.
 
         Parameters
         ----------
-        video_fps : int
-            The frames per second of the opened video feed
+        vid_link : str
+            Link or path to the video feed
+        window : str
+            Name of the window that shows the feed
+        record_dir : str
+            Directory the processed frames are written to, "" to not record them
+        session : str
+            Path of the session recording all frames are written to, "" to not record them
+        pos_feed : multiprocessing.Queue
+            Queue that receives (tip_position, tip_ori, frame_time), and (None, None, None) when the feed stops
+        camera : str
+            Name of the camera put in front of every item of pos_feed, None to send the items without it
+        stop : multiprocessing.Event
+            Stops the feed when set, None to only stop on the Escape key or the end of the feed
 
         Returns
         -------
-        The number of times per second a frame will be sent to processing.
+        None
         """
-        return video_fps / self.images_per_second
+        vidcap = cv2.VideoCapture(vid_link)
+        # Settings and image buffers are kept for the whole stream, config.ini is only read again when it changes.
+        # After the first detection only a window around the last tip position is processed (see NeedleDetector).
+        # With more than one detector the frames are detected by that many processes, which read them from shared
+        # memory (see DetectionPool)
+        # With a calibration of the camera in the [CAMERAS] section the tips are sent in millimetres
+        config_object = ConfigParser()
+        config_object.read("config.ini")
+        calibration = config_object.get("CAMERAS", "{}_calibration".format(camera or "top"), fallback="")
+        pool = DetectionPool(self.detectors, "config.ini", calibration_path=calibration, flip='yes',
+                             filtering='yes', tracking='yes')
+
+        # Shows the feed (if nofeed == false) at a capped rate and records processed frames, in background threads
+        renderer = FrameRenderer(window, show=not self.no_cam_feed, record_dir=record_dir)
+        renderer.start()
+
+        # Grabs every frame as it arrives and only decodes the newest one when the detector is ready for it
+        # (and the frames that are shown), so the detection never works on a frame that waited in a buffer
+        # The frames are processed at --fps, or less when the detection cannot keep up (see FrameScheduler)
+        scheduler = FrameScheduler(self.images_per_second, workers=self.detectors)
+        # The processed and shown frames are written to the session recording by a background thread
+        recorder = SessionRecorder(session) if session else None
+        if recorder is not None:
+            recorder.start()
+        grabber = FrameGrabber(vidcap, scheduler, renderer if renderer.show else None,
+                               renderer.max_fps, FrameGrabber.file_pace(vid_link, vidcap), recorder)
+        grabber.start()
+
+        # Frames that did not change since the last submitted frame (and no motor moved) reuse its tip, in frame order
+        gate = MotionGate(GateSettings.from_config(config_object), self.moved)
+
+        tag = () if camera is None else (camera,)
+        next_report = time.monotonic() + REPORT_INTERVAL
+        parent = multiprocessing.parent_process() if stop is not None else None
+        while self.is_running:
+            if renderer.escape_pressed.is_set():  # Escape Key exits loop
+                logger.error("Exiting Video Acquisition Process.")
+                break
+            if stop is not None and (stop.is_set() or not parent.is_alive()):
+                break
+            if time.monotonic() >= next_report:
+                logger.info("{}: {}".format(window, scheduler.summary()))
+                next_report += REPORT_INTERVAL
+
+            # Image Acquisition, only when a detector is free to process the frame
+            if pool.ready():
+                latest = grabber.latest(timeout=0.01 if pool.in_flight else 0.1)
+                if latest is not None:
+                    if gate.check(latest[0], latest[1]):
+                        pool.reuse(*latest)
+                    elif pool.submit(*latest):
+                        gate.submitted(latest[0], latest[1])
+                    else:
+                        scheduler.discard(latest[1])
+                elif grabber.ended:
+                    logger.error("Not able to retrieve image from VideoCapture Object. Exiting Process.")
+                    break
+
+            # Image Processing results, in the order of the frames
+            for result in pool.results(timeout=0.0 if pool.ready() else 0.1):
+                if not result.reused:
+                    logger.success("processing took {}".format(result.seconds))
+                    scheduler.finished(result.seconds)
+                    gate.detected(result.frame_time, result.tip_position)
+                    renderer.submit(result.frame, result.detection, result.frame_nr)
+
+                if result.tip_position is None or result.tip_ori is None: # No lines detected, no pos and ori
+                    continue
+
+                # Send Needle position and orientation back to main process.
+                pos_feed.put(tag + (result.tip_position, result.tip_ori, result.frame_time))
+
+        grabber.stop()
+        if recorder is not None:
+            recorder.stop()
+        pool.stop()
+        vidcap.release()
+        renderer.stop()
+        logger.info("Frame grabber {}: {} frames grabbed, {} decoded, {}, {} unchanged frames".format(
+            vid_link, grabber.grabbed, grabber.retrieved, scheduler.summary(), gate.reuses))
+        # Sentinel Value to end main program loop
+        pos_feed.put(tag + (None, None, None))
@@ -7,10 +7,14 @@ Authors:
     Florens Helfferich       F.J.Helfferich@student.tudelft.nl
     Bram Pronk               I.B.Pronk@student.tudelft.nl
 """
+import os
+import time
+from math import gcd, sqrt
 import cv2
 import numpy as np
-from math import sqrt
 from configparser import ConfigParser
+import src.util.logger as logger
+from src.image_pos.line_processing import as_segments, sort_segments, merge_segments, tip_from_segments
 
 
 def reduce_size(in_image, scale_percent=50):
@@ -71,79 +75,355 @@ def line_numbering(in_image, lines_array):
     return in_image
 
 
-def position_from_image(in_image, configpath: str, flip='no', filtering='no', show='no') -> (tuple, tuple):
+def _distance(point_a, point_b) -> float:
+    return sqrt((point_a[0] - point_b[0]) ** 2 + (point_a[1] - point_b[1]) ** 2)
+
+
+class DetectorSettings:
     """
-    Version 1: provides position feedback by just returning x2 y2 of last line and its orientation (tip_pos, tip_dir)
-        - in_image: the path to the image or the image itself from which the position is read
-        - configpath: the path to the config file with all image processing settings
-        - filtering (optional): 'yes' if a 3x3 low-pass filter improves line detection see 'lpf' function above
-        - show (optional): 'yes' if all numbered lines and orientation of tip need to be shown in the original image
+    Image processing settings of the [IMAGEPOS] section of config.ini
+    """
+
+    def __init__(self, imagepos) -> None:
+        # for edge detection:
+        self.lower_threshold = int(imagepos["lower_threshold"])
+        self.upper_threshold = int(imagepos["upper_threshold"])
+        # for line detection from edge mask:
+        self.theta_resolution = int(imagepos["theta_resolution"])
+        self.min_votes = int(imagepos["min_votes"])
+        self.minll = int(imagepos["minll"])
+        self.maxlg = int(imagepos["maxlg"])
+        # for merging collinear line pieces (merge_angle = 0 disables merging):
+        self.merge_angle = float(imagepos.get("merge_angle", "0"))
+        self.merge_distance = float(imagepos.get("merge_distance", "3"))
+        self.merge_gap = float(imagepos.get("merge_gap", str(self.maxlg)))
+        # for tracking the tip in a window around its last position (see NeedleDetector):
+        self.roi_size = int(imagepos.get("roi_size", "120"))
+        self.roi_growth = float(imagepos.get("roi_growth", "2"))
+        self.roi_margin = int(imagepos.get("roi_margin", "10"))
+        self.track_deadband = float(imagepos.get("track_deadband", "3"))
+        self.track_jump = float(imagepos.get("track_jump", "10"))
+        if self.roi_growth <= 1:
+            raise ValueError("roi_growth must be larger than 1, not {}".format(self.roi_growth))
+
+    @classmethod
+    def from_file(cls, configpath: str):
+        """
+        Reads the settings from the config file at configpath
+        """
+        config_object = ConfigParser()
+        config_object.read(configpath)
+        return cls(config_object["IMAGEPOS"])
+
+
+class NeedleDetector:
+    """
+    Long-lived version of position_from_image for processing a stream of frames.
+
+    The [IMAGEPOS] settings are parsed once and only read again when the modification time of the config file
+    changes, so settings can still be tuned while the camera is running. Every processing stage (grayscale, resize,
+    flip, low-pass filter, edge mask) writes into buffers that are allocated once per frame or window size.
+    The attributes image, lines and sorted_lines are overwritten by the next frame.
+
+    With tracking 'yes', a frame after a confident detection is only processed in a window of roi_size pixels
+    around the last tip position: the window is cut from the frame before any processing, and the lines found in it
+    are mapped back to the coordinates of the whole processed image. A detection is confident when the tip lies at
+    least roi_margin pixels inside the window (or at an edge of the image), otherwise the needle may continue outside
+    the window and it is grown by roi_growth. When the window covers the whole image, the whole frame is processed.
+    Windows are aligned such that the reduced window has (up to a fraction of a pixel) the same pixels as the same
+    part of the reduced frame. HoughLinesP still does not find exactly the same lines in a window as in the whole
+    frame, so a tracked tip is checked against the last tip: within track_deadband pixels it is the last tip (an
+    unchanged frame gives the tip of its whole-frame detection again), and a jump of more than track_jump pixels is
+    checked by processing the whole frame.
+
+    Attributes
+    ----------
+    configpath : str
+        Path to the config file with the [IMAGEPOS] settings
+    scale_percent : int
+        Resolution of the processed image relative to the frame
+    flip, filtering, tracking : str
+        'yes' to flip the image along the vertical axis, 'yes' to use a 3x3 low-pass filter (see lpf),
+        'yes' to process only a window around the last tip position
+    stage_times : dict or None
+        With timing 'yes', the seconds of every stage of the last detect (gray, resize, flip, lpf, canny, hough and
+        post, summed over the windows that were processed) and of the whole call (total), else None
+    image : ndarray
+        Processed (grayscale, reduced, flipped and filtered) image of the last frame, or of its window
+    roi : tuple or None
+        Window (x0, y0, x1, y1) of the last frame in processed image coordinates, None if the whole frame was used
+    lines, sorted_lines : ndarray
+        Lines found by HoughLinesP in the last frame, and the (merged) lines sorted by x1, both as (N, 4) arrays
+        in the coordinates of the whole processed image
     """
-    # Read image, convert to grayscale and reduce resolution for calculation speed
-    if type(in_image) == str:
-        in_image = cv2.imread(in_image)
-    in_image = cv2.cvtColor(in_image, cv2.COLOR_BGR2GRAY)
-    in_image = reduce_size(in_image, 40)
-    # flipping along vertical axis (left becomes right)
-    if flip == 'yes':
-        in_image = cv2.flip(in_image, 1)
-
-    # Read required values from config.ini file
-    config_object = ConfigParser()
-    config_object.read(configpath)
-    imagepos = config_object["IMAGEPOS"]
-    # for edge detection:
-    lower_threshold = int(imagepos["lower_threshold"])
-    upper_threshold = int(imagepos["upper_threshold"])
-    # for line detection from edge mask:
-    theta_resolution = int(imagepos["theta_resolution"])
-    min_votes = int(imagepos["min_votes"])
-    minll = int(imagepos["minll"])
-    maxlg = int(imagepos["maxlg"])
-
-    # lpf filtering if selected see 'lpf' function above
-    if filtering == 'yes':
-        in_image = lpf(in_image)
-
-    # creating edge mask then performing line detection
-    edge_mask = cv2.Canny(image=in_image, threshold1=lower_threshold, threshold2=upper_threshold)
-    lines = cv2.HoughLinesP(edge_mask, 1, np.pi / theta_resolution, min_votes, minLineLength=minll, maxLineGap=maxlg)
-
-    # sorting lines by smallest x1 coord
-    if lines is None:
-        return None, None
-
-    sorting_ind = np.argsort(lines[:, 0, 0])
-    sorted_lines = np.zeros((len(lines[:, 0, 0]), 4), dtype='int16')
-    for i in range(len(lines[:, 0, 0])):
-        row_to_append = np.array(lines[sorting_ind[i], 0, :], dtype='int16')
-        sorted_lines[i, :] = row_to_append
-    if len(sorted_lines[:, 0]) < 30:
-        print("image_proc2: " + str(len(sorted_lines[:, 0])) + " lines detected -> sorted_lines = \n", sorted_lines)
-    else:
-        print("image_proc2: Too many lines to print (" + str(len(sorted_lines[:, 0])) + " lines detected)")
-
-    # position calculation returning (x2, y2) of last line, (x_orientation, y_orientation)
-    # y orientation with respect to the mid horizontal line
-    y_mid = int(in_image.shape[0]/2)
-    tip_dir = orientation(sorted_lines[-1, :], y_mid)
-
-    tip_pos = (sorted_lines[-1, 2], sorted_lines[-1, 3])
-
-    # ---------------------------- SHOW PART --------------------------------
-    # showing lines in gray of original image if requested by 'show' argument
-    if show == 'yes':
-        small_color = cv2.cvtColor(in_image, cv2.COLOR_GRAY2BGR)
+
+    def __init__(self, configpath="config.ini", scale_percent=40, flip='no', filtering='no', size_blur=3,
+                 tracking='no', timing='no') -> None:
+        self.configpath = configpath
+        self.scale_percent = scale_percent
+        self.flip = flip
+        self.filtering = filtering
+        self.tracking = tracking
+        self.stage_times = {} if timing == 'yes' else None
+        self.kernel = np.ones((max(size_blur, 3), max(size_blur, 3)), np.float32) / (max(size_blur, 3) ** 2)
+        self.settings = DetectorSettings.from_file(configpath)
+        self._mtime = self._config_mtime()
+        # a window of (align * n) processed pixels is exactly (frame_align * n) frame pixels
+        self._align = scale_percent // gcd(scale_percent, 100)
+        self._frame_align = 100 // gcd(scale_percent, 100)
+        self._buffers = {}
+        self._edges = None     # edge mask buffer of the last preprocessed image size, set by preprocess
+        self.image = None
+        self.roi = None
+        self.lines = None
+        self.sorted_lines = None
+        self.last_tip = None
+        self._last_dir = None
+
+    def _config_mtime(self):
+        try:
+            return os.stat(self.configpath).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload_if_changed(self) -> bool:
+        """
+        Parses the config file again if it was modified since it was last read, returns True if it was reloaded.
+        An unreadable file is logged and the previous settings stay in use.
+        """
+        mtime = self._config_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            self.settings = DetectorSettings.from_file(self.configpath)
+        except (KeyError, ValueError) as error:
+            logger.error("NeedleDetector: could not reload {}, keeping the previous settings ({})".format(
+                self.configpath, error))
+            return False
+        logger.info("NeedleDetector: reloaded settings from {}".format(self.configpath))
+        return True
+
+    def reset_tracking(self) -> None:
+        """
+        Forgets the last tip position, the next frame is processed as a whole
+        """
+        self.last_tip = None
+        self._last_dir = None
+
+    def _allocate(self, shape, dsize) -> dict:
+        """
+        Allocates the buffers of all processing stages for frames of the given shape reduced to dsize
+        """
+        if len(self._buffers) >= 16:
+            self._buffers.clear()
+        small_shape = (dsize[1], dsize[0])
+        buffers = {"gray": np.empty(shape[:2], np.uint8), "small": np.empty(small_shape, np.uint8),
+                   "flipped": np.empty(small_shape, np.uint8), "filtered": np.empty(small_shape, np.uint8),
+                   "edges": np.empty(small_shape, np.uint8)}
+        self._buffers[(shape, dsize)] = buffers
+        return buffers
+
+    def _reduced_size(self, shape) -> (int, int):
+        """
+        Size (width, height) of the processed image of a frame of the given shape
+        """
+        return int(shape[1] * self.scale_percent / 100), int(shape[0] * self.scale_percent / 100)
+
+    def _lap(self, stage: str, start: float) -> float:
+        """
+        Adds the time since start to stage in stage_times (when timing), returns the start time of the next stage
+        """
+        now = time.perf_counter()
+        if self.stage_times is not None:
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + now - start
+        return now
+
+    def preprocess(self, in_image, dsize=None):
+        """
+        Grayscale, reduced, optionally flipped and filtered version of in_image, in the preallocated buffers.
+        The image is reduced by scale_percent, or to dsize (width, height) when given.
+        """
+        if dsize is None:
+            dsize = self._reduced_size(in_image.shape)
+        buffers = self._buffers.get((in_image.shape, dsize))
+        if buffers is None:
+            buffers = self._allocate(in_image.shape, dsize)
+        self._edges = buffers["edges"]
+        start = time.perf_counter()
+        gray = in_image
+        if in_image.ndim == 3:
+            gray = cv2.cvtColor(in_image, cv2.COLOR_BGR2GRAY, dst=buffers["gray"])
+            start = self._lap("gray", start)
+        image = cv2.resize(gray, dsize, dst=buffers["small"], interpolation=cv2.INTER_CUBIC)
+        start = self._lap("resize", start)
+        # flipping along vertical axis (left becomes right)
+        if self.flip == 'yes':
+            image = cv2.flip(image, 1, dst=buffers["flipped"])
+            start = self._lap("flip", start)
+        # lpf filtering if selected see 'lpf' function above
+        if self.filtering == 'yes':
+            image = cv2.filter2D(image, -1, self.kernel, dst=buffers["filtered"])
+            self._lap("lpf", start)
+        return image
+
+    def _window(self, shape, tip_pos, half):
+        """
+        Window (x0, y0, x1, y1) in processed image coordinates of about half pixels around tip_pos, or None if it
+        covers the whole processed image of a frame of the given shape
+        """
+        width, height = self._reduced_size(shape)
+        align = self._align
+        x_tip = tip_pos[0] if self.flip != 'yes' else width - 1 - tip_pos[0]
+        # aligned window in the coordinates of the reduced image before flipping
+        x0 = max((x_tip - half) // align * align, 0)
+        x1 = min(-(-(x_tip + half + 1) // align) * align, width // align * align)
+        y0 = max((tip_pos[1] - half) // align * align, 0)
+        y1 = min(-(-(tip_pos[1] + half + 1) // align) * align, height // align * align)
+        if x0 == 0 and y0 == 0 and x1 > width - align and y1 > height - align:
+            return None
+        if self.flip == 'yes':
+            x0, x1 = width - x1, width - x0
+        return x0, y0, x1, y1
+
+    def _confident(self, tip_pos, window, shape) -> bool:
+        """
+        True if tip_pos lies at least roi_margin pixels inside every side of window that is not an image edge
+        """
+        width, height = self._reduced_size(shape)
+        margin = self.settings.roi_margin
+        x0, y0, x1, y1 = window
+        return ((x0 < self._align or tip_pos[0] >= x0 + margin) and
+                (x1 > width - self._align or tip_pos[0] < x1 - margin) and
+                (y0 == 0 or tip_pos[1] >= y0 + margin) and
+                (y1 > height - self._align or tip_pos[1] < y1 - margin))
+
+    def _detect_in(self, in_image, window) -> (tuple, tuple):
+        """
+        Line detection in the whole frame (window None) or in a window of it, see detect
+        """
+        settings = self.settings
+        self.roi = window
+        if window is None:
+            self.image = self.preprocess(in_image)
+            offset = (0, 0)
+        else:
+            x0, y0, x1, y1 = window
+            if self.flip == 'yes':
+                width = self._reduced_size(in_image.shape)[0]
+                x0, x1 = width - x1, width - x0
+            frame = in_image[y0 // self._align * self._frame_align:y1 // self._align * self._frame_align,
+                             x0 // self._align * self._frame_align:x1 // self._align * self._frame_align]
+            self.image = self.preprocess(frame, (x1 - x0, y1 - y0))
+            offset = window[:2]
+
+        # creating edge mask then performing line detection
+        start = time.perf_counter()
+        edge_mask = cv2.Canny(image=self.image, threshold1=settings.lower_threshold,
+                              threshold2=settings.upper_threshold, edges=self._edges)
+        start = self._lap("canny", start)
+        lines = cv2.HoughLinesP(edge_mask, 1, np.pi / settings.theta_resolution, settings.min_votes,
+                                minLineLength=settings.minll, maxLineGap=settings.maxlg)
+        start = self._lap("hough", start)
+        self.lines = as_segments(lines)
+        if window is not None:
+            self.lines += np.array(offset * 2, dtype=np.int32)
+
+        # merging collinear pieces, sorting lines by smallest x1 coord and taking the tip of the last line
+        segments = self.lines
+        if settings.merge_angle > 0:
+            segments = merge_segments(segments, np.deg2rad(settings.merge_angle), settings.merge_distance,
+                                      settings.merge_gap)
+        self.sorted_lines = sort_segments(segments)
+        tip = tip_from_segments(self.sorted_lines)
+        self._lap("post", start)
+        return tip
+
+    def _detect_around(self, in_image, position) -> (tuple, tuple):
+        """
+        Detection in growing windows around position (in processed image coordinates), (None, None) when no window
+        gave a confident detection and the whole frame has to be processed
+        """
+        half = self.settings.roi_size
+        while True:
+            window = self._window(in_image.shape, position, half)
+            if window is None:
+                return None, None
+            tip_pos, tip_dir = self._detect_in(in_image, window)
+            if tip_pos is not None and self._confident(tip_pos, window, in_image.shape):
+                return tip_pos, tip_dir
+            half = int(half * self.settings.roi_growth)
+
+    def _follow(self, tip_pos, tip_dir) -> (tuple, tuple):
+        """
+        Checks a tracked tip against the last tip, see the class docstring: the last tip when it is within
+        track_deadband pixels, (None, None) when it jumped more than track_jump pixels
+        """
+        distance = _distance(tip_pos, self.last_tip)
+        if distance <= self.settings.track_deadband and self._last_dir is not None:
+            return self.last_tip, self._last_dir
+        if distance > self.settings.track_jump:
+            return None, None
+        return tip_pos, tip_dir
+
+    def detect(self, in_image, show='no') -> (tuple, tuple):
+        """
+        Same result as position_from_image for a frame (or the path to an image): (tip_pos, tip_dir),
+        or (None, None) when no lines are detected. With tracking, only a window around the last tip is processed
+        when possible. The returned coordinates are always those of the whole processed image.
+        With timing, stage_times holds the time of every stage of this call afterwards.
+        """
+        if type(in_image) == str:
+            in_image = cv2.imread(in_image)
+        self.reload_if_changed()
+        start = time.perf_counter()
+        if self.stage_times is not None:
+            self.stage_times = {}
+
+        tip_pos, tip_dir = None, None
+        if self.tracking == 'yes' and self.last_tip is not None:
+            tip_pos, tip_dir = self._detect_around(in_image, self.last_tip)
+            if tip_pos is not None:
+                tip_pos, tip_dir = self._follow(tip_pos, tip_dir)
+        if tip_pos is None:
+            tip_pos, tip_dir = self._detect_in(in_image, None)
+        self.last_tip = tip_pos
+        self._last_dir = tip_dir
+        self._lap("total", start)
+        if tip_pos is None:
+            return None, None
+
+        if show == 'yes':
+            self.show(tip_pos, tip_dir)
+        return tip_pos, tip_dir
+
+    def to_frame(self, points, frame_shape) -> np.ndarray:
+        """
+        Converts points (N x 2) in processed image coordinates to the coordinates of a frame of frame_shape
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x = points[:, 0]
+        if self.flip == 'yes':
+            x = self._reduced_size(frame_shape)[0] - 1 - x
+        scale = 100 / self.scale_percent
+        return np.stack(((x + 0.5) * scale - 0.5, (points[:, 1] + 0.5) * scale - 0.5), axis=1)
+
+    def show(self, tip_pos, tip_dir) -> None:
+        """
+        Shows all numbered lines and the orientation of the tip in the processed image (or window) of the last frame
+        """
+        small_color = cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR)
         purple = (200, 100, 200)
         yellow = (0, 255, 255)
+        offset = np.array((self.roi[:2] if self.roi is not None else (0, 0)) * 2, dtype=np.int32)
+        tip_pos = (tip_pos[0] - int(offset[0]), tip_pos[1] - int(offset[1]))
         # putting lines in image
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
+        for x1, y1, x2, y2 in self.lines - offset:
             cv2.line(small_color, (x1, y1), (x2, y2), purple, 2)
         # putting numbers and direction arrow in image
-        num_image = line_numbering(small_color, sorted_lines)
+        num_image = line_numbering(small_color, self.sorted_lines - offset)
         endpoint = (tip_pos[0]+int(40*tip_dir[0]), tip_pos[1]+int(40*tip_dir[1]))
-        if endpoint[0] > in_image.shape[1] or endpoint[1] > in_image.shape[0]:
+        if endpoint[0] > self.image.shape[1] or endpoint[1] > self.image.shape[0]:
             # reduce endpoint:
             endpoint = (tip_pos[0]+int(10*tip_dir[0]), tip_pos[1]+int(10*tip_dir[1]))
         print("image_proc->show part: endpoint arrow = ", endpoint)
@@ -153,4 +433,21 @@ def position_from_image(in_image, configpath: str, flip='no', filtering='no', sh
         if cv2.waitKey(1) == 13:
             cv2.destroyAllWindows()
 
-    return tip_pos, tip_dir
+
+# detectors of position_from_image, one per combination of (configpath, flip, filtering)
+_DETECTORS = {}
+
+
+def position_from_image(in_image, configpath: str, flip='no', filtering='no', show='no') -> (tuple, tuple):
+    """
+    Version 1: provides position feedback by just returning x2 y2 of last line and its orientation (tip_pos, tip_dir)
+        - in_image: the path to the image or the image itself from which the position is read
+        - configpath: the path to the config file with all image processing settings
+        - filtering (optional): 'yes' if a 3x3 low-pass filter improves line detection see 'lpf' function above
+        - show (optional): 'yes' if all numbered lines and orientation of tip need to be shown in the original image
+    The work is done by a NeedleDetector that is kept between calls, see above.
+    """
+    key = (configpath, flip, filtering)
+    if key not in _DETECTORS:
+        _DETECTORS[key] = NeedleDetector(configpath, 40, flip, filtering)
+    return _DETECTORS[key].detect(in_image, show)
@@ -0,0 +1,119 @@
+"""
+This file offers the post-processing of the line segments found by cv2.HoughLinesP, vectorized with NumPy
+
+A needle edge is often found as several short collinear pieces, and noisy frames can give hundreds of segments.
+All functions here work on (N, 4) arrays of segments (x1, y1, x2, y2) with whole-array operations,
+so their cost grows with N log N (sorting) instead of with Python loops over the segments.
+
+Segments are kept with x1 <= x2 (and y1 >= y2 for vertical segments), the order HoughLinesP gives them in.
+"""
+import numpy as np
+
+
+def as_segments(lines) -> np.ndarray:
+    """
+    Converts the output of HoughLinesP, (N, 1, 4) or (N, 4) or None, into an (N, 4) int32 array
+    """
+    if lines is None:
+        return np.zeros((0, 4), dtype=np.int32)
+    return np.asarray(lines, dtype=np.int32).reshape(-1, 4)
+
+
+def sort_segments(segments) -> np.ndarray:
+    """
+    Returns the segments sorted by smallest x1 coord
+    """
+    return segments[np.argsort(segments[:, 0])]
+
+
+def orientations(segments) -> np.ndarray:
+    """
+    Unit vectors (x-direction, y-direction) of all segments as an (N, 2) array, zero for segments of zero length
+    """
+    vectors = (segments[:, 2:4] - segments[:, 0:2]).astype(np.float64)
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+    return np.divide(vectors, lengths[:, None], out=np.zeros_like(vectors), where=lengths[:, None] > 0)
+
+
+def _canonical(segments) -> np.ndarray:
+    """
+    Swaps the endpoints where needed so every segment points in +x (or -y when vertical)
+    """
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    swap = (dx < 0) | ((dx == 0) & (dy > 0))
+    return np.where(swap[:, None], segments[:, [2, 3, 0, 1]], segments)
+
+
+def _breaks(values, tolerance) -> np.ndarray:
+    """
+    Boolean array that is True where a sorted sequence jumps by more than tolerance (and for the first element)
+    """
+    jumps = np.ones(len(values), dtype=bool)
+    jumps[1:] = np.diff(values) > tolerance
+    return jumps
+
+
+def merge_segments(segments, angle_tolerance: float, distance_tolerance: float, max_gap: float) -> np.ndarray:
+    """
+    Merges collinear segments that overlap or are at most max_gap pixels apart into one segment
+        - angle_tolerance: largest angle difference (radians) between the segments of one line
+        - distance_tolerance: largest distance (pixels) between the parallel lines through the segments
+        - max_gap: largest gap (pixels) along the line between two segments that are merged
+    Segments are grouped by angle first and then by their distance to the origin (both single-linkage), and the
+    segments of a group are merged as overlapping intervals along the group direction.
+    A merged segment runs from the first to the last endpoint of its pieces.
+    """
+    if len(segments) < 2:
+        return segments
+    segments = _canonical(segments)
+    starts = segments[:, 0:2].astype(np.float64)
+    ends = segments[:, 2:4].astype(np.float64)
+    directions = orientations(segments)
+    angles = np.arctan2(directions[:, 1], directions[:, 0])
+    rhos = directions[:, 0] * starts[:, 1] - directions[:, 1] * starts[:, 0]
+
+    # group by angle, then split every angle group by the distance of the lines to the origin
+    by_angle = np.argsort(angles, kind="stable")
+    angle_group = np.empty(len(segments), dtype=np.int64)
+    angle_group[by_angle] = np.cumsum(_breaks(angles[by_angle], angle_tolerance))
+    by_line = np.lexsort((rhos, angle_group))
+    new_line = _breaks(rhos[by_line], distance_tolerance)
+    new_line[1:] |= np.diff(angle_group[by_line]) != 0
+    line_group = np.empty(len(segments), dtype=np.int64)
+    line_group[by_line] = np.cumsum(new_line) - 1
+
+    # project the endpoints on the mean direction of their line group
+    group_directions = np.zeros((line_group.max() + 1, 2))
+    np.add.at(group_directions, line_group, directions)
+    group_directions /= np.maximum(np.hypot(group_directions[:, 0], group_directions[:, 1]), 1e-12)[:, None]
+    member_directions = group_directions[line_group]
+    t_start = np.einsum('ij,ij->i', starts, member_directions)
+    t_end = np.einsum('ij,ij->i', ends, member_directions)
+
+    # merge overlapping intervals per line group: a running maximum of the interval ends, offset per group
+    order = np.lexsort((t_start, line_group))
+    offset = line_group[order] * 4 * (np.abs(np.concatenate((t_start, t_end))).max() + max_gap + 1)
+    reach = np.maximum.accumulate(t_end[order] + offset) - offset
+    new_segment = np.ones(len(order), dtype=bool)
+    new_segment[1:] = (np.diff(line_group[order]) != 0) | (t_start[order][1:] > reach[:-1] + max_gap)
+    cluster = np.empty(len(segments), dtype=np.int64)
+    cluster[order] = np.cumsum(new_segment) - 1
+
+    # a merged segment starts at its first start point and ends at its furthest end point
+    first = order[new_segment]
+    by_end = np.lexsort((t_end, cluster))
+    last = by_end[np.append(np.diff(cluster[by_end]) != 0, True)]
+    return np.hstack((segments[first, 0:2], segments[last, 2:4]))
+
+
+def tip_from_segments(segments) -> (tuple, tuple):
+    """
+    Position (x2, y2) and orientation of the segment that reaches furthest to the right (largest x2, then largest
+    x1), which is the last piece of the needle. Returns (None, None) without segments.
+    """
+    if len(segments) == 0:
+        return None, None
+    tip = segments[np.lexsort((segments[:, 0], segments[:, 2]))[-1]]
+    tip_dir = orientations(tip[None, :])[0]
+    return (int(tip[2]), int(tip[3])), (float(tip_dir[0]), float(tip_dir[1]))
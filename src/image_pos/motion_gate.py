@@ -0,0 +1,127 @@
+"""
+This file offers a cheap check whether a camera frame changed since the last detection
+
+Between the commands of the user the needle does not move, and detecting it again gives the same tip. The MotionGate
+compares a thumbnail of every frame (every gate_step-th pixel of every gate_step-th row, in gray and blurred against
+camera noise, well under a millisecond) with the thumbnail of the last frame that was submitted for detection, the
+reference frame. Only when at least gate_pixels thumbnail pixels differ more than gate_threshold gray levels, the frame
+is detected again; otherwise it reuses the detection of the reference frame, which may still be running (see
+DetectionPool.reuse, which hands out the reused frames in order). A full detection is also done:
+    - while the motors move and gate_settle seconds after, as reported by the StepScheduler in moved
+    - when the reference frame is gate_refresh seconds old
+    - when the detection of the reference frame found no tip
+
+Settings are read from the [IMAGEPOS] section of config.ini, gate_threshold = 0 disables the gate.
+"""
+import cv2
+import numpy as np
+
+
+class GateSettings:
+    """
+    Settings of the MotionGate, read from the [IMAGEPOS] section of config.ini
+
+    Attributes
+    ----------
+    step : int
+        Distance in pixels between the sampled pixels of the thumbnail
+    threshold : float
+        Smallest gray level difference of a changed thumbnail pixel, 0 to detect every frame
+    pixels : int
+        Number of changed thumbnail pixels of a changed frame
+    settle : float
+        Seconds after a move during which every frame is detected
+    refresh : float
+        Largest age in seconds of the detection of an unchanged frame
+    """
+
+    def __init__(self, imagepos=None) -> None:
+        imagepos = imagepos if imagepos is not None else {}
+        self.step = int(imagepos.get("gate_step", "8"))
+        self.threshold = float(imagepos.get("gate_threshold", "15"))
+        self.pixels = int(imagepos.get("gate_pixels", "20"))
+        self.settle = float(imagepos.get("gate_settle", "0.5"))
+        self.refresh = float(imagepos.get("gate_refresh", "5"))
+
+    @classmethod
+    def from_config(cls, config_object):
+        """
+        Reads the settings from the [IMAGEPOS] section of a ConfigParser, defaults when there is no such section
+        """
+        if config_object.has_section("IMAGEPOS"):
+            return cls(config_object["IMAGEPOS"])
+        return cls()
+
+
+class MotionGate:
+    """
+    Decides which frames have to be detected again, see the module docstring.
+
+    Attributes
+    ----------
+    settings : GateSettings
+        Thumbnail size, thresholds and times
+    moved : multiprocessing.Value or None
+        Time.monotonic() at which the last motor move ends (see StepScheduler.motion)
+    detections, reuses : int
+        Number of frames that were submitted for detection and of frames that reused the detection of their
+        reference frame
+    """
+
+    def __init__(self, settings=None, moved=None) -> None:
+        self.settings = settings if settings is not None else GateSettings()
+        self.moved = moved
+        self.detections = 0
+        self.reuses = 0
+        self._reference = None
+        self._reference_time = None
+        self._found = None  # whether the detection of the reference frame found a tip, None while it runs
+
+    def thumbnail(self, frame):
+        """
+        Small blurred gray copy of frame that is compared between frames
+        """
+        step = self.settings.step
+        sample = np.ascontiguousarray(frame[::step, ::step])
+        if sample.ndim == 3:
+            sample = cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY)
+        return cv2.blur(sample, (3, 3))
+
+    def check(self, frame, frame_time: float) -> bool:
+        """
+        True when frame (taken at frame_time) does not have to be detected and reuses the detection of the reference
+        frame. A frame that is submitted for detection instead has to be reported with submitted().
+        """
+        if self.settings.threshold <= 0 or self._reference is None or self._found is False:
+            return False
+        if self.moved is not None and frame_time <= self.moved.value + self.settings.settle:
+            return False
+        if frame_time - self._reference_time > self.settings.refresh:
+            return False
+        thumbnail = self.thumbnail(frame)
+        if thumbnail.shape != self._reference.shape:
+            return False
+        changed = np.count_nonzero(cv2.absdiff(thumbnail, self._reference) > self.settings.threshold)
+        if changed >= self.settings.pixels:
+            return False
+        self.reuses += 1
+        return True
+
+    def submitted(self, frame, frame_time: float) -> None:
+        """
+        Makes frame (taken at frame_time), which was submitted for detection, the reference for the next frames
+        """
+        self.detections += 1
+        if self.settings.threshold <= 0:
+            return
+        self._reference = self.thumbnail(frame)
+        self._reference_time = frame_time
+        self._found = None
+
+    def detected(self, frame_time: float, tip_position) -> None:
+        """
+        Reports the detection of the frame taken at frame_time, the frames after a reference frame without a tip
+        are detected again
+        """
+        if frame_time == self._reference_time:
+            self._found = tip_position is not None
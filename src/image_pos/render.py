@@ -0,0 +1,208 @@
+"""
+This file offers the visualization of the needle detection, separate from the detection itself
+
+The acquisition loop hands every frame (and the detection result of the processed ones) to a FrameRenderer, which
+only stores a reference and returns immediately. Drawing happens in background threads:
+    - display: the newest frame with the overlay of the newest detection, shown at most max_fps times per second;
+      frames that arrive in between are skipped
+    - recording (optional): every processed frame with its overlay is written to record_dir; when the disk cannot keep
+      up the frames are dropped (and counted) instead of slowing down the detection
+
+OpenCV-package required
+"""
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+import src.util.logger as logger
+
+PURPLE = (200, 100, 200)
+YELLOW = (0, 255, 255)
+LIGHTBLUE = (255, 255, 0)
+GREEN = (0, 200, 0)
+
+
+class Detection:
+    """
+    Result of a NeedleDetector for one frame, converted to frame coordinates so it can be drawn after the detector
+    has moved on to the next frame.
+
+    Attributes
+    ----------
+    tip_pos : tuple or None
+        (x, y) of the tip in frame pixels
+    tip_dir : tuple or None
+        (x-direction, y-direction) unit vector of the tip in the frame
+    lines, sorted_lines : ndarray
+        All lines found by HoughLinesP and the (merged) lines sorted by x1, as (N, 4) arrays in frame pixels
+    roi : tuple or None
+        Window (x0, y0, x1, y1) in frame pixels that was processed, None for the whole frame
+    """
+
+    def __init__(self, detector, frame_shape, tip_pos, tip_dir) -> None:
+        def segments_to_frame(segments):
+            if segments is None or len(segments) == 0:
+                return np.zeros((0, 4))
+            return detector.to_frame(np.reshape(segments, (-1, 2)), frame_shape).reshape(-1, 4)
+
+        self.lines = segments_to_frame(detector.lines)
+        self.sorted_lines = segments_to_frame(detector.sorted_lines)
+        self.roi = None
+        if detector.roi is not None:
+            corners = detector.to_frame(np.reshape(detector.roi, (2, 2)), frame_shape)
+            self.roi = (float(corners[:, 0].min()), float(corners[:, 1].min()),
+                        float(corners[:, 0].max()), float(corners[:, 1].max()))
+        self.tip_pos = None
+        self.tip_dir = None
+        if tip_pos is not None:
+            self.tip_pos = tuple(float(value) for value in detector.to_frame(tip_pos, frame_shape)[0])
+            self.tip_dir = (-tip_dir[0], tip_dir[1]) if detector.flip == 'yes' else tuple(tip_dir)
+
+
+def draw_overlay(image, detection, scale=1.0):
+    """
+    Draws the lines (purple), their numbers, the processed window (green) and the tip orientation (yellow arrow)
+    of detection in image, a copy of the frame resized by scale. Returns image.
+    """
+    def point(x, y):
+        return int(round(x * scale)), int(round(y * scale))
+
+    if detection.roi is not None:
+        cv2.rectangle(image, point(*detection.roi[0:2]), point(*detection.roi[2:4]), GREEN, 1)
+    for x1, y1, x2, y2 in detection.lines:
+        cv2.line(image, point(x1, y1), point(x2, y2), PURPLE, 2)
+    for i, (_, _, x2, y2) in enumerate(detection.sorted_lines):
+        cv2.putText(image, str(i), point(x2, y2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, LIGHTBLUE, 1, cv2.LINE_AA)
+    if detection.tip_pos is not None:
+        tip = point(*detection.tip_pos)
+        endpoint = (tip[0] + int(40 * detection.tip_dir[0]), tip[1] + int(40 * detection.tip_dir[1]))
+        cv2.arrowedLine(image, tip, endpoint, YELLOW, 2)
+    return image
+
+
+class FrameRenderer:
+    """
+    Shows and records frames with their detection overlay in background threads, see the module docstring.
+
+    Attributes
+    ----------
+    max_fps : float
+        Largest number of displayed frames per second
+    display_percent : int
+        Size of the displayed frame relative to the camera frame
+    show : bool
+        False to run without a window (only recording)
+    record_dir : str
+        Directory the annotated frames are written to, "" to not record
+    escape_pressed : threading.Event
+        Set when the Escape key is pressed in the window
+    shown, recorded, dropped : int
+        Number of displayed frames, written frames and frames not recorded because the disk could not keep up
+    """
+
+    def __init__(self, window="Top Camera Feed", max_fps=15, display_percent=50, show=True, record_dir="",
+                 record_queue=32) -> None:
+        self.window = window
+        self.max_fps = max_fps
+        self.display_percent = display_percent
+        self.show = show
+        self.record_dir = record_dir
+        self.escape_pressed = threading.Event()
+        self.shown = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.is_running = False
+        self._latest = None
+        self._detection = None
+        self._condition = threading.Condition()
+        self._records = queue.Queue(maxsize=record_queue)
+        self._threads = []
+
+    def start(self) -> None:
+        """
+        Starts the display thread (when show) and the recording thread (when record_dir is set)
+        """
+        self.is_running = True
+        if self.show:
+            self._threads.append(threading.Thread(target=self._display, name="FrameRenderer_display", daemon=True))
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+            self._threads.append(threading.Thread(target=self._record, name="FrameRenderer_record", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the threads after the frames waiting for the disk are written, and closes the window
+        """
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+        if self.record_dir:
+            self._records.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.record_dir:
+            logger.info("FrameRenderer: {} frames recorded in {}, {} dropped".format(
+                self.recorded, self.record_dir, self.dropped))
+
+    def submit(self, frame, detection=None, frame_nr=0) -> None:
+        """
+        Hands a frame to the renderer without waiting. A frame with a Detection is also recorded; the overlay of the
+        newest detection is drawn on all following frames.
+        """
+        with self._condition:
+            self._latest = frame
+            if detection is not None:
+                self._detection = detection
+            self._condition.notify()
+        if detection is not None and self.record_dir:
+            try:
+                self._records.put_nowait((frame, detection, frame_nr))
+            except queue.Full:
+                self.dropped += 1
+
+    def _display(self) -> None:
+        interval = 1 / self.max_fps
+        next_time = time.monotonic()
+        while True:
+            with self._condition:
+                if self.is_running and self._latest is None:
+                    self._condition.wait(interval)
+                if not self.is_running:
+                    break
+                frame, detection = self._latest, self._detection
+                self._latest = None
+            if frame is None:
+                # no new frame, only handle the window events
+                if self.shown and cv2.waitKey(1) == 27:
+                    self.escape_pressed.set()
+                continue
+
+            scale = self.display_percent / 100
+            image = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)),
+                               interpolation=cv2.INTER_AREA)
+            if detection is not None:
+                draw_overlay(image, detection, scale)
+            cv2.imshow(self.window, image)
+            self.shown += 1
+
+            # waitKey keeps the window responsive and waits for the next display moment at the same time
+            next_time = max(next_time + interval, time.monotonic())
+            if cv2.waitKey(max(1, int((next_time - time.monotonic()) * 1000))) == 27:
+                self.escape_pressed.set()
+        if self.shown:
+            cv2.destroyWindow(self.window)
+
+    def _record(self) -> None:
+        while True:
+            item = self._records.get()
+            if item is None:
+                break
+            frame, detection, frame_nr = item
+            path = os.path.join(self.record_dir, "frame_{:06d}.jpg".format(int(frame_nr)))
+            cv2.imwrite(path, draw_overlay(frame.copy(), detection))
+            self.recorded += 1
@@ -0,0 +1,213 @@
+"""
+This file offers the recording of the camera frames of a run, and their replay
+
+A session recording consists of two files:
+    - <path>.mjpg: the frames as JPEG images, one after the other (a Motion JPEG stream)
+    - <path>.idx: a header followed by one fixed-size record per frame: the time.monotonic() at which the frame was
+      grabbed, the frame number, and the byte offset and size of its JPEG image in the .mjpg file
+Every frame is an image of its own, so any frame is decoded without decoding the frames before it. The reader maps
+both files in memory: frame i is read at its offset in constant time. The frame of a moment is found with a binary
+search in the mapped grab times, in O(log n) without reading any image.
+
+The SessionRecorder encodes and writes in a background thread; when the disk cannot keep up the frames are dropped
+(and counted) instead of slowing down the camera. replay() feeds a recording to position_from_image as fast as
+the frames can be processed.
+
+OpenCV-package required
+"""
+import mmap
+import os
+import queue
+import struct
+import threading
+import cv2
+import numpy as np
+import src.util.logger as logger
+from src.image_pos.image_proc2 import position_from_image
+
+_MAGIC = b"BRS1"
+# magic, size of an index record
+_HEADER = struct.Struct("<4sI8x")
+INDEX_RECORD = np.dtype([("time", "<f8"), ("frame_nr", "<i8"), ("offset", "<u8"), ("size", "<u8")])
+
+
+def session_paths(path: str) -> tuple:
+    """
+    Returns the (.mjpg, .idx) paths of the session recording at path, with or without one of these extensions
+    """
+    base, extension = os.path.splitext(path)
+    if extension.lower() not in (".mjpg", ".idx"):
+        base = path
+    return base + ".mjpg", base + ".idx"
+
+
+def is_session(path: str) -> bool:
+    """
+    True if path is (one of the files of) a session recording
+    """
+    return all(os.path.isfile(part) for part in session_paths(path))
+
+
+class SessionRecorder:
+    """
+    Writes frames to a session recording in a background thread, see the module docstring.
+
+    Attributes
+    ----------
+    path : str
+        Path of the recording (see session_paths)
+    quality : int
+        JPEG quality (0 - 100)
+    recorded, dropped : int
+        Number of written frames and of frames not recorded because the disk could not keep up
+    """
+
+    def __init__(self, path: str, quality=90, queue_size=64) -> None:
+        self.path = path
+        self.quality = quality
+        self.recorded = 0
+        self.dropped = 0
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Creates (or overwrites) the recording files and starts the writer thread
+        """
+        data_path, index_path = session_paths(self.path)
+        if os.path.dirname(data_path):
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        data_file = open(data_path, "wb")
+        index_file = open(index_path, "wb")
+        index_file.write(_HEADER.pack(_MAGIC, INDEX_RECORD.itemsize))
+        self._thread = threading.Thread(target=self._write, args=(data_file, index_file),
+                                        name="SessionRecorder_thread", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, frame_time: float, frame_nr: int) -> None:
+        """
+        Hands a frame to the writer without waiting, the frame must not be changed afterwards
+        """
+        try:
+            self._frames.put_nowait((frame, frame_time, frame_nr))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """
+        Writes the frames that are still waiting and closes the recording
+        """
+        if self._thread is None:
+            return
+        self._frames.put(None)
+        self._thread.join()
+        self._thread = None
+        logger.info("SessionRecorder: {} frames recorded in {}, {} dropped".format(
+            self.recorded, self.path, self.dropped))
+
+    def _write(self, data_file, index_file) -> None:
+        offset = 0
+        record = np.zeros(1, dtype=INDEX_RECORD)
+        with data_file, index_file:
+            while True:
+                item = self._frames.get()
+                if item is None:
+                    break
+                frame, frame_time, frame_nr = item
+                success, image = cv2.imencode(".jpg", frame, (cv2.IMWRITE_JPEG_QUALITY, self.quality))
+                if not success:
+                    self.dropped += 1
+                    continue
+                data_file.write(image.data)
+                record[0] = (frame_time, frame_nr, offset, image.size)
+                # the image is written before its index record, so a recording cut off by a crash stays readable
+                data_file.flush()
+                index_file.write(record.tobytes())
+                index_file.flush()
+                offset += image.size
+                self.recorded += 1
+
+
+class SessionReader:
+    """
+    Random access to the frames of a session recording, see the module docstring.
+
+    Attributes
+    ----------
+    path : str
+        Path of the recording
+    times, frame_nrs : ndarray
+        Grab times and frame numbers of all frames (views of the mapped index)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        data_path, index_path = session_paths(path)
+        with open(index_path, "rb") as index_file:
+            header = index_file.read(_HEADER.size)
+        magic, record_size = _HEADER.unpack(header) if len(header) == _HEADER.size else (None, None)
+        if magic != _MAGIC or record_size != INDEX_RECORD.itemsize:
+            raise ValueError("{} is not a session recording".format(index_path))
+        count = (os.path.getsize(index_path) - _HEADER.size) // INDEX_RECORD.itemsize
+        self._index = np.memmap(index_path, dtype=INDEX_RECORD, mode="r", offset=_HEADER.size, shape=(count,)) \
+            if count else np.zeros(0, dtype=INDEX_RECORD)
+        self._data_file = open(data_path, "rb")
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(data_path) else b""
+        self.times = self._index["time"]
+        self.frame_nrs = self._index["frame_nr"]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def close(self) -> None:
+        """
+        Unmaps the recording
+        """
+        self.times = self.frame_nrs = None
+        self._index = None
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def frame(self, i: int):
+        """
+        Decodes frame i, returns (frame, time, frame number)
+        """
+        record = self._index[i]
+        image = np.frombuffer(self._data, dtype=np.uint8, count=int(record["size"]), offset=int(record["offset"]))
+        return cv2.imdecode(image, cv2.IMREAD_COLOR), float(record["time"]), int(record["frame_nr"])
+
+    def index_at(self, moment: float) -> int:
+        """
+        Index of the last frame grabbed at or before moment (the first frame for an earlier moment),
+        by a binary search in O(log n)
+        """
+        return max(int(np.searchsorted(self.times, moment, side="right")) - 1, 0)
+
+    def frames(self, start=0, stop=None):
+        """
+        Generator of the (frame, time, frame number) of the frames start up to stop
+        """
+        for i in range(start, len(self) if stop is None else min(stop, len(self))):
+            yield self.frame(i)
+
+
+def replay(path: str, configpath: str, flip='no', filtering='no', start_time=None, end_time=None):
+    """
+    Generator of (time, frame number, tip_position, tip_ori) with position_from_image of the frames of the
+    recording at path that were grabbed between start_time and end_time (default: all), as fast as they are
+    processed
+    """
+    with SessionReader(path) as reader:
+        start = reader.index_at(start_time) if start_time is not None else 0
+        stop = int(np.searchsorted(reader.times, end_time, side="right")) if end_time is not None else None
+        for frame, frame_time, frame_nr in reader.frames(start, stop):
+            tip_position, tip_ori = position_from_image(frame, configpath, flip, filtering)
+            yield frame_time, frame_nr, tip_position, tip_ori
@@ -0,0 +1,113 @@
+"""
+This file combines the needle tips seen by the top and the front camera into a 3D tip position and orientation
+
+The top camera looks down on the needle and measures (x, y), the front camera looks at its side and measures (x, z).
+Both are detected in their own process, so their frames are not taken at the same moment: every measurement of one
+camera is paired with the measurement of the other camera that is nearest in time (at most max_pair_interval
+seconds apart). Every new measurement gives an estimate, so two cameras give more estimates per second than one.
+    - the front view is mapped to top view pixels with front_scale and the front_offsets
+    - x is the mean of both views, y comes from the top view and z from the front view
+    - the orientation has the slopes dy/dx of the top view and dz/dx of the front view
+A top measurement without a front measurement nearby is passed on in 2D, as with one camera.
+
+Settings are read from the [CAMERAS] section of config.ini.
+"""
+import collections
+import math
+
+
+class StereoSettings:
+    """
+    Settings of the pairing of the two camera views, read from the [CAMERAS] section of config.ini
+
+    Attributes
+    ----------
+    max_pair_interval : float
+        Largest time in seconds between two paired frames
+    front_scale : float
+        Top view pixels per front view pixel
+    front_offset_x, front_offset_z : float
+        Position in top view pixels of the front view pixel (0, 0)
+    """
+
+    def __init__(self, cameras=None) -> None:
+        cameras = cameras if cameras is not None else {}
+        self.max_pair_interval = float(cameras.get("max_pair_interval", "0.1"))
+        self.front_scale = float(cameras.get("front_scale", "1"))
+        self.front_offset_x = float(cameras.get("front_offset_x", "0"))
+        self.front_offset_z = float(cameras.get("front_offset_z", "0"))
+
+    @classmethod
+    def from_config(cls, config_object):
+        """
+        Reads the settings from the [CAMERAS] section of a ConfigParser, defaults when there is no such section
+        """
+        if config_object.has_section("CAMERAS"):
+            return cls(config_object["CAMERAS"])
+        return cls()
+
+
+def combine(top, front, settings):
+    """
+    Combines the (tip_pos, tip_ori) of the top view and of the front view into
+    ((x, y, z), (x-direction, y-direction, z-direction)) in top view pixels
+    """
+    (top_x, top_y), (top_dx, top_dy) = top
+    (front_x, front_z), (front_dx, front_dz) = front
+    x = (top_x + settings.front_scale * front_x + settings.front_offset_x) / 2
+    z = settings.front_scale * front_z + settings.front_offset_z
+
+    # (dx, dy, dz) with dy/dx of the top view and dz/dx of the front view, pointing in the x-direction of the top view
+    if top_dx * front_dx < 0:
+        front_dx, front_dz = -front_dx, -front_dz
+    direction = (top_dx * abs(front_dx), top_dy * abs(front_dx), front_dz * abs(top_dx))
+    norm = math.sqrt(sum(value * value for value in direction))
+    if norm < 1e-9:  # needle along the viewing direction of a camera
+        direction, norm = (top_dx, top_dy, 0.0), 1.0
+    return (x, top_y, z), tuple(value / norm for value in direction)
+
+
+class StereoPairer:
+    """
+    Pairs the measurements of the two cameras by time, see the module docstring.
+
+    Attributes
+    ----------
+    settings : StereoSettings
+        Pair interval and the mapping of the front view
+    paired, unpaired : int
+        Number of 3D estimates and of measurements without a measurement of the other camera nearby
+    """
+
+    CAMERAS = ("top", "front")
+
+    def __init__(self, settings=None, history=16) -> None:
+        self.settings = settings if settings is not None else StereoSettings()
+        self.paired = 0
+        self.unpaired = 0
+        self._history = {camera: collections.deque(maxlen=history) for camera in self.CAMERAS}
+        self._last_time = None
+
+    def add(self, camera: str, tip_pos, tip_ori, frame_time: float):
+        """
+        Adds the measurement of camera ("top" or "front") of the frame taken at frame_time. Returns the
+        (tip_pos, tip_ori, frame_time) to pass on, or None: for a front measurement without a top measurement nearby,
+        and for a measurement older than the last one passed on.
+        """
+        self._history[camera].append((frame_time, tip_pos, tip_ori))
+        if self._last_time is not None and frame_time <= self._last_time:
+            return None
+        other = self._history["front" if camera == "top" else "top"]
+        nearest = min(other, key=lambda item: abs(item[0] - frame_time), default=None)
+        if nearest is None or abs(nearest[0] - frame_time) > self.settings.max_pair_interval:
+            self.unpaired += 1
+            if camera != "top":
+                return None
+            self._last_time = frame_time
+            return tip_pos, tip_ori, frame_time
+
+        measured = (tip_pos, tip_ori)
+        top, front = (measured, nearest[1:]) if camera == "top" else (nearest[1:], measured)
+        self.paired += 1
+        self._last_time = frame_time
+        return combine(top, front, self.settings) + (frame_time,)
@@ -0,0 +1,272 @@
+"""
+This file offers a Kalman filter that tracks the needle tip between the (slow and noisy) camera measurements
+
+The state is the tip position (x, y) and orientation angle a with their rates of change (vx, vy, w), all in the
+coordinates of the processed image: a constant velocity model for the position and the orientation.
+    - update(): fuses a vision measurement (tip_pos, tip_ori) at the time the frame was taken. Measurements that are
+      too far from the prediction (Mahalanobis distance above gate) are rejected as outliers, unless several in a
+      row are rejected: then the tip really moved and the filter starts again from the new measurement.
+    - command(): known motor moves. With the pixels (and degrees) per step of every motor in motor_gains, the move
+      is added to the prediction while the motors step; its uncertainty (command_noise) is added to the covariance.
+    - predict(t): the estimate at any time t, without changing the filter, so it can be asked at any rate.
+
+Settings are read from the [TRACKER] section of config.ini.
+"""
+import ast
+import math
+import threading
+import time
+import numpy as np
+
+# chi-square value of 3 degrees of freedom that 99.7 % of the correct measurements stay below
+DEFAULT_GATE = 14.2
+# the measurement is the (x, y, angle) part of the state
+_MEASURED = np.eye(3, 6)
+
+
+class TrackerSettings:
+    """
+    Noise levels of the TipTracker, read from the [TRACKER] section of config.ini
+
+    Attributes
+    ----------
+    position_noise, angle_noise : float
+        Standard deviation of a vision measurement in pixels, and of its orientation in degrees
+    acceleration_noise, angular_acceleration_noise : float
+        Standard deviation of the unmodelled acceleration in pixels/s^2, and degrees/s^2
+    motor_gains : list
+        Per motor the (x pixels, y pixels, degrees) the tip moves per forward step
+    command_noise : float
+        Relative standard deviation of the tip movement caused by a motor command
+    gate : float
+        Largest squared Mahalanobis distance of an accepted measurement
+    max_rejections : int
+        Number of rejected measurements in a row after which the filter is restarted
+    """
+
+    def __init__(self, tracker=None) -> None:
+        tracker = tracker if tracker is not None else {}
+        self.position_noise = float(tracker.get("position_noise", "3"))
+        self.angle_noise = float(tracker.get("angle_noise", "3"))
+        self.acceleration_noise = float(tracker.get("acceleration_noise", "200"))
+        self.angular_acceleration_noise = float(tracker.get("angular_acceleration_noise", "90"))
+        self.motor_gains = [tuple(float(value) for value in gains)
+                            for gains in ast.literal_eval(tracker.get("motor_gains", "[]"))]
+        self.command_noise = float(tracker.get("command_noise", "0.5"))
+        self.gate = float(tracker.get("gate", str(DEFAULT_GATE)))
+        self.max_rejections = int(tracker.get("max_rejections", "3"))
+
+    @classmethod
+    def from_config(cls, config_object):
+        """
+        Reads the settings from the [TRACKER] section of a ConfigParser, defaults when there is no such section
+        """
+        if config_object.has_section("TRACKER"):
+            return cls(config_object["TRACKER"])
+        return cls()
+
+
+class TipEstimate:
+    """
+    Estimated tip pose at a moment in time.
+
+    Attributes
+    ----------
+    time : float
+        Moment of the estimate (time.monotonic() of the tracker clock)
+    tip_pos : tuple
+        (x, y) position of the tip in processed image pixels
+    tip_ori : tuple
+        (x-direction, y-direction) unit vector of the tip, like the tip_ori of position_from_image
+    velocity : tuple
+        (x, y) velocity of the tip in pixels per second
+    position_std : float
+        Standard deviation of the position in pixels (root of the mean of the x and y variance)
+    """
+
+    def __init__(self, time_, tip_pos, tip_ori, velocity, position_std) -> None:
+        self.time = time_
+        self.tip_pos = tip_pos
+        self.tip_ori = tip_ori
+        self.velocity = velocity
+        self.position_std = position_std
+
+
+def _wrap(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class TipTracker:
+    """
+    Constant velocity Kalman filter of the tip pose, see the module docstring.
+    All methods can be called from different threads (vision results in the main loop, commands from the
+    MotionExecutor thread).
+
+    Attributes
+    ----------
+    settings : TrackerSettings
+        Noise levels, motor gains and outlier gate
+    clock : module or VirtualClock
+        Provides monotonic(), the time module or a simulator.VirtualClock
+    accepted, rejected : int
+        Number of accepted measurements and of rejected outliers
+    """
+
+    def __init__(self, settings=None, clock=time) -> None:
+        self.settings = settings if settings is not None else TrackerSettings()
+        self.clock = clock
+        self.accepted = 0
+        self.rejected = 0
+        self._rejections_in_a_row = 0
+        self._state = None
+        self._covariance = None
+        self._time = None
+        self._commands = []
+        self._last_command = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        """
+        True once a measurement has been fused
+        """
+        return self._state is not None
+
+    def reset(self) -> None:
+        """
+        Forgets the state, the next measurement starts the filter again
+        """
+        with self._lock:
+            self._state = None
+            self._covariance = None
+            self._time = None
+
+    def _transition(self, dt):
+        transition = np.eye(6)
+        transition[0:3, 3:6] = dt * np.eye(3)
+        q_pos = self.settings.acceleration_noise ** 2
+        q_ang = math.radians(self.settings.angular_acceleration_noise) ** 2
+        noise = np.zeros((6, 6))
+        for axis, q in ((0, q_pos), (1, q_pos), (2, q_ang)):
+            noise[axis, axis] = q * dt ** 3 / 3
+            noise[axis, axis + 3] = noise[axis + 3, axis] = q * dt ** 2 / 2
+            noise[axis + 3, axis + 3] = q * dt
+        return transition, noise
+
+    def _command_effect(self, start, end):
+        """
+        Change of (x, y, angle) caused by the commands between the times start and end, and its covariance
+        """
+        effect = np.zeros(3)
+        for deltas, command_start, duration in self._commands:
+            if duration <= 0:
+                overlap = 1.0 if start < command_start <= end else 0.0
+            else:
+                overlap = max(0.0, min(end, command_start + duration) - max(start, command_start)) / duration
+            if overlap <= 0:
+                continue
+            for delta, gains in zip(deltas, self.settings.motor_gains):
+                effect += overlap * delta * np.array((gains[0], gains[1], math.radians(gains[2])))
+        return effect, np.diag((self.settings.command_noise * effect) ** 2)
+
+    def _propagate(self, state, covariance, start, end):
+        dt = max(end - start, 0.0)
+        transition, noise = self._transition(dt)
+        state = transition @ state
+        covariance = transition @ covariance @ transition.T + noise
+        effect, effect_noise = self._command_effect(start, end)
+        state[0:3] += effect
+        covariance[0:3, 0:3] += effect_noise
+        return state, covariance
+
+    def command(self, deltas, start=None, duration=0.0) -> None:
+        """
+        Registers a motor move of deltas steps that starts at start (default: now) and takes duration seconds
+        """
+        if not self.settings.motor_gains:
+            return
+        with self._lock:
+            self._last_command = [[int(delta) for delta in deltas],
+                                  self.clock.monotonic() if start is None else start, duration]
+            self._commands.append(self._last_command)
+
+    def finish_command(self, done, end=None) -> None:
+        """
+        Replaces the last command by the steps that were really done until end (default: now),
+        for a move that was cancelled before it was finished
+        """
+        with self._lock:
+            if self._last_command is None:
+                return
+            end = self.clock.monotonic() if end is None else end
+            self._last_command[0] = [int(step) for step in done]
+            self._last_command[2] = max(end - self._last_command[1], 0.0)
+
+    def update(self, tip_pos, tip_ori, measured=None) -> bool:
+        """
+        Fuses the vision measurement (tip_pos, tip_ori) of the frame taken at measured (default: now).
+        Of a 3D measurement of two cameras (see stereo.py) the (x, y) part of the top view is used.
+        Returns False if it was rejected: as an outlier, or because it is older than the last fused measurement.
+        A measurement that follows more than max_rejections rejected ones restarts the filter and is accepted.
+        """
+        measured = self.clock.monotonic() if measured is None else measured
+        angle = math.atan2(tip_ori[1], tip_ori[0])
+        measurement = np.array((tip_pos[0], tip_pos[1], angle), dtype=np.float64)
+        noise = np.diag((self.settings.position_noise ** 2, self.settings.position_noise ** 2,
+                         math.radians(self.settings.angle_noise) ** 2))
+        with self._lock:
+            if self._state is None:
+                self._initialize(measurement, noise, measured)
+                return True
+            if measured < self._time:
+                return False
+            state, covariance = self._propagate(self._state, self._covariance, self._time, measured)
+            innovation = measurement - state[0:3]
+            innovation[2] = _wrap(innovation[2])
+            innovation_covariance = covariance[0:3, 0:3] + noise
+            inverse = np.linalg.inv(innovation_covariance)
+            if innovation @ inverse @ innovation > self.settings.gate:
+                self.rejected += 1
+                self._rejections_in_a_row += 1
+                if self._rejections_in_a_row > self.settings.max_rejections:
+                    self._initialize(measurement, noise, measured)
+                    return True
+                return False
+            gain = covariance[:, 0:3] @ inverse
+            state = state + gain @ innovation
+            state[2] = _wrap(state[2])
+            self._state = state
+            self._covariance = (np.eye(6) - gain @ _MEASURED) @ covariance
+            self._time = measured
+            self._forget_commands(measured)
+            self._rejections_in_a_row = 0
+            self.accepted += 1
+            return True
+
+    def _initialize(self, measurement, noise, measured) -> None:
+        self._state = np.concatenate((measurement, np.zeros(3)))
+        self._covariance = np.zeros((6, 6))
+        self._covariance[0:3, 0:3] = noise
+        # the rates are unknown: one second of the unmodelled acceleration
+        self._covariance[3:6, 3:6] = np.diag((self.settings.acceleration_noise ** 2,
+                                              self.settings.acceleration_noise ** 2,
+                                              math.radians(self.settings.angular_acceleration_noise) ** 2))
+        self._time = measured
+        self._forget_commands(measured)
+        self._rejections_in_a_row = 0
+        self.accepted += 1
+
+    def _forget_commands(self, before) -> None:
+        self._commands = [command for command in self._commands if command[1] + command[2] > before]
+
+    def predict(self, at=None):
+        """
+        TipEstimate at the time at (default: now), or None before the first measurement
+        """
+        with self._lock:
+            if self._state is None:
+                return None
+            at = self.clock.monotonic() if at is None else at
+            state, covariance = self._propagate(self._state, self._covariance, self._time, max(at, self._time))
+        return TipEstimate(at, (float(state[0]), float(state[1])), (math.cos(state[2]), math.sin(state[2])),
+                           (float(state[3]), float(state[4])), math.sqrt((covariance[0, 0] + covariance[1, 1]) / 2))
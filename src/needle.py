@@ -8,16 +8,25 @@ import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 from queue import LifoQueue
 import argparse
-import ast
+import functools
 import pyfirmata
 import pygame
-import numpy as np
 from labjack import ljm
 from configparser import ConfigParser
 
-from src.controls.stepper_motor import Steppermotor
+from src.controls.stepper_motor import Steppermotor, MOTOR_PINS
+from src.controls.step_train import StepTrain
+from src.controls.scheduler import StepScheduler
+from src.controls.motion_profile import profile_from_config
+from src.controls.motion_executor import MotionExecutor
+from src.controls.kinematics import DIRPULL, DIRPUSH, MOTORVEC, MovePlanner
+from src.controls.homing import HomingSettings, home_motors
+from src.controls.step_program import compile_test
+from src.controls.state_journal import StateJournal
+from src.controls.simulator import SimulatedBoard, SimulatedLJM
 from src.controls.controller import Controller
 from src.image_pos.image_acquisition import ImageAcquisition
+from src.image_pos.tip_tracker import TipTracker, TrackerSettings
 from src.util import logger
 
 
@@ -28,7 +37,7 @@ class Needle:
     Functions as a manager for the program, always knows what is the status of needle controlling parts.
     """
 
-    def __init__(self, comport_arduino, startsteps, sensitivity, invertx: bool, run_test: str):
+    def __init__(self, comport_arduino, startsteps, sensitivity, invertx: bool, run_test: str, dry_run=False):
         # Handle input parameters
         self.port = comport_arduino
         self.startcount = startsteps
@@ -39,50 +48,48 @@ class Needle:
             logger.info("Invalid sensitivity entered: new value = {}".format(self.sensitivity))
         self.invert_x_axis = invertx
         self.test = run_test
+        self.dry_run = dry_run
+        # smoothed tip pose from the camera (see tip_tracker.py), only available in manual_brachy_therapy
+        self.tip_estimate = None
 
-        # Setup Arduino and Stepper Motors
-        self.board = pyfirmata.Arduino(self.port)
-        time.sleep(1)
+        # config
+        self.config_object = ConfigParser()
+        self.config_object.read('config.ini')
+        needle_config = self.config_object["NEEDLE"]
+
+        # Setup Arduino and Stepper Motors, comport SIM uses an emulated board (and T7) instead of the hardware
+        if self.port == "SIM":
+            self.board = SimulatedBoard()
+            self.ljm = SimulatedLJM()
+        else:
+            self.ljm = ljm
+            self.board = pyfirmata.Arduino(self.port)
+            time.sleep(1)
         self.motors = []
         self.default_motor_setup()
-        self.dirpull = {
-            0: [0, 1],
-            1: [0],
-            2: [0, 3],
-            3: [3],
-            4: [2, 3],
-            5: [2],
-            6: [1, 2],
-            7: [1],
-        }
-
-        self.dirpush = {
-            0: [2, 3],
-            1: [2],
-            2: [1, 2],
-            3: [1],
-            4: [0, 1],
-            5: [0],
-            6: [0, 3],
-            7: [3],
-        }
 
+        # Let the board generate the step pulses itself if its firmware supports it (see step_train.py)
+        self.step_train = None
+        if needle_config.getboolean("step_train", False):
+            step_train = StepTrain(self.board)
+            if all(motor.attach_step_train(step_train) for motor in self.motors):
+                self.step_train = step_train
+                logger.success("Step trains are generated by the board")
+        self.scheduler = StepScheduler(self.motors, self.step_train)
+        # Moves from the input loops run in the background, a newer input preempts the move in progress
+        self.executor = MotionExecutor(self.scheduler, merge=needle_config.get("preemption", "cancel") == "merge")
+        self.dirpull = DIRPULL
+        self.dirpush = DIRPUSH
         # motor vectors that code for the directions in the x-y space of the needle
-        self.motorvec = {
-            0: np.array([1, 1]),
-            1: np.array([-1, 1]),
-            2: np.array([-1, -1]),
-            3: np.array([1, -1]),
-        }
+        self.motorvec = MOTORVEC
+        # inverse kinematics of all directions are precomputed once
+        self.planner = MovePlanner(self.sensitivity, len(self.motors))
 
         """
         FESTO section
         !!! to use FESTO:    first upload "FESTO_controlv3.lua" to the T7 with Kipling 3 software
                             then close the connection with Kipling 3 software
         """
-        # config
-        self.config_object = ConfigParser()
-        self.config_object.read('config.ini')
         festo = self.config_object["FESTO"]
 
         self.init_FESTO_pos = int(festo["initial_pos"])
@@ -106,7 +113,7 @@ class Needle:
         self.currentpos = self.init_FESTO_pos
 
         try:
-            FESTO_handle = ljm.openS("ANY", "USB", "ANY")
+            FESTO_handle = self.ljm.openS("ANY", "USB", "ANY")
         except ljm.LJMError as error:
             FESTO_handle = None
             logger.error("No FESTO_handle: thus not able to use the FESTO functions \n Error presented: " + str(error))
@@ -114,44 +121,71 @@ class Needle:
         if FESTO_handle is not None:
             self.FESTO_handle = FESTO_handle
             # Set initial positions (keep target pos at init_FESTO_pos at the start)
-            ljm.eWriteAddress(self.FESTO_handle, self.initialpos_addr, self.f_datatype, self.init_FESTO_pos)
-            ljm.eWriteAddress(self.FESTO_handle, self.targetpos_addr, self.f_datatype, self.init_FESTO_pos)
+            self.ljm.eWriteAddress(self.FESTO_handle, self.initialpos_addr, self.f_datatype, self.init_FESTO_pos)
+            self.ljm.eWriteAddress(self.FESTO_handle, self.targetpos_addr, self.f_datatype, self.init_FESTO_pos)
             # Set speed
-            ljm.eWriteAddress(self.FESTO_handle, self.speed_addr, self.f_datatype, self.init_FESTO_speed)
-            logger.success("FESTO connected, handle is available, init is set, current position =" + str(ljm.eReadAddress(self.FESTO_handle, self.AIN0addr, self.f_datatype)))
+            self.ljm.eWriteAddress(self.FESTO_handle, self.speed_addr, self.f_datatype, self.init_FESTO_speed)
+            logger.success("FESTO connected, handle is available, init is set, current position =" + str(self.ljm.eReadAddress(self.FESTO_handle, self.AIN0addr, self.f_datatype)))
             time.sleep(0.3)
 
             # Enable init LUA program
-            ljm.eWriteAddress(self.FESTO_handle, self.enable_addr, self.f_datatype, 1)
+            self.ljm.eWriteAddress(self.FESTO_handle, self.enable_addr, self.f_datatype, 1)
             logger.success("FESTO moving to initial position")
         else:
             logger.error("Something went wrong when creating a FESTO Handle. Check if all adresses are correct in needle.py")
             self.FESTO_handle = None
 
+        # State journal: restores the step counters of a cleanly closed session, or asks for homing after a crash
+        self.journal = None
+        self._needs_homing = False
+        if needle_config.get("state_journal", ""):
+            self.journal = StateJournal(needle_config["state_journal"], len(self.motors))
+            previous = self.journal.open()
+            if previous is None:
+                logger.info("No state journal yet, motors are assumed to be at {} steps".format(self.startcount))
+            elif previous.clean:
+                for motor, count in zip(self.motors, previous.counts):
+                    motor.stepcounter = count
+                self.init_pos = previous.init_pos
+                logger.success("Resumed from state journal: step counters {}, init_pos {}, FESTO was at {} mm".format(
+                    previous.counts, previous.init_pos, previous.festo_pos))
+            else:
+                self._needs_homing = True
+                logger.error("State journal: the previous session did not shut down cleanly, motors need homing")
+            self.journal.record([motor.get_count() for motor in self.motors], self.currentpos, self.init_pos)
+            self.scheduler.journal = self.journal
+
+    @property
+    def needs_homing(self) -> bool:
+        """
+        True when the step counters cannot be trusted: after a crash, or when a step train was not reported by the board
+        """
+        return self._needs_homing or (self.step_train is not None and bool(self.step_train.lost))
+
+    @needs_homing.setter
+    def needs_homing(self, value: bool) -> None:
+        self._needs_homing = value
+        if not value and self.step_train is not None:
+            self.step_train.lost.clear()
+
     def default_motor_setup(self):
         """
         Initializes default motor to Arduino board configuration
         """
-        motor0 = Steppermotor(self.board.get_pin('d:{}:o'.format(7)),
-                                     self.board.get_pin('d:{}:o'.format(6)),
-                                     self.startcount, 0)
-        motor1 = Steppermotor(self.board.get_pin('d:{}:o'.format(5)),
-                                     self.board.get_pin('d:{}:o'.format(4)),
-                                     self.startcount, 1)
-        motor2 = Steppermotor(self.board.get_pin('d:{}:o'.format(3)),
-                                     self.board.get_pin('d:{}:o'.format(2)),
-                                     self.startcount, 2)
-        motor3 = Steppermotor(self.board.get_pin('d:{}:o'.format(9)),
-                                     self.board.get_pin('d:{}:o'.format(8)),
-                                     self.startcount, 3)
-        self.motors.extend([motor0, motor1, motor2, motor3])
+        for index, (dirpin, movpin) in enumerate(MOTOR_PINS):
+            self.motors.append(Steppermotor(self.board.get_pin('d:{}:o'.format(dirpin)),
+                                            self.board.get_pin('d:{}:o'.format(movpin)),
+                                            self.startcount, index, profile_from_config(self.config_object, index)))
 
     def add_motor(self, dirpin, steppin, startcount, index):
         """
         Add specific stepper_motor to Motor array
         """
         motor = Steppermotor(self.board.get_pin('d:{}:o'.format(dirpin)),
-                                    self.board.get_pin('d:{}:o'.format(steppin)), startcount, index)
+                                    self.board.get_pin('d:{}:o'.format(steppin)), startcount, index,
+                                    profile_from_config(self.config_object, index))
+        if self.step_train is not None:
+            motor.attach_step_train(self.step_train)
         self.motors.insert(index, motor)
 
     def remove_motor(self, index):
@@ -181,34 +215,47 @@ class Needle:
         """
         # Create Class instances of controller and image acquisition
         input_method = Controller(self.invert_x_axis)
-        image_acquisition = ImageAcquisition(args.fps, args.camtop, args.camfront, args.nofeed)
+        image_acquisition = ImageAcquisition(args.fps, args.camtop, args.camfront, args.nofeed, args.recorddir,
+                                             args.detectors, args.session)
 
         # Queues allow for communication between threads/processes. LIFO means the most recent image/input will be used
         input_feed = LifoQueue(maxsize=0) # Create LIFO queue of infinite size that reads controller input
         needle_pos_feed = multiprocessing.Queue(maxsize=0) # Create Queue for communication of needle tip pos/ori
+        # Kalman filter between the camera and this loop: smoothed tip pose at any moment, also between frames
+        tracker = TipTracker(TrackerSettings.from_config(self.config_object))
+        self.scheduler.tracker = tracker
+        # the camera process detects every frame while the motors move, and skips unchanged frames in between
+        self.scheduler.motion = image_acquisition.moved
 
         # Create and start Process for Image Acq/Proc
         process_1 = multiprocessing.Process(target=image_acquisition.retrieve_current_image, args=(needle_pos_feed, ))
         process_1.name = "ImageAcquiProc_process"
+        process_1.start()
 
         # Start pygame to allow controller and keyboard inputs
         pygame.init()
+        self.executor.start()
 
         logger.success("Ready to receive inputs.\n")
         while True:
             # Check for needle coordinates in the Multiprocessing Queue
             if not needle_pos_feed.empty():
 
-                tip_position, tip_ori = needle_pos_feed.get()
+                tip_position, tip_ori, frame_time = needle_pos_feed.get()
 
                 # Sentinel value found, exit program
                 if tip_position is None and tip_ori is None:
                     break
 
+                if not tracker.update(tip_position, tip_ori, frame_time):
+                    logger.info("Rejected tip measurement {} as an outlier".format(tip_position))
                 logger.info("Needletip is currently at {}".format(tip_position))
                 logger.info("Needle orientation is currently {}".format(tip_ori))
                 # TODO: check and finish use of image proc in manual_brachy function
 
+            # Smoothed tip pose of this moment, updated every loop iteration
+            self.tip_estimate = tracker.predict()
+
             # Retrieve any user inputs
             events = pygame.event.get()
             input_method.get_direction_from_pygame_events(input_feed, events)
@@ -232,15 +279,21 @@ class Needle:
             # Move the needle:
             if direction.direction == 100:
                 logger.success("Init called: moving to midpoint then to zero")
+                self.executor.cancel()
+                self.executor.wait_idle()
                 self.initial_position()
 
             else:
                 logger.success("Moving to : {}".format(input_method.dir_to_text(direction.direction)))
-                self.move_to_dir_sync(direction)
-                logger.success("\nReady to receive inputs.\n")
+                self.executor.submit(functools.partial(self.plan_dir_sync, direction),
+                                     input_method.dir_to_text(direction.direction))
 
 
         # Neatly exiting main program loop
+        self.executor.stop()
+        self.scheduler.tracker = None
+        self.scheduler.motion = None
+        self.close()
         pygame.quit()
         image_acquisition.is_running = False
         input_method.is_running = False
@@ -261,6 +314,7 @@ class Needle:
             test = self.config_object[self.test]
             self.run_predefined_test(test, input_method)
 
+        self.executor.start()
         while True:
             # Retrieve user inputs
             events = pygame.event.get()
@@ -286,10 +340,13 @@ class Needle:
                 if dir_output.direction == 100:
                     logger.success("Init called: Needle motors moving to midpoint then to zero \n"
                                    "                FESTO returning to initial point")
+                    self.executor.cancel()
+                    self.executor.wait_idle()
                     self.initial_position()
                 elif dir_output.direction == -3: # The X-Button: a counter part of the Y-button
                     # Set the init_pos back to 0
                     self.init_pos = 0
+                    self.record_state()
                     print("The new initial position is 0")
                 elif dir_output.direction == -2: # Special value for pressing the Y-button
                     # We want a new initial position, update initial position to current position
@@ -302,7 +359,7 @@ class Needle:
                     midpoint = int((max(currentpos) + min(currentpos)) / 2)
                     print("The new initial position instead of 0 is the average of current pos: ", midpoint)
                     self.init_pos = midpoint
-
+                    self.record_state()
 
                 elif dir_output.direction == 200:
                     logger.success("Moving to : {}".format(input_method.dir_to_text(dir_output.direction)))
@@ -316,10 +373,12 @@ class Needle:
                     continue
                 else:
                     logger.success("Moving to : {}".format(input_method.dir_to_text(dir_output.direction)))
-                    self.move_to_dir_syncv2(dir_output, report=1)
-                    logger.success("\nReady to receive inputs.\n")
+                    self.executor.submit(functools.partial(self.plan_dir_move, dir_output, 1),
+                                         input_method.dir_to_text(dir_output.direction))
 
         # Neatly exiting main program loop
+        self.executor.stop()
+        self.close()
         pygame.quit()
         input_method.is_running = False
 
@@ -329,68 +388,28 @@ class Needle:
 
         :param test: the name of the test to run, passed along by --test and found in config.ini
         :param input_method: the Controller object made in move_freely, methods of this Controller are used in the function.
+        With dry_run the compiled program and its estimated duration are printed without moving the motors.
         :return: None, the program exits using sys.exit() 
         """
         logger.success("STARTING PREDEFINED TEST")
 
-        # Load command arrays
-        number_of_positions = int(test["number_of_positions"])
-        motor0test = ast.literal_eval(test["motor0test"])
-        motor1test = ast.literal_eval(test["motor1test"])
-        motor2test = ast.literal_eval(test["motor2test"])
-        motor3test = ast.literal_eval(test["motor3test"])
-        coords = ast.literal_eval(test["coords"])
-        sleep = ast.literal_eval(test["sleep"])
-
-        logger.info("Running {} positions".format(number_of_positions))
-
-        for position in range(number_of_positions):
-
-            # Run motors with specified steps
-            if motor0test[position] < 0:
-                logger.info("Motor 0 took {} steps".format(motor0test[position]))
-                self.motors[0].run_backward(motor0test[position])
-            else:
-                logger.info("Motor 0 took {} steps".format(motor0test[position]))
-                self.motors[0].run_forward(motor0test[position])
-            if motor1test[position] < 0:
-                logger.info("Motor 1 took {} steps".format(motor1test[position]))
-                self.motors[1].run_backward(motor1test[position])
-            else:
-                logger.info("Motor 1 took {} steps".format(motor1test[position]))
-                self.motors[1].run_forward(motor1test[position])
-            if motor2test[position] < 0:
-                logger.info("Motor 2 took {} steps".format(motor2test[position]))
-                self.motors[2].run_backward(motor2test[position])
-            else:
-                logger.info("Motor 2 took {} steps".format(motor2test[position]))
-                self.motors[2].run_forward(motor2test[position])
-            if motor3test[position] < 0:
-                logger.info("Motor 3 took {} steps".format(motor3test[position]))
-                self.motors[3].run_backward(motor3test[position])
-            else:
-                logger.info("Motor 3 took {} steps".format(motor3test[position]))
-                self.motors[3].run_forward(motor3test[position])
-
-            # Go to coordinates with move_to_dir_sync
-            test_x = coords[position][0] / 100
-            test_y = coords[position][1] / 100
-            gdo_test = input_method.analog_stick_to_dir(test_x, test_y)
-
-            # Check if the motors should move to a position
-            if test_x != 0 and test_y != 0:
-                logger.info("Motors are moving to position ({}, {})".format(test_x, test_y))
-                self.move_to_dir_syncv2(gdo_test)
-
-            # Then sleep
-            if sleep[position] == 0:
-                input("Press Enter to continue...")
-            else:
-                logger.info("Sleeping for {} seconds...".format(sleep[position]))
-                time.sleep(sleep[position])
+        # Plan the whole test before moving, every position becomes one concurrent move of all motors
+        program = compile_test(test, self.planner, input_method.analog_stick_to_dir,
+                               [motor.get_count() for motor in self.motors], self.test)
+        logger.info("Running {} positions, estimated duration {:.1f} s (+ {} manual pauses)".format(
+            len(program.steps), program.duration(self.scheduler), program.manual_pauses()))
+
+        if self.dry_run:
+            for position, step in enumerate(program.steps):
+                print("Position {}: {} -> deltas {}, {:.2f} s".format(
+                    position, step.label, step.deltas, self.scheduler.duration(step.deltas)))
+            print("Final step counters: {}".format(program.final_counts))
+        else:
+            program.run(self.scheduler)
 
         # Neatly exiting main program loop
         logger.success("ENDING PREDEFINED TEST")
+        self.close()
         pygame.quit()
 
         logger.success("Exiting Program...")
@@ -399,120 +418,71 @@ class Needle:
     def move_to_dir_syncv2(self, gdo, report=0):
         """
         Receive direction (gdo) --> Drive needle with motors synchronously
+        The steps per motor are found by plan_dir_move, then all motors step at the same time with the scheduler.
+
+        gdo = get direction output (an object of the class Output(direction, stepsout) )
+        """
+        deltas = self.plan_dir_move(gdo, report)
+        if deltas is None:
+            return None
+        self.scheduler.move(deltas, report=report)
+        # report final motor positions to user
+        for motor_i in range(len(self.motors)):
+            self.motors[motor_i].get_count(report=1)
+        return 0
+
+    def plan_dir_move(self, gdo, report=0):
+        """
+        Receive direction (gdo) --> steps per motor to drive the needle synchronously
         1) Find A and B such that gdo.stepsout = (stepsx, stepsy) = A(motor_u) + B(motor_Z)
             (linear combination of 2 motor vectors to reach gdo.stepsout vector)
         2a) view the push option (corresponds with run_forward() method) ELSE do 2b)
         2b) view the pull option (corresponds with run_backward() method ELSE do *)
-        *) return error in case both options do not work
+        *) return None in case both options do not work
 
         gdo = get direction output (an object of the class Output(direction, stepsout) )
+        returns the list of step deltas per motor (push > 0, pull < 0)
         """
-
-        # 1) if push available then find the steps for motorpush0 and motorpush1
-        motor_matrix_push = []
-        for n in self.dirpush[gdo.direction]:
-            motor_matrix_push.append(self.motorvec[n])
-        a = np.array(motor_matrix_push, dtype=int)
-        b = np.array([int(gdo.stepsout[0]*self.sensitivity), int(gdo.stepsout[1]*self.sensitivity)], dtype=int)
-        x = np.linalg.solve(a.transpose(), b)
-        big_a = int(abs(x[0]))
-        big_b = int(abs(x[1]))
+        deltas = self.planner.plan(gdo, [motor.get_count() for motor in self.motors])
         if report == 1:
-            print("NEEDLE->move_syncV2: PUSH system of equations: \n"
-                  "|     a = " + str(a.transpose()[0]) + "\n"
-                  "|         " + str(a.transpose()[1]) + "\n"
-                  "|     b = " + str(b) + "\n"
-                  "|     [big_a, big_b] = " + str([big_a, big_b]) + "\n")
-
-        motorpush0 = self.dirpush[gdo.direction][0]
-        motorpush1 = self.dirpush[gdo.direction][1]
-        if report == 1:
-            print("|     motorpush0 = " + str(motorpush0) + " motorpush1 = " + str(motorpush1))
-
-        # can we push? IF yes ==> then push ELSE continue to pull
-        if self.motors[motorpush0].get_count() + abs(big_a) <= 400 and self.motors[motorpush1].get_count() + abs(big_b) <= 400:
-            print("NEEDLE->move_syncV2: PUSH available, starting...")
-            if big_b > big_a:
-                if big_a == 0: # removing division by zero error
-                    big_a = 1
-                ratio = int(big_b/big_a)
-                #print(" mod ratio = ", ratio)
-                for i in range(big_a + big_b):
-                    if i % (ratio+1) == 0 and i != 0:
-                        #print("big_a at i = ", i)
-                        self.motors[motorpush0].run_forward(1)
-                    else:
-                        self.motors[motorpush1].run_forward(1)
-            else:
-                if big_b == 0:
-                    big_b = 1
-                ratio = int(big_a/big_b)
-                #print(" mod ratio = ", ratio)
-                for i in range(big_a + big_b):
-                    if i % (ratio+1) == 0 and i != 0:
-                        #print("big_b at i = ", i)
-                        self.motors[motorpush1].run_forward(1)
-                    else:
-                        self.motors[motorpush0].run_forward(1)
-            # report final motor positions to user
-            for motor_i in range(len(self.motors)):
-                self.motors[motor_i].get_count(report=1)
-            return 0
-
-        print("\nNEEDLE->move_syncV2: PUSH not available, trying PULL")
-        # 2) if pull available then find the steps for motorpull0 and motorpull1
-        motor_matrix_pull = []
-        for n in self.dirpull[gdo.direction]:
-            motor_matrix_pull.append(self.motorvec[n])
-        a = np.array(motor_matrix_pull, dtype=int)
-        b = np.array([int(gdo.stepsout[0]*self.sensitivity), int(gdo.stepsout[1]*self.sensitivity)], dtype=int)
-        x = np.linalg.solve(a.transpose(), b)
-        big_a = int(abs(x[0]))
-        big_b = int(abs(x[1]))
-        if report == 1:
-            print("NEEDLE->move_syncV2: PULL system of equations: \n"
-                  "|     a = " + str(a.transpose()[0]) + "\n"
-                  "|         " + str(a.transpose()[1]) + "\n"
-                  "|     b = " + str(b) + "\n"
-                  "|     [big_a, big_b] = " + str([big_a, big_b]) + "\n")
-
-        motorpull0 = self.dirpull[gdo.direction][0]
-        motorpull1 = self.dirpull[gdo.direction][1]
-        if report == 1:
-            print("|     motorpull0 = " + str(motorpull0) + " motorpull1 = " + str(motorpull1))
-
-        # can we pull? IF yes ==> then pull ELSE report the movement requested is not possible
-        if self.motors[motorpull0].get_count() - abs(big_a) >= 0 and self.motors[motorpull1].get_count() - abs(big_b) >= 0:
-            print("NEEDLE->move_syncV2: PULL available, starting...")
-            if big_b > big_a:
-                if big_a == 0: # removing division by zero error
-                    big_a = 1
-                ratio = int(big_b/big_a)
-                #print(" mod ratio = ", ratio)
-                for i in range(big_a + big_b):
-                    if i % (ratio+1) == 0 and i != 0:
-                        #print("big_a at i = ", i)
-                        self.motors[motorpull0].run_backward(1)
-                    else:
-                        self.motors[motorpull1].run_backward(1)
-            else:
-                if big_b == 0:
-                    big_b = 1
-                ratio = int(big_a/big_b)
-                #print(" mod ratio = ", ratio)
-                for i in range(big_a + big_b):
-                    if i % (ratio+1) == 0 and i != 0:
-                        #print("big_b at i = ", i)
-                        self.motors[motorpull1].run_backward(1)
-                    else:
-                        self.motors[motorpull0].run_backward(1)
-            # report final motor positions to user
-            for motor_i in range(len(self.motors)):
-                self.motors[motor_i].get_count(report=1)
-            return 0
-        else:
+            print("NEEDLE->move_syncV2: direction = {}, stepsout = {} --> deltas = {}".format(
+                gdo.direction, gdo.stepsout, deltas))
+        if deltas is None:
             logger.error("\n NEEDLE->move_syncV2: neither PUSH nor PULL available; no movement of needle occurred")
+        return deltas
+
+
+    def home(self) -> float:
+        """
+        Homes all motors at the same time on the board connection of this Needle (see controls/homing.py):
+        a fast approach to zero, a short slow final approach, then all motors to startsteps.
+        Returns the total homing time in seconds.
+        """
+        startsteps = min(int(self.startcount), 400)
+        elapsed = home_motors(self.scheduler, HomingSettings.from_config(self.config_object), startsteps)
+        self.init_pos = 0
+        self.needs_homing = False
+        self.record_state()
+        for motor_i in range(len(self.motors)):
+            self.motors[motor_i].get_count(report=1)
+        return elapsed
+
+    def record_state(self) -> None:
+        """
+        Writes the step counters, FESTO position and init_pos to the state journal (if there is one)
+        """
+        if self.journal is not None:
+            self.journal.record([motor.get_count() for motor in self.motors], self.currentpos, self.init_pos)
 
+    def close(self) -> None:
+        """
+        Marks the state journal as cleanly closed, so the next session can resume without homing.
+        When a motor lost its position the journal stays RUNNING, so the next session homes.
+        """
+        if self.journal is not None:
+            if self.needs_homing:
+                logger.error("Motors need homing, the state journal is not marked clean")
+            self.journal.close(clean=not self.needs_homing)
 
     def initial_position(self):
         """
@@ -529,21 +499,15 @@ class Needle:
         print("Midpoint = ", midpoint)
 
 
-        # return to midpoint individually
+        # all motors return to midpoint at the same time
         print('\nNEEDLE->initial_position: starting to move to midpoint...  midpoint =', midpoint)
-        for motor_i in range(len(self.motors)):
-            if currentpos[motor_i] > midpoint:
-                self.motors[motor_i].run_backward(currentpos[motor_i] - midpoint)
-            else:
-                self.motors[motor_i].run_forward(midpoint - currentpos[motor_i])
+        self.scheduler.move([midpoint - position for position in currentpos])
 
         # all return simultaneously to init_pos
         print('\nNEEDLE->initial_position: starting to move to zero...')
-        # for _ in range(midpoint):
         nr_of_steps_to_init = midpoint - self.init_pos
         print("I am going to take nr_of_steps_to_init : ", nr_of_steps_to_init)
-        for motor_i in range(len(self.motors)):
-            self.motors[motor_i].run_backward(nr_of_steps_to_init)
+        self.scheduler.move([-nr_of_steps_to_init] * len(self.motors))
 
         print("\nReady to receive input again")
         for motor_i in range(len(self.motors)):
@@ -552,72 +516,35 @@ class Needle:
     def move_to_dir_sync(self, gdo):
         """
         Krijg een richting --> Stuur de motors synchroon
-        doe één stap op motor 1 dan op 2 dan 3 dan 4 dan weer één op 1 etc tot alle stappen zijn bereikt
+        alle motoren stappen tegelijk in dezelfde puls (zie StepScheduler) tot alle stappen zijn bereikt
+        gdo = get direction output (an object of the class Output(direction: int, stepsout: tuple) )
+        """
+        deltas = self.plan_dir_sync(gdo)
+        print('\nNEEDLE->move_to_dir_sync: starting to move sync...  deltas =', deltas)
+        self.scheduler.move(deltas)
+        print('\nNEEDLE->move_to_dir_sync: Movement finished. Step count after movement : ')
+        for motor_i in range(len(self.motors)):
+            self.motors[motor_i].get_count(report=1)
+
+    def plan_dir_sync(self, gdo):
+        """
+        Steps per motor for move_to_dir_sync: the pull motors go back and the push motors go forward
         gdo = get direction output (an object of the class Output(direction: int, stepsout: tuple) )
         """
         # TODO implement automated needle speed adjustment
         sx = round(self.sensitivity * gdo.stepsx)
         sy = round(self.sensitivity * gdo.stepsy)
 
-        # setting directions for each motor (pulling = 0, pushing = 1)
+        # steps for each motor (pulling < 0, pushing > 0), all motors step at the same time
         motorpull = self.dirpull[gdo.direction]
         motorpush = self.dirpush[gdo.direction]
+        deltas = [0] * len(self.motors)
+        deltas[motorpull[0]] = -1 * sx
+        deltas[motorpush[0]] = sx
         if len(motorpull) > 1:
-            self.motors[motorpull[0]].dirpin.write(0)
-            self.motors[motorpull[1]].dirpin.write(0)
-            self.motors[motorpush[0]].dirpin.write(1)
-            self.motors[motorpush[1]].dirpin.write(1)
-        else:
-            self.motors[motorpull[0]].dirpin.write(0)
-            self.motors[motorpush[0]].dirpin.write(1)
-
-        # writing to the movpins in one while loop
-        total_steps = sx+sy
-        print('\nNEEDLE->move_to_dir_sync: starting to move sync...  total_steps =', total_steps)
-        count = 0
-        xcount = 0
-        ycount = 0
-        if len(motorpull) > 1:
-            while count <= total_steps:
-                if xcount < sx:
-                    xcount = xcount + 1
-                    self.motors[motorpull[0]].movpin.write(1)
-                    self.motors[motorpush[0]].movpin.write(1)
-                    time.sleep(0.01)
-                    self.motors[motorpull[0]].movpin.write(0)
-                    self.motors[motorpush[0]].movpin.write(0)
-                    time.sleep(0.01)
-                if ycount < sy:
-                    ycount = ycount + 1
-                    self.motors[motorpull[1]].movpin.write(1)
-                    self.motors[motorpush[1]].movpin.write(1)
-                    time.sleep(0.01)
-                    self.motors[motorpull[1]].movpin.write(0)
-                    self.motors[motorpush[1]].movpin.write(0)
-                    time.sleep(0.01)
-                count = count + 1
-            # setting stepcounters to current positions
-            self.motors[motorpull[0]].set_count(-1 * sx)
-            self.motors[motorpull[1]].set_count(-1 * sy)
-            self.motors[motorpush[0]].set_count(sx)
-            self.motors[motorpush[1]].set_count(sy)
-        else:
-            while count <= sx:
-                count = count + 1
-                self.motors[motorpull[0]].movpin.write(1)
-                self.motors[motorpush[0]].movpin.write(1)
-                time.sleep(0.01)
-                self.motors[motorpull[0]].movpin.write(0)
-                self.motors[motorpush[0]].movpin.write(0)
-                time.sleep(0.01)
-            # setting stepcounters to current positions
-            self.motors[motorpull[0]].set_count(-1*sx)
-            self.motors[motorpush[0]].set_count(sx)
-        print('\nNEEDLE->move_to_dir_sync: Movement finished. Step count after movement : ')
-        self.motors[0].get_count()
-        self.motors[1].get_count()
-        self.motors[2].get_count()
-        self.motors[3].get_count()
+            deltas[motorpull[1]] = -1 * sy
+            deltas[motorpush[1]] = sy
+        return deltas
 
 
     def festo_move(self, targetpos: int, speed: float, relative=0) -> None:
@@ -638,7 +565,8 @@ class Needle:
                 print("NEEDLE->festo_move: Warning, currentpos is going past 50")
             targetpos = self.currentpos + targetpos
 
-        ljm.eWriteAddress(self.FESTO_handle, self.targetpos_addr, self.f_datatype, targetpos)
-        ljm.eWriteAddress(self.FESTO_handle, self.speed_addr, self.f_datatype, speed)
+        self.ljm.eWriteAddress(self.FESTO_handle, self.targetpos_addr, self.f_datatype, targetpos)
+        self.ljm.eWriteAddress(self.FESTO_handle, self.speed_addr, self.f_datatype, speed)
 
         self.currentpos = targetpos
+        self.record_state()
@@ -0,0 +1,97 @@
+"""
+Makes the src package importable from the tests, like the sys.path line at the top of the modules in src, and offers
+the emulated hardware the tests of src/controls share: a VirtualClock, a SimulatedSerial on that clock, and the
+pyfirmata ports or the SysEx commands of a board on that serial port
+"""
+import os
+import sys
+import types
+import pyfirmata
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(ROOT)
+# the logger writes every message to output/log.txt
+os.makedirs(os.path.join(ROOT, "output"), exist_ok=True)
+
+from src.controls.simulator import SimulatedSerial, VirtualClock  # noqa: E402 (needs the path above)
+
+
+class SerialBoard:
+    """
+    The SysEx part of a pyfirmata Board on a SimulatedSerial, enough for a StepTrain. SimulatedBoard itself needs
+    inspect.getargspec, which pyfirmata 1.1 still uses and Python 3.11 no longer has.
+    """
+
+    def __init__(self, serial) -> None:
+        self.sp = serial
+        self.handlers = {}
+
+    def add_cmd_handler(self, command, handler) -> None:
+        self.handlers[command] = handler
+
+    def send_sysex(self, command, data) -> None:
+        self.sp.write(bytearray([pyfirmata.START_SYSEX, command] + list(data) + [pyfirmata.END_SYSEX]))
+
+    def bytes_available(self) -> int:
+        return self.sp.inWaiting()
+
+    def iterate(self) -> None:
+        message = bytearray(self.sp.read())
+        while message[-1] != pyfirmata.END_SYSEX:
+            message += self.sp.read()
+        self.handlers[message[1]](*message[2:-1])
+
+
+class MuteBoard(SerialBoard):
+    """
+    Board that accepts every SysEx command and never answers
+    """
+
+    def __init__(self) -> None:
+        super().__init__(None)
+
+    def send_sysex(self, command, data) -> None:
+        pass
+
+    def bytes_available(self) -> int:
+        return 0
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+@pytest.fixture
+def serial(clock):
+    return SimulatedSerial(clock=clock)
+
+
+@pytest.fixture
+def sysex_board(serial):
+    return SerialBoard(serial)
+
+
+@pytest.fixture
+def mute_board():
+    return MuteBoard()
+
+
+@pytest.fixture
+def board(serial):
+    """
+    Digital ports 0 (pins 0 - 7) and 1 (pins 8 - 15) of a board on serial, through the regular pyfirmata Port and
+    Pin classes
+    """
+    board = types.SimpleNamespace(sp=serial)
+    board.ports = [pyfirmata.Port(board, 0), pyfirmata.Port(board, 1)]
+    return board
+
+
+@pytest.fixture
+def pin(board):
+    """
+    Function that returns the pyfirmata Pin of a digital pin number of board
+    """
+    return lambda number: board.ports[number // 8].pins[number % 8]
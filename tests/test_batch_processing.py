@@ -0,0 +1,71 @@
+"""
+Tests of the batch processing of a directory of images (src/image_pos/batch_processing.py) with the photos in
+src/image_pos/photos
+"""
+import csv
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+from src.image_pos.batch_processing import CSV_HEADER, process_batch
+from src.image_pos.image_proc2 import position_from_image
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src")
+CONFIG = os.path.join(SRC, "config.ini")
+PHOTOS = ["bending.jpg", "bending2.jpg", "black.jpeg", "festo.jpeg"]
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """
+    Directory with the photos in PHOTOS, a file that is no image and a file with an image name that cannot be read
+    """
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for name in PHOTOS:
+        shutil.copy(os.path.join(SRC, "image_pos", "photos", name), str(directory / name))
+    (directory / "notes.txt").write_text("not an image")
+    (directory / "zz_broken.jpg").write_bytes(b"not a jpeg")
+    return directory
+
+
+def expected_tips():
+    tips = []
+    for name in sorted(PHOTOS):
+        tip_position, tip_ori = position_from_image(cv2.imread(os.path.join(SRC, "image_pos", "photos", name)),
+                                                    CONFIG, "yes")
+        tips.append((name, tip_position, tip_ori))
+    return tips + [("zz_broken.jpg", None, None)]
+
+
+def test_csv_rows_come_in_file_order(image_dir, tmp_path):
+    output = str(tmp_path / "tips.csv")
+    assert process_batch(str(image_dir), output, CONFIG, flip="yes", workers=2) == len(PHOTOS) + 1
+    with open(output, newline="") as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows[0] == CSV_HEADER
+    for frame_nr, (row, (name, tip_position, tip_ori)) in enumerate(zip(rows[1:], expected_tips())):
+        assert row[:2] == [str(frame_nr), name]
+        if tip_position is None:
+            assert row[2:6] == ["", "", "", ""]
+        else:
+            assert (int(row[2]), int(row[3])) == tuple(tip_position)
+            assert (float(row[4]), float(row[5])) == pytest.approx(tip_ori)
+    assert len(rows) == len(PHOTOS) + 2
+
+
+def test_npz_arrays_have_nan_for_a_missing_tip(image_dir, tmp_path):
+    output = str(tmp_path / "tips.npz")
+    process_batch(str(image_dir), output, CONFIG, flip="yes", workers=2)
+    with np.load(output) as results:
+        assert list(results["frame"]) == list(range(len(PHOTOS) + 1))
+        assert list(results["source"]) == sorted(PHOTOS) + ["zz_broken.jpg"]
+        for tip, ori, (_, tip_position, tip_ori) in zip(results["tip"], results["ori"], expected_tips()):
+            if tip_position is None:
+                assert np.isnan(tip).all() and np.isnan(ori).all()
+            else:
+                assert tuple(tip) == tuple(tip_position)
+                assert tuple(ori) == pytest.approx(tip_ori)
+        assert (results["seconds"][:-1] > 0).all()
+        assert results["seconds"][-1] == 0
@@ -0,0 +1,49 @@
+"""
+Tests of the benchmark of the needle detection on synthetic frames (src/image_pos/benchmark.py)
+"""
+import copy
+import os
+import numpy as np
+import pytest
+from src.image_pos import benchmark
+from src.image_pos.image_proc2 import NeedleDetector
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src")
+CONFIG = os.path.join(SRC, "config.ini")
+
+
+@pytest.mark.parametrize("tracking", ["no", "yes"])
+def test_cases_have_the_stages_of_detect(tracking):
+    results = benchmark.run_benchmark(CONFIG, tracking=tracking, repeats=3, resolutions=((640, 480),),
+                                      noise_levels=(0,))
+    name = "640x480_noise0" + ("_tracking" if tracking == "yes" else "")
+    case = results["cases"][name]
+    assert set(case["stages"]) == {"gray", "resize", "lpf", "canny", "hough", "post", "total"}
+    assert case["detected"] == 1.0
+    assert case["fps"] == pytest.approx(1e3 / case["stages"]["total"]["p50"], rel=0.5)
+
+
+def test_tip_error_is_that_of_detect_in_processed_pixels():
+    results = benchmark.run_benchmark(CONFIG, flip="yes", repeats=3, resolutions=((1280, 720),), noise_levels=(10,))
+    detector = NeedleDetector(CONFIG, 40, flip="yes", filtering="yes")
+    errors = []
+    for seed in range(3):
+        frame, tip = benchmark.synthetic_needle_image(1280, 720, 10, seed)
+        tip_pos = detector.detect(frame)[0]
+        expected = (1280 * 0.4 - 1 - (tip[0] + 0.5) * 0.4 + 0.5, (tip[1] + 0.5) * 0.4 - 0.5)
+        errors.append(np.hypot(tip_pos[0] - expected[0], tip_pos[1] - expected[1]))
+    assert results["cases"]["1280x720_noise10"]["median_tip_error"] == pytest.approx(np.median(errors))
+
+
+def test_only_slower_stages_of_the_same_case_are_regressions():
+    results = benchmark.run_benchmark(CONFIG, repeats=2, resolutions=((640, 480),), noise_levels=(0,))
+    assert benchmark.compare_to_baseline(results, results) == []
+    baseline = copy.deepcopy(results)
+    stages = baseline["cases"]["640x480_noise0"]["stages"]
+    stages["canny"]["p50"] = results["cases"]["640x480_noise0"]["stages"]["canny"]["p50"] / 2
+    stages["post"]["p50"] = 0.0
+    regressions = benchmark.compare_to_baseline(results, baseline, min_ms=0.0001)
+    assert len(regressions) == 1 and regressions[0].startswith("640x480_noise0 canny")
+    # a tracking run is not compared with the cases of a run without tracking
+    baseline["cases"] = {name + "_tracking": case for name, case in baseline["cases"].items()}
+    assert benchmark.compare_to_baseline(results, baseline, min_ms=0.0001) == []
@@ -0,0 +1,115 @@
+"""
+Tests of the camera calibration (src/image_pos/calibration.py) on synthetic photos of a chessboard
+"""
+import types
+import cv2
+import numpy as np
+import pytest
+from src.image_pos.calibration import CameraCalibration, chessboard_points, find_chessboard, load_calibration
+
+PATTERN = (9, 6)
+SQUARE = 5.0
+WIDTH, HEIGHT = 960, 540
+
+
+def chessboard_photos(count=8, square=30):
+    """
+    Photos of a chessboard of PATTERN inner corners seen from count random poses by a camera without distortion
+    """
+    columns, rows = PATTERN
+    board = np.full(((rows + 1) * square + 2 * square, (columns + 1) * square + 2 * square), 255, np.uint8)
+    for row in range(rows + 1):
+        for column in range(columns + 1):
+            if (row + column) % 2 == 0:
+                board[square + row * square:square + (row + 1) * square,
+                      square + column * square:square + (column + 1) * square] = 0
+    camera_matrix = np.array([[700, 0, WIDTH / 2], [0, 700, HEIGHT / 2], [0, 0, 1.0]])
+    height, width = board.shape
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    rng = np.random.default_rng(0)
+    photos = []
+    for _ in range(count):
+        rotation = rng.normal(0, 0.25, 3)
+        translation = np.array([-width / 2 + rng.normal(0, 30), -height / 2 + rng.normal(0, 30),
+                                800 + rng.normal(0, 80)])
+        projected, _ = cv2.projectPoints(np.hstack((corners, np.zeros((4, 1)))).astype(np.float64), rotation,
+                                         translation, camera_matrix, None)
+        warp = cv2.getPerspectiveTransform(corners, projected.reshape(-1, 2).astype(np.float32))
+        photo = cv2.warpPerspective(board, warp, (WIDTH, HEIGHT), borderValue=255)
+        photos.append(cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR))
+    return photos
+
+
+@pytest.fixture(scope="module")
+def photos():
+    return chessboard_photos()
+
+
+@pytest.fixture(scope="module")
+def calibration(photos):
+    return CameraCalibration.from_chessboards(photos, photos[0], PATTERN, SQUARE)
+
+
+def test_lens_calibration_fits(calibration):
+    assert calibration.rms < 0.5
+    assert calibration.image_size == (WIDTH, HEIGHT)
+    assert calibration.camera_matrix[0, 0] == pytest.approx(700, rel=0.05)
+
+
+def test_chessboard_of_the_plane_photo_maps_to_millimetres(calibration, photos):
+    corners = find_chessboard(photos[0], PATTERN).reshape(-1, 2)
+    assert calibration.points_to_mm(corners) == pytest.approx(chessboard_points(PATTERN, SQUARE)[:, :2], abs=0.05)
+
+
+def test_save_and_load_round_trip(calibration, tmp_path):
+    path = str(tmp_path / "calibration" / "top.npz")
+    calibration.save(path)
+    loaded = load_calibration(path)
+    assert loaded.image_size == calibration.image_size
+    assert np.array_equal(loaded.homography, calibration.homography)
+    assert np.array_equal(loaded.map1, calibration.map1)
+    assert load_calibration("") is None
+    assert load_calibration(str(tmp_path / "missing.npz")) is None
+
+
+def test_too_few_chessboards_raise(photos):
+    blank = np.full_like(photos[0], 255)
+    with pytest.raises(ValueError):
+        CameraCalibration.from_chessboards(photos[:2] + [blank], photos[0], PATTERN, SQUARE)
+    with pytest.raises(ValueError):
+        CameraCalibration.from_chessboards(photos, blank, PATTERN, SQUARE)
+
+
+def detector(sorted_lines):
+    # NeedleDetector stand-in that processes the frame at full size
+    return types.SimpleNamespace(sorted_lines=np.asarray(sorted_lines, dtype=np.int32).reshape(-1, 4),
+                                 to_frame=lambda points, frame_shape: np.asarray(points, dtype=np.float64))
+
+
+def test_tip_to_mm_uses_the_tip_segment(calibration, photos):
+    corners = find_chessboard(photos[0], PATTERN).reshape(-1, 2)
+    start, tip = corners[0], corners[8]  # along the first row of corners, 8 squares apart
+    start_pixel, tip_pixel = tuple(int(round(value)) for value in start), tuple(int(round(value)) for value in tip)
+    tip_mm, tip_dir = calibration.tip_to_mm(detector([start_pixel + tip_pixel]), photos[0].shape, tip_pixel,
+                                            (1.0, 0.0))
+    assert tip_mm == pytest.approx((8 * SQUARE, 0), abs=0.3)
+    assert tip_dir == pytest.approx((1.0, 0.0), abs=0.01)
+
+
+def test_tip_to_mm_without_a_tip_or_direction(calibration, photos):
+    assert calibration.tip_to_mm(detector([]), photos[0].shape, None, None) == (None, None)
+    assert calibration.tip_to_mm(detector([[400, 300, 400, 300]]), photos[0].shape, (400, 300), (0.0, 0.0)) == \
+        (None, None)
+
+
+def test_frames_of_another_size_raise(calibration, photos):
+    with pytest.raises(ValueError):
+        calibration.check_frame((HEIGHT // 2, WIDTH // 2, 3))
+    with pytest.raises(ValueError):
+        calibration.tip_to_mm(detector([]), (HEIGHT, WIDTH + 1, 3), None, None)
+    with pytest.raises(ValueError):
+        calibration.remap_roi(photos[0][:100], (0, 0, 10, 10))
+
+
+def test_remap_roi_has_the_size_of_the_window(calibration, photos):
+    assert calibration.remap_roi(photos[0], (100, 50, 400, 250)).shape == (200, 300, 3)
@@ -0,0 +1,112 @@
+"""
+Tests of the needle detection in several processes (src/image_pos/detection_pool.py) with the photos in
+src/image_pos/photos
+"""
+import os
+import time
+import cv2
+import numpy as np
+import pytest
+from src.image_pos.detection_pool import DetectionPool
+from src.image_pos.image_proc2 import NeedleDetector
+from src.image_pos.motion_gate import GateSettings, MotionGate
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src")
+CONFIG = os.path.join(SRC, "config.ini")
+
+
+@pytest.fixture(scope="module")
+def frames():
+    """
+    Six different frames of the same size: two photos, upside down and mirrored
+    """
+    photos = [cv2.imread(os.path.join(SRC, "image_pos", "photos", name)) for name in ("bending2.jpg", "bending3.jpg")]
+    return photos + [cv2.flip(photo, 0) for photo in photos] + [cv2.flip(photo, 1) for photo in photos]
+
+
+@pytest.fixture(scope="module")
+def tips(frames):
+    detector = NeedleDetector(CONFIG, flip="yes")
+    return [detector.detect(frame)[0] for frame in frames]
+
+
+def collect(pool, count, timeout=30.0) -> list:
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < count and time.monotonic() < deadline:
+        results.extend(pool.results(timeout=0.1))
+    return results
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_results_come_in_submission_order(frames, tips, workers):
+    pool = DetectionPool(workers, CONFIG, slots=len(frames), flip="yes")
+    try:
+        for frame_nr, frame in enumerate(frames):
+            assert pool.submit(frame, 10.0 + frame_nr, frame_nr)
+        results = collect(pool, len(frames))
+    finally:
+        pool.stop()
+    assert [result.sequence for result in results] == list(range(len(frames)))
+    assert [result.frame_nr for result in results] == list(range(len(frames)))
+    assert [result.frame_time for result in results] == [10.0 + frame_nr for frame_nr in range(len(frames))]
+    assert [result.tip_position for result in results] == tips
+    for result, frame in zip(results, frames):
+        assert np.array_equal(result.frame, frame)
+    assert pool.in_flight == 0
+
+
+def test_slots_are_reused_once_their_result_is_handed_out(frames, tips):
+    pool = DetectionPool(2, CONFIG, slots=2, flip="yes")
+    try:
+        assert pool.submit(frames[0], 0.0, 0) and pool.submit(frames[1], 0.1, 1)
+        assert not pool.ready()
+        # no free slot: the frame is refused
+        assert not pool.submit(frames[2], 0.2, 2)
+        first = collect(pool, 2)
+        assert pool.ready()
+        assert pool.submit(frames[2], 0.2, 2) and pool.submit(frames[3], 0.3, 3)
+        second = collect(pool, 2)
+    finally:
+        pool.stop()
+    # the frames handed out are copies: overwriting their slots did not change them
+    assert np.array_equal(first[0].frame, frames[0]) and np.array_equal(first[1].frame, frames[1])
+    assert [result.tip_position for result in first + second] == tips[:4]
+    assert [result.sequence for result in first + second] == [0, 1, 2, 3]
+
+
+def test_frame_of_another_size_is_refused(frames):
+    pool = DetectionPool(2, CONFIG, flip="yes")
+    try:
+        assert pool.submit(frames[0], 0.0, 0)
+        assert not pool.submit(frames[0][:100], 0.1, 1)
+        assert [result.sequence for result in collect(pool, 1)] == [0]
+    finally:
+        pool.stop()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_reused_frames_are_handed_out_in_frame_order(frames, tips, workers):
+    # frames 0 and 2 of frames, each seen several times by the camera
+    feed = [0, 0, 0, 2, 2, 0, 0, 2]
+    gate = MotionGate(GateSettings())
+    pool = DetectionPool(workers, CONFIG, slots=workers, flip="yes")
+    results = []
+    try:
+        for frame_nr, index in enumerate(feed):
+            frame_time = 0.04 * frame_nr
+            if gate.check(frames[index], frame_time):
+                pool.reuse(frames[index], frame_time, frame_nr)
+                continue
+            while not pool.ready():
+                results.extend(pool.results(timeout=0.1))
+            assert pool.submit(frames[index], frame_time, frame_nr)
+            gate.submitted(frames[index], frame_time)
+        results.extend(collect(pool, len(feed) - len(results)))
+    finally:
+        pool.stop()
+    assert [result.frame_nr for result in results] == list(range(len(feed)))
+    assert [result.reused for result in results] == [False, True, True, False, True, False, True, False]
+    assert [result.tip_position for result in results] == [tips[index] for index in feed]
+    assert all(result.seconds == 0 for result in results if result.reused)
+    assert pool.in_flight == 0
@@ -0,0 +1,75 @@
+"""
+Tests of the adaptive processing rate of a video feed (src/image_pos/frame_scheduler.py) on a virtual clock
+"""
+import pytest
+from src.image_pos.frame_scheduler import FrameScheduler
+
+
+def run_feed(scheduler, clock, fps, seconds, detection_time) -> None:
+    """
+    Grabs frames at fps for seconds and processes every due frame, which takes detection_time
+    """
+    for _ in range(int(fps * seconds)):
+        if scheduler.due():
+            scheduler.take()
+            scheduler.finished(detection_time)
+        clock.sleep(1 / fps)
+
+
+def test_rate_is_capped_at_max_rate(clock):
+    scheduler = FrameScheduler(10, clock=clock)
+    run_feed(scheduler, clock, 60, 2, 0.01)
+    assert scheduler.rate == 10
+    assert scheduler.achieved_rate == pytest.approx(10, rel=0.1)
+    assert scheduler.processed == pytest.approx(20, abs=1)
+
+
+def test_rate_follows_the_detection_time(clock):
+    scheduler = FrameScheduler(0, workers=2, headroom=0.8, clock=clock)
+    # an unlimited rate starts at one frame per second
+    assert scheduler.rate == 1.0
+    run_feed(scheduler, clock, 100, 3, 0.05)
+    assert scheduler.latency == pytest.approx(0.05)
+    assert scheduler.rate == pytest.approx(0.8 * 2 / 0.05)
+    assert scheduler.achieved_rate == pytest.approx(32, rel=0.15)
+    # slower detections lower the rate, gradually
+    scheduler.finished(0.2)
+    assert 0.8 * 2 / 0.2 < scheduler.rate < 32
+    for _ in range(50):
+        scheduler.finished(0.2)
+    assert scheduler.rate == pytest.approx(0.8 * 2 / 0.2, rel=0.01)
+
+
+def test_frame_due_without_a_free_detector_is_dropped(clock):
+    scheduler = FrameScheduler(10, clock=clock)
+    assert scheduler.due()
+    scheduler.take()
+    assert not scheduler.due()
+    clock.sleep(0.1)
+    assert scheduler.due()
+    scheduler.drop()
+    assert not scheduler.due()
+    assert (scheduler.processed, scheduler.dropped) == (1, 1)
+    assert "1 processed, 1 dropped" in scheduler.summary()
+
+
+def test_frame_refused_by_the_detectors_counts_as_dropped(clock):
+    scheduler = FrameScheduler(10, clock=clock)
+    scheduler.take()
+    clock.sleep(0.1)
+    scheduler.take()
+    scheduler.discard(clock.monotonic())
+    assert (scheduler.processed, scheduler.dropped) == (1, 1)
+
+
+def test_stall_does_not_make_the_next_frame_due_at_once(clock):
+    scheduler = FrameScheduler(10, clock=clock)
+    scheduler.take()
+    # the grabbing stalled for a second: the late frame is due, the one right after it is not
+    clock.sleep(1.0)
+    assert scheduler.due()
+    scheduler.take()
+    clock.sleep(0.05)
+    assert not scheduler.due()
+    clock.sleep(0.05)
+    assert scheduler.due()
@@ -0,0 +1,50 @@
+"""
+Integration test of the camera process (src/image_pos/image_acquisition.py) as started by
+Needle.manual_brachy_therapy, on a video made of the photos in src/image_pos/photos
+"""
+import multiprocessing
+import os
+import cv2
+import numpy as np
+from src.image_pos.image_acquisition import ImageAcquisition
+from src.image_pos.tip_tracker import TipTracker
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src")
+
+
+def write_video(path, frames, fps=25) -> None:
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+
+def test_camera_process_feeds_the_tip_tracker(tmp_path, monkeypatch):
+    photo = cv2.imread(os.path.join(SRC, "image_pos", "photos", "bending3.jpg"))
+    # the needle moves a few pixels per frame, for three seconds
+    video = str(tmp_path / "needle.avi")
+    write_video(video, [np.roll(photo, 2 * frame_nr, axis=1) for frame_nr in range(75)])
+    # the camera process reads config.ini from the working directory, like brachy.py run from src
+    monkeypatch.chdir(SRC)
+    image_acquisition = ImageAcquisition(0, video, "", True)
+    needle_pos_feed = multiprocessing.Queue(maxsize=0)
+    process_1 = multiprocessing.Process(target=image_acquisition.retrieve_current_image, args=(needle_pos_feed, ))
+    process_1.start()
+    tracker = TipTracker()
+    frame_times = []
+    try:
+        while True:
+            tip_position, tip_ori, frame_time = needle_pos_feed.get(timeout=60)
+            if tip_position is None and tip_ori is None:
+                break
+            tracker.update(tip_position, tip_ori, frame_time)
+            frame_times.append(frame_time)
+    finally:
+        process_1.join(timeout=10)
+        if process_1.is_alive():
+            process_1.terminate()
+    assert process_1.exitcode == 0
+    assert len(frame_times) >= 5 and frame_times == sorted(frame_times)
+    assert tracker.accepted >= 5
+    assert tracker.predict() is not None
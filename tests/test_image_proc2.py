@@ -0,0 +1,73 @@
+"""
+Regression tests of the tracking mode and the stage timing of NeedleDetector (src/image_pos/image_proc2.py) on the photos
+in src/image_pos/photos
+"""
+import os
+import cv2
+import numpy as np
+import pytest
+from src.image_pos.image_proc2 import NeedleDetector
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src")
+CONFIG = os.path.join(SRC, "config.ini")
+PHOTOS = ["bending.jpg", "bending2.jpg", "bending3.jpg", "black.jpeg", "festo.jpeg", "white.jpeg"]
+
+
+def distance(point_a, point_b) -> float:
+    return float(np.hypot(point_a[0] - point_b[0], point_a[1] - point_b[1]))
+
+
+@pytest.fixture(scope="module")
+def photos():
+    return {name: cv2.imread(os.path.join(SRC, "image_pos", "photos", name)) for name in PHOTOS}
+
+
+@pytest.mark.parametrize("flip", ["no", "yes"])
+@pytest.mark.parametrize("name", PHOTOS)
+def test_tracking_an_unchanged_frame_keeps_the_tip(photos, name, flip):
+    full_tip = NeedleDetector(CONFIG, flip=flip).detect(photos[name])[0]
+    detector = NeedleDetector(CONFIG, flip=flip, tracking="yes")
+    tips = [detector.detect(photos[name])[0] for _ in range(3)]
+    assert tips[0] == full_tip
+    # HoughLinesP finds slightly other lines in a window, the tracked tip may differ a few pixels once
+    assert distance(tips[1], full_tip) <= detector.settings.track_jump
+    assert tips[2] == tips[1]
+
+
+@pytest.mark.parametrize("name", ["festo.jpeg", "bending2.jpg", "black.jpeg"])
+def test_tracking_a_flipped_frame_gives_the_whole_frame_tip(photos, name):
+    full_tip = NeedleDetector(CONFIG, flip="yes").detect(photos[name])[0]
+    detector = NeedleDetector(CONFIG, flip="yes", tracking="yes")
+    assert [detector.detect(photos[name])[0] for _ in range(3)] == [full_tip] * 3
+
+
+def test_tracking_a_moving_needle_stays_in_its_window(photos):
+    detector = NeedleDetector(CONFIG, tracking="yes")
+    full = NeedleDetector(CONFIG)
+    whole_frames = []
+    detect_in = detector._detect_in
+    detector._detect_in = lambda in_image, window: whole_frames.append(window is None) or detect_in(in_image, window)
+    for shift in range(0, 80, 10):
+        frame = np.roll(photos["bending3.jpg"], shift, axis=1)
+        assert distance(detector.detect(frame)[0], full.detect(frame)[0]) <= detector.settings.track_deadband
+    assert sum(whole_frames) == 1
+
+
+def test_tracking_jump_detects_the_whole_frame(photos):
+    detector = NeedleDetector(CONFIG, tracking="yes")
+    detector.detect(photos["bending3.jpg"])
+    tip_pos = detector.last_tip
+    detector.last_tip = (tip_pos[0] - 3 * int(detector.settings.track_jump), tip_pos[1])
+    assert detector.detect(photos["bending3.jpg"])[0] == tip_pos
+
+
+@pytest.mark.parametrize("tracking", ["no", "yes"])
+def test_timing_gives_the_stages_of_the_last_detection(photos, tracking):
+    assert NeedleDetector(CONFIG).stage_times is None
+    detector = NeedleDetector(CONFIG, flip="yes", filtering="yes", tracking=tracking, timing="yes")
+    for _ in range(2):
+        detector.detect(photos["bending3.jpg"])
+        times = detector.stage_times
+        assert set(times) == {"gray", "resize", "flip", "lpf", "canny", "hough", "post", "total"}
+        assert all(seconds > 0 for seconds in times.values())
+        assert sum(seconds for stage, seconds in times.items() if stage != "total") <= times["total"]
@@ -0,0 +1,70 @@
+"""
+Tests of the vectorized inverse kinematics (src/controls/kinematics.py) against solving every move on its own
+"""
+import types
+import numpy as np
+import pytest
+from src.controls.kinematics import DIRPULL, DIRPUSH, MOTORVEC, MovePlanner
+
+
+def gdo(direction, stepsout):
+    # controller.Output needs pygame, the planner only reads these two attributes
+    return types.SimpleNamespace(direction=direction, stepsout=stepsout)
+
+
+def solved_steps(dirmotors, direction, stepsout, sensitivity, nr_of_motors=4):
+    # the original per-move computation: the motor vectors times the steps add up to the displacement
+    matrix = np.array([MOTORVEC[motor] for motor in dirmotors[direction]]).T
+    steps = np.linalg.solve(matrix, np.trunc(np.array(stepsout, dtype=float) * sensitivity))
+    deltas = np.zeros(nr_of_motors, dtype=int)
+    deltas[dirmotors[direction]] = np.trunc(np.abs(steps) + 1e-9)
+    return deltas
+
+
+STEPSOUTS = [(0, 20), (13, 7), (-9, 31), (40, -40), (3, 3), (0, 0), (-17, -5)]
+
+
+@pytest.mark.parametrize("sensitivity", [0.5, 1.0, 0.37])
+def test_two_motor_directions_match_a_linear_solve(sensitivity):
+    planner = MovePlanner(sensitivity)
+    gdos = [gdo(direction, stepsout) for direction in range(0, 8, 2) for stepsout in STEPSOUTS]
+    push, pull, valid = planner.candidates(gdos)
+    assert valid.all()
+    for move, item in enumerate(gdos):
+        expected_push = solved_steps(DIRPUSH, item.direction, item.stepsout, sensitivity)
+        expected_pull = solved_steps(DIRPULL, item.direction, item.stepsout, sensitivity)
+        assert push[move].tolist() == expected_push.tolist()
+        assert pull[move].tolist() == (-expected_pull).tolist()
+
+
+def test_single_motor_directions_project_on_the_motor_vector():
+    push, pull, _ = MovePlanner(1.0).candidates([gdo(1, (10, 10)), gdo(3, (10, -4))])
+    assert push.tolist() == [[0, 0, 10, 0], [0, 7, 0, 0]]
+    assert pull.tolist() == [[-10, 0, 0, 0], [0, 0, 0, -7]]
+
+
+def test_gdos_without_a_needle_direction_are_not_valid():
+    push, pull, valid = MovePlanner(1.0).candidates([gdo(-1, (5, 5)), gdo(100, (5, 5)), gdo(201, (5, 5))])
+    assert not valid.any()
+    assert not push.any() and not pull.any()
+
+
+def test_plan_pushes_within_the_limits():
+    assert MovePlanner(1.0).plan(gdo(0, (0, 20)), [200, 200, 200, 200]) == [0, 0, 10, 10]
+
+
+def test_plan_pulls_when_pushing_exceeds_the_limits():
+    assert MovePlanner(1.0).plan(gdo(0, (0, 20)), [200, 200, 395, 200]) == [-10, -10, 0, 0]
+
+
+def test_plan_refuses_when_neither_fits():
+    assert MovePlanner(1.0).plan(gdo(0, (0, 20)), [5, 200, 395, 200]) is None
+
+
+def test_plan_batch_follows_the_positions_of_the_previous_moves():
+    planner = MovePlanner(1.0)
+    gdos = [gdo(0, (0, 20))] * 3
+    deltas, feasible = planner.plan_batch(gdos, [200, 200, 375, 200])
+    assert feasible.all()
+    assert deltas.tolist() == [[0, 0, 10, 10], [0, 0, 10, 10], [-10, -10, 0, 0]]
+    assert planner.within_limits([200, 200, 375, 200], deltas).all()
@@ -0,0 +1,57 @@
+"""
+Tests of the vectorized post-processing of Hough line segments (src/image_pos/line_processing.py)
+"""
+import numpy as np
+import pytest
+from src.image_pos.line_processing import as_segments, merge_segments, orientations, sort_segments, \
+    tip_from_segments
+
+
+def segments(*rows):
+    return np.array(rows, dtype=np.int32).reshape(-1, 4)
+
+
+@pytest.mark.parametrize("lines, count", [(None, 0), (np.zeros((3, 1, 4)), 3), ([[1, 2, 3, 4]], 1)])
+def test_as_segments_shapes(lines, count):
+    result = as_segments(lines)
+    assert result.shape == (count, 4) and result.dtype == np.int32
+
+
+def test_sort_segments_by_x1():
+    assert sort_segments(segments([5, 0, 9, 0], [1, 0, 3, 0], [3, 0, 4, 0]))[:, 0].tolist() == [1, 3, 5]
+
+
+def test_orientations_are_unit_vectors_and_zero_for_points():
+    result = orientations(segments([0, 0, 3, 4], [2, 2, 2, 2]))
+    assert result.tolist() == [[0.6, 0.8], [0.0, 0.0]]
+
+
+def test_collinear_pieces_are_merged():
+    pieces = segments([0, 0, 40, 20], [44, 22, 80, 40], [120, 60, 100, 50])
+    merged = merge_segments(pieces, angle_tolerance=0.05, distance_tolerance=2, max_gap=5)
+    # the last piece is reversed and about 22 pixels from the others
+    assert sorted(merged.tolist()) == [[0, 0, 80, 40], [100, 50, 120, 60]]
+    merged = merge_segments(pieces, angle_tolerance=0.05, distance_tolerance=2, max_gap=25)
+    assert merged.tolist() == [[0, 0, 120, 60]]
+
+
+def test_overlapping_pieces_give_the_outer_endpoints():
+    merged = merge_segments(segments([0, 10, 50, 10], [20, 10, 30, 10], [40, 11, 90, 11]),
+                            angle_tolerance=0.05, distance_tolerance=2, max_gap=0)
+    assert merged.tolist() == [[0, 10, 90, 11]]
+
+
+def test_parallel_and_crossing_lines_stay_apart():
+    pieces = segments([0, 0, 100, 0], [0, 20, 100, 20], [50, -50, 50, 50])
+    merged = merge_segments(pieces, angle_tolerance=0.05, distance_tolerance=2, max_gap=10)
+    assert sorted(merged.tolist()) == [[0, 0, 100, 0], [0, 20, 100, 20], [50, 50, 50, -50]]
+
+
+def test_tip_is_the_furthest_right_end():
+    tip_pos, tip_dir = tip_from_segments(segments([0, 0, 60, 0], [10, 10, 70, 90], [30, 0, 70, 30]))
+    assert tip_pos == (70, 30)
+    assert tip_dir == pytest.approx((0.8, 0.6))
+
+
+def test_no_segments_have_no_tip():
+    assert tip_from_segments(as_segments(None)) == (None, None)
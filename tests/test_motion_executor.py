@@ -0,0 +1,92 @@
+"""
+Tests of the background execution of needle moves (src/controls/motion_executor.py)
+"""
+import threading
+import pytest
+from src.controls.motion_executor import MotionCommand, MotionExecutor
+
+
+class CountingMotor:
+    def __init__(self, count=200) -> None:
+        self.count = count
+
+    def get_count(self) -> int:
+        return self.count
+
+
+class RecordingScheduler:
+    """
+    Scheduler double that does every move at once, or half of it when blocking is set and the move is cancelled
+    """
+
+    def __init__(self, blocking=False) -> None:
+        self.motors = [CountingMotor() for _ in range(4)]
+        self.moves = []
+        self.blocking = blocking
+        self.started = threading.Event()
+
+    def move(self, deltas, cancel=None) -> list:
+        self.moves.append(list(deltas))
+        self.started.set()
+        done = list(deltas)
+        if self.blocking:
+            assert cancel.wait(timeout=5)
+            done = [delta // 2 for delta in deltas]
+        for motor, step in zip(self.motors, done):
+            motor.count += step
+        return done
+
+
+@pytest.fixture
+def executor():
+    executor = MotionExecutor(RecordingScheduler())
+    executor.start()
+    yield executor
+    executor.stop()
+
+
+def test_commands_are_executed_in_the_background(executor):
+    executor.submit(lambda: [10, 0, -10, 0], "first")
+    assert executor.wait_idle(timeout=5)
+    assert executor.scheduler.moves == [[10, 0, -10, 0]]
+
+
+def test_impossible_plan_does_not_move(executor):
+    executor.submit(lambda: None, "impossible")
+    assert executor.wait_idle(timeout=5)
+    assert executor.scheduler.moves == []
+
+
+def test_failing_plan_keeps_the_executor_running(executor):
+    def failing():
+        raise RuntimeError("motor not connected")
+
+    executor.submit(failing, "failing")
+    assert executor.wait_idle(timeout=5)
+    executor.submit(lambda: [1, 2, 3, 4], "later")
+    assert executor.wait_idle(timeout=5)
+    assert executor.scheduler.moves == [[1, 2, 3, 4]]
+    assert not executor.busy
+
+
+@pytest.mark.parametrize("merge, second_move", [(False, [0, 10, 0, 0]), (True, [50, 10, 0, -20])])
+def test_preempted_steps_are_dropped_or_merged(merge, second_move):
+    scheduler = RecordingScheduler(blocking=True)
+    executor = MotionExecutor(scheduler, merge=merge)
+    executor.start()
+    try:
+        executor.submit(lambda: [100, 0, 0, -40], "first")
+        assert scheduler.started.wait(timeout=5)
+        scheduler.blocking = False
+        executor.submit(lambda: [0, 10, 0, 0], "second")
+        assert executor.wait_idle(timeout=5)
+    finally:
+        executor.stop()
+    assert scheduler.moves == [[100, 0, 0, -40], second_move]
+
+
+def test_merged_move_beyond_the_limits_drops_the_leftover():
+    executor = MotionExecutor(RecordingScheduler(), merge=True)
+    executor._leftover = [150, 0, 0, 0]
+    assert executor._next_deltas(MotionCommand(lambda: [100, 0, 0, 0])) == [100, 0, 0, 0]
+    assert executor._leftover is None
@@ -0,0 +1,78 @@
+"""
+Tests of the check whether a frame changed since the last frame sent to detection (src/image_pos/motion_gate.py)
+"""
+import types
+import numpy as np
+import pytest
+from src.image_pos.motion_gate import GateSettings, MotionGate
+
+TIP = (120, 40)
+
+
+@pytest.fixture
+def frame():
+    frame = np.full((240, 320, 3), 90, np.uint8)
+    frame[100:110, 20:200] = 220  # the needle
+    return frame
+
+
+@pytest.fixture
+def moved():
+    # like the multiprocessing.Value of ImageAcquisition, no move yet
+    return types.SimpleNamespace(value=float("-inf"))
+
+
+def test_unchanged_frame_reuses_the_reference_frame(frame, moved):
+    gate = MotionGate(GateSettings(), moved)
+    assert not gate.check(frame, 0.0)
+    gate.submitted(frame, 0.0)
+    noisy = frame.astype(np.int16) + np.random.default_rng(0).integers(-4, 5, frame.shape)
+    # also while the detection of the reference frame is still running
+    assert gate.check(noisy.astype(np.uint8), 0.1)
+    gate.detected(0.0, TIP)
+    assert gate.check(frame, 0.2)
+    assert (gate.detections, gate.reuses) == (1, 2)
+
+
+def test_changed_frame_is_detected_again(frame, moved):
+    gate = MotionGate(GateSettings(), moved)
+    gate.submitted(frame, 0.0)
+    bent = frame.copy()
+    bent[100:110, 200:260] = 220  # the needle moved further
+    assert not gate.check(bent, 0.1)
+    # the changed frame is the reference of the next frames, before its detection is done
+    gate.submitted(bent, 0.1)
+    assert gate.check(bent, 0.2)
+    assert not gate.check(frame, 0.2)
+
+
+def test_motor_move_invalidates_the_reference_frame(frame, moved):
+    gate = MotionGate(GateSettings({"gate_settle": "0.5"}), moved)
+    gate.submitted(frame, 0.0)
+    gate.detected(0.0, TIP)
+    moved.value = 1.0
+    # the frame did not change, but it was taken during the move or less than gate_settle seconds after
+    assert not gate.check(frame, 0.9)
+    assert not gate.check(frame, 1.4)
+    assert gate.check(frame, 1.6)
+
+
+def test_old_reference_or_missing_tip_is_not_reused(frame, moved):
+    gate = MotionGate(GateSettings({"gate_refresh": "5"}), moved)
+    gate.submitted(frame, 0.0)
+    gate.detected(0.0, TIP)
+    assert not gate.check(frame, 5.1)
+    gate.submitted(frame, 6.0)
+    gate.detected(6.0, None)
+    assert not gate.check(frame, 6.1)
+    # the detection of an older frame does not change the reference
+    gate.submitted(frame, 7.0)
+    gate.detected(6.5, None)
+    assert gate.check(frame, 7.1)
+
+
+def test_threshold_zero_disables_the_gate(frame):
+    gate = MotionGate(GateSettings({"gate_threshold": "0"}))
+    gate.submitted(frame, 0.0)
+    gate.detected(0.0, TIP)
+    assert not gate.check(frame, 0.1)
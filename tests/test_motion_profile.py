@@ -0,0 +1,65 @@
+"""
+Tests of the acceleration profiles (src/controls/motion_profile.py)
+"""
+import configparser
+import pytest
+from src.controls.motion_profile import MotionProfile, SCURVE, TRAPEZOID, profile_from_config, ramp_rate
+
+
+@pytest.mark.parametrize("shape", [TRAPEZOID, SCURVE])
+def test_ramp_rate_goes_from_start_to_peak(shape):
+    rates = [ramp_rate(ramp_pos, 100, 100.0, 400.0, shape) for ramp_pos in range(101)]
+    assert rates[0] == pytest.approx(100.0)
+    assert rates[-1] == pytest.approx(400.0)
+    assert all(earlier <= later for earlier, later in zip(rates, rates[1:]))
+
+
+def test_trapezoid_ramp_has_constant_acceleration():
+    # v^2 = v0^2 + 2 a s
+    assert ramp_rate(50, 100, 100.0, 400.0, TRAPEZOID) ** 2 == pytest.approx((100 ** 2 + 400 ** 2) / 2)
+
+
+def test_ramp_of_a_long_move_reaches_max_rate():
+    profile = MotionProfile(100, 400, 2000)
+    assert profile.ramp(1000) == (400, 38)  # (400^2 - 100^2) / (2 * 2000) = 37.5
+
+
+def test_short_move_ramps_for_half_of_the_move():
+    peak_rate, ramp_steps = MotionProfile(100, 400, 2000).ramp(20)
+    assert ramp_steps == 10
+    assert peak_rate == pytest.approx((100 ** 2 + 2 * 2000 * 10) ** 0.5)
+
+
+def test_no_acceleration_keeps_the_start_rate():
+    profile = MotionProfile(50, 400, 0)
+    assert profile.ramp(1000) == (50, 0)
+    assert profile.duration(100) == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize("shape", [TRAPEZOID, SCURVE])
+def test_intervals_are_symmetric_and_faster_than_without_ramp(shape):
+    profile = MotionProfile(100, 400, 2000, shape)
+    intervals = profile.intervals(200)
+    assert intervals == pytest.approx(intervals[::-1])
+    assert intervals[0] == pytest.approx(1 / 100)
+    assert min(intervals) == pytest.approx(1 / 400)
+    assert profile.duration(-200) == pytest.approx(sum(intervals))
+    assert profile.duration(200) < MotionProfile(100, 100).duration(200)
+
+
+def test_scaled_train_finishes_with_the_lead_motor():
+    profile = MotionProfile(100, 400, 2000)
+    cruise_period, start_period, ramp_steps = profile.scaled_train(50, 200)
+    assert cruise_period == pytest.approx(4 / 400)
+    assert start_period == pytest.approx(4 / 100)
+    assert ramp_steps == round(38 / 4)
+
+
+def test_profile_from_config_overrides_per_motor():
+    config = configparser.ConfigParser()
+    config.read_string("[MOTION]\nstart_rate = 80\nmax_rate = 300\nacceleration = 1000\n"
+                       "[MOTOR2]\nmax_rate = 500\nshape = SCurve\n")
+    default = profile_from_config(config, 0)
+    override = profile_from_config(config, 2)
+    assert (default.start_rate, default.max_rate, default.acceleration, default.shape) == (80, 300, 1000, TRAPEZOID)
+    assert (override.start_rate, override.max_rate, override.acceleration, override.shape) == (80, 500, 1000, SCURVE)
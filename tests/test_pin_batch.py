@@ -0,0 +1,39 @@
+"""
+Tests of the per-port coalescing of pin writes (src/controls/pin_batch.py)
+"""
+import types
+import pyfirmata
+from src.controls.pin_batch import PinBatch
+
+
+def test_pins_of_one_port_go_in_one_message(board, pin):
+    batch = PinBatch()
+    assert batch.write([(pin(number), 1) for number in (2, 4, 6)]) == 1
+    assert board.sp.messages == 1
+    assert [board.sp.levels[number] for number in range(2, 8)] == [1, 0, 1, 0, 1, 0]
+    # the three rising edges happen at the same moment
+    assert len({timestamp for timestamp, _, _ in board.sp.edges}) == 1
+
+
+def test_one_message_per_changed_port(board, pin):
+    batch = PinBatch()
+    assert batch.write([(pin(6), 1), (pin(8), 1), (pin(4), 1)]) == 2
+    assert batch.write([(pin(6), 0), (pin(8), 1)]) == 1
+    assert batch.messages_sent == 3
+    assert board.sp.messages == 3
+    assert (board.sp.levels[6], board.sp.levels[8], board.sp.levels[4]) == (0, 1, 1)
+
+
+def test_unchanged_pins_send_nothing(board, pin):
+    batch = PinBatch()
+    batch.write([(pin(6), 1)])
+    assert batch.write([(pin(6), 1)]) == 0
+    assert board.sp.messages == 1
+
+
+def test_pins_that_are_no_outputs_are_written_directly(board, pin):
+    written = []
+    input_pin = types.SimpleNamespace(mode=pyfirmata.INPUT, port=None, write=written.append)
+    batch = PinBatch()
+    assert batch.write([(input_pin, 1), (pin(6), 1)]) == 1
+    assert written == [1]
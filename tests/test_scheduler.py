@@ -0,0 +1,76 @@
+"""
+Tests of the Bresenham planner and the StepScheduler (src/controls/scheduler.py) on emulated Firmata ports
+"""
+import pytest
+from src.controls.motion_profile import MotionProfile
+from src.controls.scheduler import StepScheduler, plan_ticks
+from src.controls.step_train import StepTrain
+from src.controls.stepper_motor import MOTOR_PINS, Steppermotor
+
+
+@pytest.mark.parametrize("deltas", [[10, 3], [7, -7, 0, 2], [-5, 13, 1, 12], [0, 0], [400, 1, 399, 200]])
+def test_plan_ticks_steps_every_motor_exactly(deltas):
+    ticks = plan_ticks(deltas)
+    assert len(ticks) == max(abs(delta) for delta in deltas)
+    for motor_i, delta in enumerate(deltas):
+        assert sum(motor_i in tick for tick in ticks) == abs(delta)
+
+
+def test_plan_ticks_spreads_the_steps_evenly():
+    ticks = plan_ticks([12, 4])
+    positions = [tick_i for tick_i, tick in enumerate(ticks) if 1 in tick]
+    assert [second - first for first, second in zip(positions, positions[1:])] == [3, 3, 3]
+
+
+@pytest.fixture
+def motors(pin, clock):
+    return [Steppermotor(pin(dirpin), pin(movpin), 200, index, MotionProfile(100, 400, 2000), clock)
+            for index, (dirpin, movpin) in enumerate(MOTOR_PINS)]
+
+
+def test_move_steps_all_motors_together(board, motors, clock):
+    scheduler = StepScheduler(motors, clock=clock)
+    done = scheduler.move([100, -50, 0, 25])
+    assert done == [100, -50, 0, 25]
+    assert [motor.get_count() for motor in motors] == [300, 150, 200, 225]
+    for (dirpin, movpin), delta in zip(MOTOR_PINS, done):
+        assert board.sp.step_count(movpin) == abs(delta)
+    assert board.sp.levels[7] == 1 and board.sp.levels[5] == 0
+    # the ticks take as long as the longest move, not the sum of the moves
+    assert clock.monotonic() == pytest.approx(scheduler.duration([100, -50, 0, 25]))
+
+
+def test_move_with_step_trains_lets_the_board_pulse(sysex_board, motors, clock):
+    step_train = StepTrain(sysex_board, clock=clock)
+    for motor in motors:
+        assert motor.attach_step_train(step_train)
+    scheduler = StepScheduler(motors, step_train, clock=clock)
+    done = scheduler.move([40, 0, -10, 20])
+    assert done == [40, 0, -10, 20]
+    assert [motor.get_count() for motor in motors] == [240, 200, 190, 220]
+    assert sysex_board.sp.step_count(6) == 40 and sysex_board.sp.step_count(8) == 20
+    assert step_train.messages_sent == 4 + 3
+    # the slower trains are stretched, so all motors finish together
+    last_steps = [max(timestamp for timestamp, pin, level in sysex_board.sp.edges if pin == movpin and level == 1)
+                  for movpin in (6, 2, 8)]
+    assert max(last_steps) - min(last_steps) < scheduler.duration([40, 0, -10, 20]) / 10
+
+
+def test_move_sends_one_message_per_port_and_edge(board, motors, clock):
+    scheduler = StepScheduler(motors, clock=clock)
+    messages = board.sp.messages
+    scheduler.move([10, 10, 10, 0])
+    # a direction message for port 0, then a rising and a falling edge message of port 0 per tick
+    assert board.sp.messages - messages == 1 + 2 * 10
+
+
+def test_cancelled_move_stops_at_a_step_boundary(motors, clock):
+    class Cancel:
+        def is_set(self):
+            return clock.monotonic() >= 0.2
+
+    scheduler = StepScheduler(motors, clock=clock)
+    done = scheduler.move([200, 0, 0, -100], cancel=Cancel())
+    assert 0 < done[0] < 200
+    assert abs(done[3]) in (done[0] // 2, done[0] // 2 + 1)
+    assert [motor.get_count() for motor in motors] == [200 + done[0], 200, 200, 200 + done[3]]
@@ -0,0 +1,67 @@
+"""
+Tests of the session recording and its seek by moment (src/image_pos/session_recording.py)
+"""
+import numpy as np
+import pytest
+from src.image_pos.session_recording import SessionReader, SessionRecorder, is_session, session_paths
+
+
+def record(path, times, shape=(8, 8, 3)):
+    recorder = SessionRecorder(path, queue_size=len(times) + 1)
+    recorder.start()
+    for frame_nr, frame_time in enumerate(times):
+        recorder.submit(np.full(shape, frame_nr % 256, dtype=np.uint8), float(frame_time), frame_nr)
+    recorder.stop()
+    assert (recorder.recorded, recorder.dropped) == (len(times), 0)
+
+
+def test_session_paths_with_and_without_extension():
+    assert session_paths("run/session.idx") == ("run/session.mjpg", "run/session.idx")
+    assert session_paths("run/session") == ("run/session.mjpg", "run/session.idx")
+
+
+def test_frames_round_trip(tmp_path):
+    path = str(tmp_path / "session")
+    record(path, [1.0, 1.04, 1.08], shape=(16, 24, 3))
+    assert is_session(path + ".mjpg")
+    with SessionReader(path) as reader:
+        assert len(reader) == 3
+        frame, frame_time, frame_nr = reader.frame(2)
+        assert frame.shape == (16, 24, 3) and abs(int(frame.mean()) - 2) <= 1
+        assert (frame_time, frame_nr) == (1.08, 2)
+        assert [frame_nr for _, _, frame_nr in reader.frames(1)] == [1, 2]
+
+
+def test_other_file_is_not_a_session(tmp_path):
+    path = str(tmp_path / "session")
+    for part in session_paths(path):
+        with open(part, "wb") as file:
+            file.write(b"not a recording")
+    with pytest.raises(ValueError):
+        SessionReader(path)
+
+
+RNG = np.random.default_rng(1)
+
+
+@pytest.mark.parametrize("times", [
+    np.cumsum(RNG.uniform(0.02, 0.05, 2000)),               # irregular frame rate
+    np.r_[np.arange(100) * 0.03, 1000 + np.arange(100) * 0.03],  # long pause between two runs
+    np.array([1.0, 1.0, 1.0, 2.0]),                         # frames with the same time
+    np.array([5.0]),
+])
+def test_index_at_is_the_last_frame_at_or_before_the_moment(tmp_path, times):
+    path = str(tmp_path / "session")
+    record(path, times, shape=(2, 2, 3))
+    with SessionReader(path) as reader:
+        moments = np.r_[RNG.uniform(times[0] - 1, times[-1] + 1, 500), times]
+        for moment in moments:
+            expected = max(int(np.count_nonzero(times <= moment)) - 1, 0)
+            assert reader.index_at(moment) == expected
+
+
+def test_empty_recording(tmp_path):
+    path = str(tmp_path / "session")
+    record(path, [])
+    with SessionReader(path) as reader:
+        assert len(reader) == 0 and reader.index_at(3.0) == 0
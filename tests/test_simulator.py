@@ -0,0 +1,89 @@
+"""
+Tests of the emulated Firmata firmware (src/controls/simulator.py), driven with raw Firmata bytes
+"""
+import pyfirmata
+import pytest
+from src.controls.motion_profile import TRAPEZOID
+from src.controls.step_train import STEP_TRAIN, STEP_TRAIN_CONFIG, STEP_TRAIN_DONE, STEP_TRAIN_STOP, FORWARD, \
+    encode_step_train, train_duration, unpack_7bit
+
+
+def replies(serial) -> list:
+    """
+    (command, data) of every SysEx message the emulated board sent back
+    """
+    data = serial.read(serial.inWaiting())
+    messages = []
+    while data:
+        end = data.index(pyfirmata.END_SYSEX)
+        messages.append((data[1], list(data[2:end])))
+        data = data[end + 1:]
+    return messages
+
+
+@pytest.fixture
+def step_serial(serial, sysex_board):
+    """
+    The serial port of a board with the step and direction pins of motor 0 configured
+    """
+    sysex_board.send_sysex(STEP_TRAIN_CONFIG, [0, 7, 6])
+    assert replies(serial) == [(STEP_TRAIN_CONFIG, [0, 7, 6])]
+    return serial
+
+
+def test_digital_message_sets_the_output_pins(serial):
+    serial.write(bytearray([pyfirmata.SET_PIN_MODE, 9, pyfirmata.INPUT]))
+    # port 1 (pins 8..15) with pins 8, 9 and 15 high, split in 7 bit bytes
+    serial.write(bytearray([pyfirmata.DIGITAL_MESSAGE | 1, 0b0000011, 0b1]))
+    assert serial.messages == 2
+    assert (serial.levels[8], serial.levels.get(9, 0), serial.levels[15]) == (1, 0, 1)
+
+
+def test_messages_split_over_writes_are_parsed_once_complete(serial):
+    message = bytearray([pyfirmata.DIGITAL_MESSAGE, 0b1000000, 0])
+    serial.write(message[:2])
+    assert serial.messages == 0
+    serial.write(message[2:])
+    assert serial.messages == 1 and serial.levels[6] == 1
+
+
+def test_step_train_round_trip(step_serial, sysex_board, clock):
+    sysex_board.send_sysex(STEP_TRAIN, encode_step_train(0, FORWARD, 120, 0.004, 0.02, 30, TRAPEZOID))
+    assert replies(step_serial) == []
+    clock.sleep(train_duration(120, 0.004, 0.02, 30, TRAPEZOID))
+    done = replies(step_serial)
+    assert [(command, data[0], unpack_7bit(data[1:])) for command, data in done] == [(STEP_TRAIN_DONE, 0, 120)]
+    assert step_serial.step_count(6) == 120
+    assert step_serial.levels[7] == FORWARD
+
+
+def test_new_train_replaces_the_running_one_silently(step_serial, sysex_board, clock):
+    sysex_board.send_sysex(STEP_TRAIN, encode_step_train(0, FORWARD, 1000, 0.01))
+    clock.sleep(1.0)
+    sysex_board.send_sysex(STEP_TRAIN, encode_step_train(0, FORWARD, 50, 0.01))
+    clock.sleep(1.0)
+    done = replies(step_serial)
+    # only the second train is reported, the steps of the first one did happen
+    assert [(command, data[0], unpack_7bit(data[1:])) for command, data in done] == [(STEP_TRAIN_DONE, 0, 50)]
+    assert step_serial.step_count(6) == 100 + 50
+
+
+def test_stop_decelerates_and_reports_the_steps_done(step_serial, sysex_board, clock):
+    sysex_board.send_sysex(STEP_TRAIN, encode_step_train(0, FORWARD, 1000, 0.002, 0.02, 100, TRAPEZOID))
+    clock.sleep(0.5)
+    sysex_board.send_sysex(STEP_TRAIN_STOP, [0])
+    clock.sleep(5.0)
+    (command, data), = replies(step_serial)
+    assert command == STEP_TRAIN_DONE
+    assert 0 < unpack_7bit(data[1:]) < 1000
+    assert step_serial.step_count(6) == unpack_7bit(data[1:])
+
+
+def test_measure_counts_the_steps_and_messages(step_serial, sysex_board, clock):
+    with step_serial.measure("train"):
+        sysex_board.send_sysex(STEP_TRAIN, encode_step_train(0, FORWARD, 100, 0.01))
+        clock.sleep(1.1)
+        replies(step_serial)
+    stats = step_serial.moves[-1]
+    assert (stats.messages, stats.replies, stats.steps) == (1, 1, {6: 100})
+    assert stats.rates[6] == pytest.approx(100.0)
@@ -0,0 +1,82 @@
+"""
+Tests of the memory-mapped state journal (src/controls/state_journal.py)
+"""
+import pytest
+from src.controls.state_journal import StateJournal, STATE_CLEAN, STATE_RUNNING
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal.bin")
+
+
+def test_first_start_has_no_previous_state(path):
+    journal = StateJournal(path)
+    assert journal.open() is None
+    journal.close()
+
+
+def test_clean_shutdown_is_restored(path):
+    journal = StateJournal(path)
+    journal.open()
+    journal.record(counts=[10, 20, 30, 40], festo_pos=12.5)
+    journal.record(init_pos=200)
+    journal.close()
+
+    previous = StateJournal(path).open()
+    assert previous.clean
+    assert (previous.counts, previous.festo_pos, previous.init_pos) == ([10, 20, 30, 40], 12.5, 200)
+
+
+def test_journal_without_close_is_still_running(path):
+    crashed = StateJournal(path)
+    crashed.open()
+    crashed.record(counts=[1, 2, 3, 4])
+    # the process dies here: the mapped page is written, but the journal was never closed
+    previous = StateJournal(path).open()
+    assert previous.valid and previous.state == STATE_RUNNING and not previous.clean
+    assert previous.counts == [1, 2, 3, 4]
+
+
+def test_close_without_clean_needs_homing(path):
+    journal = StateJournal(path)
+    journal.open()
+    journal.close(clean=False)
+    assert not StateJournal(path).open().clean
+
+
+def test_torn_record_has_an_invalid_checksum(path):
+    journal = StateJournal(path)
+    journal.open()
+    journal.record(counts=[100, 100, 100, 100])
+    journal.close()
+    with open(path, "r+b") as file:
+        file.seek(20)  # inside the step counters
+        byte = file.read(1)
+        file.seek(20)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+    reopened = StateJournal(path)
+    previous = reopened.open()
+    assert previous.state == STATE_CLEAN and not previous.valid and not previous.clean
+    reopened.close()
+    # the invalid record is not restored, the new journal starts from zero
+    assert StateJournal(path).open().counts == [0, 0, 0, 0]
+
+
+def test_journal_of_another_size_is_invalid_and_recreated(path):
+    StateJournal(path, nr_of_motors=3).open()
+    journal = StateJournal(path)
+    previous = journal.open()
+    assert not previous.valid
+    journal.close()
+    assert StateJournal(path).open().clean
+
+
+def test_sequence_counts_the_writes(path):
+    journal = StateJournal(path)
+    journal.open()
+    for count in range(5):
+        journal.record(counts=[count] * 4)
+    journal.close()
+    assert StateJournal(path).open().sequence == 1 + 5 + 1
@@ -0,0 +1,66 @@
+"""
+Tests of the compilation of a predefined test into a step program (src/controls/step_program.py), run on the
+emulated board
+"""
+import types
+import pytest
+from src.controls.kinematics import MovePlanner
+from src.controls.motion_profile import MotionProfile
+from src.controls.scheduler import StepScheduler
+from src.controls.step_program import compile_test
+from src.controls.stepper_motor import MOTOR_PINS, Steppermotor
+
+
+def to_gdo(test_x, test_y):
+    # stand-in for Controller.analog_stick_to_dir (which needs pygame): always straight up by 20 steps
+    return types.SimpleNamespace(direction=0, stepsout=(0, 20))
+
+
+def predefined_test(motor_steps, coords, sleep):
+    section = {"number_of_positions": str(len(coords)), "coords": str(coords), "sleep": str(sleep)}
+    for motor_i, steps in enumerate(motor_steps):
+        section["motor{}test".format(motor_i)] = str(steps)
+    return section
+
+
+@pytest.fixture
+def motors(pin, clock):
+    return [Steppermotor(pin(dirpin), pin(movpin), 200, index, MotionProfile(100, 400, 2000), clock)
+            for index, (dirpin, movpin) in enumerate(MOTOR_PINS)]
+
+
+def test_motor_steps_and_needle_move_are_one_move_per_position():
+    test = predefined_test([[0, -20], [0, 0], [0, 100], [0, 0]], [(0, 0), (100, 100)], [1, 2])
+    program = compile_test(test, MovePlanner(1.0), to_gdo, [200, 200, 200, 200], "example")
+    # the needle move is planned from the counters after the motor steps: push motors 2 and 3 by 10 steps
+    assert [step.deltas for step in program.steps] == [[0, 0, 0, 0], [-20, 0, 110, 10]]
+    assert program.final_counts == [180, 200, 310, 210]
+    assert [step.sleep for step in program.steps] == [1, 2]
+    assert program.manual_pauses() == 0
+
+
+def test_steps_beyond_the_limits_are_skipped():
+    test = predefined_test([[-250], [10], [0], [0]], [(0, 0)], [0])
+    program = compile_test(test, MovePlanner(1.0), to_gdo, [200, 200, 200, 200])
+    assert program.steps[0].deltas == [0, 10, 0, 0]
+    assert program.manual_pauses() == 1
+
+
+def test_coordinate_out_of_reach_is_skipped():
+    test = predefined_test([[0], [0], [0], [0]], [(100, 100)], [1])
+    program = compile_test(test, MovePlanner(1.0), to_gdo, [5, 200, 395, 200])
+    assert program.steps[0].deltas == [0, 0, 0, 0]
+    assert program.final_counts == [5, 200, 395, 200]
+
+
+def test_program_runs_in_its_estimated_duration(board, motors, clock):
+    test = predefined_test([[0, -20, 0], [0, 0, 40], [0, 100, 50], [0, 0, 50]], [(0, 0), (100, 100), (0, 0)],
+                        [0.5, 1, 0.25])
+    program = compile_test(test, MovePlanner(1.0), to_gdo, [motor.get_count() for motor in motors])
+    scheduler = StepScheduler(motors, clock=clock)
+    # a dry run only plans: nothing was sent to the board yet
+    assert board.sp.messages == 0
+    estimate = program.duration(scheduler)
+    program.run(scheduler)
+    assert [motor.get_count() for motor in motors] == program.final_counts
+    assert clock.monotonic() == pytest.approx(estimate)
@@ -0,0 +1,79 @@
+"""
+Tests of the step-train protocol (src/controls/step_train.py) against the emulated board of simulator.py
+"""
+import pytest
+from src.controls.motion_profile import SCURVE, TRAPEZOID
+from src.controls.step_train import StepTrain, decode_step_train, encode_step_train, pack_7bit, train_duration, \
+    unpack_7bit, FORWARD
+
+
+@pytest.fixture
+def step_train(sysex_board, clock):
+    step_train = StepTrain(sysex_board, clock=clock)
+    assert step_train.configure(0, 7, 6)
+    assert step_train.configure(1, 5, 4)
+    return step_train
+
+
+@pytest.mark.parametrize("value, nr_of_bytes", [(0, 1), (127, 1), (128, 2), (2 ** 21 - 1, 3), (123456789, 4)])
+def test_pack_7bit_round_trip(value, nr_of_bytes):
+    data = pack_7bit(value, nr_of_bytes)
+    assert len(data) == nr_of_bytes
+    assert all(0 <= byte < 128 for byte in data)
+    assert unpack_7bit(data) == value
+
+
+def test_pack_7bit_rejects_values_that_do_not_fit():
+    with pytest.raises(ValueError):
+        pack_7bit(128, 1)
+    with pytest.raises(ValueError):
+        pack_7bit(-1, 2)
+
+
+def test_encode_decode_round_trip():
+    payload = encode_step_train(3, FORWARD, 1500, 0.0025, 0.02, 120, SCURVE)
+    assert len(payload) == 17
+    assert all(0 <= byte < 128 for byte in payload)
+    assert decode_step_train(payload) == (3, FORWARD, 1500, 0.0025, 0.02, 120, SCURVE)
+
+
+def test_train_duration_without_ramp():
+    assert train_duration(100, 0.01) == pytest.approx(1.0)
+
+
+def test_run_reports_all_steps_and_pulses_the_step_pin(step_train, serial, clock):
+    assert step_train.run(0, FORWARD, 200, 0.005, 0.02, 50, TRAPEZOID) == 200
+    assert serial.step_count(6) == 200
+    assert serial.levels[7] == FORWARD
+    assert clock.monotonic() == pytest.approx(train_duration(200, 0.005, 0.02, 50, TRAPEZOID), abs=0.01)
+
+
+def test_concurrent_trains_finish_independently(step_train, serial):
+    step_train.start(0, FORWARD, 100, 0.01)
+    step_train.start(1, FORWARD, 10, 0.01)
+    assert step_train.wait([0, 1]) == {0: 100, 1: 10}
+    assert serial.step_count(6) == 100
+    assert serial.step_count(4) == 10
+    assert step_train.messages_sent == 4
+
+
+def test_cancelled_train_reports_the_steps_done(step_train, serial, clock):
+    class Cancel:
+        def is_set(self):
+            return clock.monotonic() >= 0.5
+
+    step_train.start(0, FORWARD, 1000, 0.01)
+    done = step_train.wait([0], Cancel())
+    assert 40 < done[0] < 1000
+    assert serial.step_count(6) == done[0]
+    assert not step_train.lost
+
+
+def test_unconfigured_board_does_not_acknowledge(mute_board, clock):
+    assert not StepTrain(mute_board, clock=clock).configure(0, 7, 6, timeout=0.05)
+
+
+def test_unreported_train_counts_no_steps_and_needs_homing(mute_board, clock):
+    step_train = StepTrain(mute_board, clock=clock)
+    assert step_train.run(2, FORWARD, 100, 0.001) == 0
+    assert step_train.lost == {2}
@@ -0,0 +1,49 @@
+"""
+Tests of the pairing of the top and front camera tips (src/image_pos/stereo.py)
+"""
+import math
+import pytest
+from src.image_pos.stereo import StereoPairer, StereoSettings, combine
+
+
+def test_combine_maps_the_front_view_and_averages_x():
+    settings = StereoSettings({"front_scale": "2", "front_offset_x": "10", "front_offset_z": "-5"})
+    position, direction = combine(((110, 40), (1.0, 0.0)), ((50, 30), (1.0, 0.0)), settings)
+    assert position == pytest.approx((110, 40, 55))
+    assert direction == pytest.approx((1.0, 0.0, 0.0))
+
+
+def test_combine_takes_the_slopes_of_both_views():
+    top_ori = (1 / math.sqrt(2), 1 / math.sqrt(2))   # dy/dx = 1
+    front_ori = (-0.8, -0.6)                          # dz/dx = 0.75, pointing the other way
+    direction = combine(((0, 0), top_ori), ((0, 0), front_ori), StereoSettings())[1]
+    assert direction == pytest.approx(tuple(value / math.sqrt(1 + 1 + 0.75 ** 2) for value in (1, 1, 0.75)))
+
+
+def test_needle_along_the_front_view_keeps_the_top_direction():
+    direction = combine(((0, 0), (0.0, 1.0)), ((0, 0), (0.0, 1.0)), StereoSettings())[1]
+    assert direction == (0.0, 1.0, 0.0)
+
+
+def test_measurements_are_paired_with_the_nearest_in_time():
+    pairer = StereoPairer(StereoSettings({"max_pair_interval": "0.05"}))
+    assert pairer.add("front", (10, 20), (1.0, 0.0), 0.00) is None
+    assert pairer.add("front", (12, 30), (1.0, 0.0), 0.04) is None
+    tip_pos, tip_ori, frame_time = pairer.add("top", (14, 5), (1.0, 0.0), 0.05)
+    assert tip_pos == pytest.approx((13, 5, 30)) and frame_time == 0.05
+    # a later front frame gives another estimate with the same top frame
+    assert pairer.add("front", (16, 40), (1.0, 0.0), 0.07)[0] == pytest.approx((15, 5, 40))
+    assert (pairer.paired, pairer.unpaired) == (2, 2)
+
+
+def test_top_without_front_is_passed_on_in_2d():
+    pairer = StereoPairer()
+    assert pairer.add("top", (14, 5), (1.0, 0.0), 1.0) == ((14, 5), (1.0, 0.0), 1.0)
+    assert pairer.add("front", (1, 2), (1.0, 0.0), 2.0) is None
+
+
+def test_older_measurements_are_not_passed_on():
+    pairer = StereoPairer()
+    pairer.add("top", (14, 5), (1.0, 0.0), 1.0)
+    assert pairer.add("front", (14, 5), (1.0, 0.0), 0.95) is None
+    assert pairer.add("top", (14, 5), (1.0, 0.0), 0.9) is None
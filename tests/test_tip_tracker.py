@@ -0,0 +1,81 @@
+"""
+Tests of the Kalman filter of the tip pose (src/image_pos/tip_tracker.py)
+"""
+import configparser
+import math
+import pytest
+from src.controls.simulator import VirtualClock
+from src.image_pos.tip_tracker import TipTracker, TrackerSettings
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+def test_no_estimate_before_a_measurement(clock):
+    tracker = TipTracker(clock=clock)
+    assert not tracker.initialized and tracker.predict() is None
+
+
+def test_constant_velocity_is_followed_and_extrapolated(clock):
+    tracker = TipTracker(clock=clock)
+    for frame in range(30):
+        assert tracker.update((100 + 10 * frame, 50), (1.0, 0.0), measured=frame * 0.1)
+    estimate = tracker.predict(at=3.4)
+    assert estimate.tip_pos == pytest.approx((100 + 10 * 34, 50), abs=1.0)
+    assert estimate.velocity == pytest.approx((100, 0), abs=2.0)
+    assert estimate.tip_ori == pytest.approx((1.0, 0.0), abs=1e-3)
+
+
+def test_noise_is_averaged_out(clock):
+    tracker = TipTracker(clock=clock)
+    for frame in range(40):
+        tracker.update((200 + (3 if frame % 2 else -3), 80), (0.0, 1.0), measured=frame * 0.1)
+    estimate = tracker.predict(at=3.9)
+    assert abs(estimate.tip_pos[0] - 200) < 3
+    assert estimate.position_std < TrackerSettings().position_noise
+
+
+def test_outlier_is_rejected_and_a_real_jump_restarts_the_filter(clock):
+    tracker = TipTracker(clock=clock)
+    for frame in range(10):
+        tracker.update((100, 100), (1.0, 0.0), measured=frame * 0.1)
+    assert not tracker.update((400, 100), (1.0, 0.0), measured=1.0)
+    assert tracker.update((100, 100), (1.0, 0.0), measured=1.1)
+    results = [tracker.update((400, 100), (1.0, 0.0), measured=1.2 + frame * 0.1) for frame in range(4)]
+    assert results == [False, False, False, True]
+    assert tracker.predict(at=1.5).tip_pos == pytest.approx((400, 100))
+
+
+def test_old_measurement_is_rejected(clock):
+    tracker = TipTracker(clock=clock)
+    tracker.update((100, 100), (1.0, 0.0), measured=1.0)
+    assert not tracker.update((101, 100), (1.0, 0.0), measured=0.5)
+
+
+def test_command_moves_the_prediction_while_the_motors_step(clock):
+    settings = TrackerSettings({"motor_gains": "[(0.5, 0, 0), (0, 0.25, 0)]"})
+    tracker = TipTracker(settings, clock=clock)
+    tracker.update((100, 100), (1.0, 0.0), measured=0.0)
+    tracker.command([40, 40], start=1.0, duration=2.0)
+    assert tracker.predict(at=1.0).tip_pos == pytest.approx((100, 100))
+    assert tracker.predict(at=2.0).tip_pos == pytest.approx((110, 105))
+    assert tracker.predict(at=4.0).tip_pos == pytest.approx((120, 110))
+    tracker.finish_command([20, 20], end=2.0)
+    assert tracker.predict(at=4.0).tip_pos == pytest.approx((110, 105))
+
+
+def test_angle_wraps_around(clock):
+    tracker = TipTracker(clock=clock)
+    tracker.update((0, 0), (math.cos(math.radians(179)), math.sin(math.radians(179))), measured=0.0)
+    assert tracker.update((0, 0), (math.cos(math.radians(-179)), math.sin(math.radians(-179))), measured=0.1)
+    assert tracker.predict(at=0.1).tip_ori[0] == pytest.approx(-1.0, abs=1e-3)
+
+
+def test_settings_from_config():
+    config = configparser.ConfigParser()
+    config.read_string("[TRACKER]\nposition_noise = 5\nmotor_gains = [(1, 2, 3)]\n")
+    settings = TrackerSettings.from_config(config)
+    assert settings.position_noise == 5 and settings.motor_gains == [(1.0, 2.0, 3.0)]
+    assert TrackerSettings.from_config(configparser.ConfigParser()).motor_gains == []